@@ -65,6 +65,16 @@ namespace RimTalk.TTS.Data
         // Remove bracketed content during preprocessing
         public bool RemoveBracketsInPreProcess = false;
         
+        // FishAudio local server options (applied to FishAudioTTSClient by FishAudioProvider)
+        public bool FishAudioUseAsyncioServer = false;
+        public bool FishAudioWarmUpOnStart = false;
+        public bool FishAudioUseStdioTransport = false;
+        public int FishAudioServerWorkers = 1;
+        public int FishAudioRequestDeadlineMs = 0;
+        public bool FishAudioAdaptiveLatency = false;
+        public bool FishAudioUseSpoolHandoff = false;
+        public bool FishAudioSplitLongLines = false;
+        
         public string TTSModel = "s1"; // fishaudio-1 (v1.6) or s1 (default)//Deprecated
         public float TTSTemperature = 0.9f; // TTS generation temperature (0.7-1.0)//Deprecated
         public float TTSTopP = 0.9f; // TTS generation top_p (0.7-1.0)//Deprecated
@@ -140,6 +150,16 @@ namespace RimTalk.TTS.Data
             Scribe_Values.Look(ref CustomBaseUrl, "customBaseUrl", "");
             Scribe_Values.Look(ref RemoveBracketsInPreProcess, "removeBracketsInPreProcess", false);
 
+            // FishAudio local server options
+            Scribe_Values.Look(ref FishAudioUseAsyncioServer, "fishAudioUseAsyncioServer", false);
+            Scribe_Values.Look(ref FishAudioWarmUpOnStart, "fishAudioWarmUpOnStart", false);
+            Scribe_Values.Look(ref FishAudioUseStdioTransport, "fishAudioUseStdioTransport", false);
+            Scribe_Values.Look(ref FishAudioServerWorkers, "fishAudioServerWorkers", 1);
+            Scribe_Values.Look(ref FishAudioRequestDeadlineMs, "fishAudioRequestDeadlineMs", 0);
+            Scribe_Values.Look(ref FishAudioAdaptiveLatency, "fishAudioAdaptiveLatency", false);
+            Scribe_Values.Look(ref FishAudioUseSpoolHandoff, "fishAudioUseSpoolHandoff", false);
+            Scribe_Values.Look(ref FishAudioSplitLongLines, "fishAudioSplitLongLines", false);
+
             LoadOldSettings();
         }
 
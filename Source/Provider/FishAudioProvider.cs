@@ -1,5 +1,6 @@
 using System.Threading;
 using System.Threading.Tasks;
+using RimTalk.TTS.Data;
 using RimTalk.TTS.Service;
 using RimTalk.TTS.Service.FishAudioService;
 
@@ -10,14 +11,49 @@ namespace RimTalk.TTS.Provider
     /// </summary>
     public class FishAudioProvider : ITTSProvider
     {
+        private TTSSettings _settings;
+
+        public void SetSettings(TTSSettings settings)
+        {
+            _settings = settings;
+        }
+
         public async Task<byte[]> GenerateSpeechAsync(TTSRequest request, CancellationToken cancellationToken = default)
         {
+            ApplySettings();
+
             // Delegate to existing FishAudio client which accepts parameter list
             return await FishAudioTTSClient.GenerateSpeechAsync(
                 request,
                 cancellationToken);
         }
 
+        /// <summary>
+        /// Queue a line that will be requested soon, so the server renders it into its cache in the meantime
+        /// </summary>
+        public async Task PrefetchAsync(TTSRequest request)
+        {
+            ApplySettings();
+            await FishAudioTTSClient.PrefetchAsync(new[] { request });
+        }
+
+        // Read the server options on every call so settings changes apply without a restart
+        // (server-side options such as the worker count take effect when the server starts)
+        private void ApplySettings()
+        {
+            if (_settings != null)
+            {
+                FishAudioTTSClient.UseAsyncioServer = _settings.FishAudioUseAsyncioServer;
+                FishAudioTTSClient.WarmUpOnStart = _settings.FishAudioWarmUpOnStart;
+                FishAudioTTSClient.UseStdioTransport = _settings.FishAudioUseStdioTransport;
+                FishAudioTTSClient.ServerWorkers = _settings.FishAudioServerWorkers;
+                FishAudioTTSClient.RequestDeadlineMs = _settings.FishAudioRequestDeadlineMs;
+                FishAudioTTSClient.AdaptiveLatency = _settings.FishAudioAdaptiveLatency;
+                FishAudioTTSClient.UseSpoolHandoff = _settings.FishAudioUseSpoolHandoff;
+                FishAudioTTSClient.SplitLongLines = _settings.FishAudioSplitLongLines;
+            }
+        }
+
         public void Shutdown()
         {
             // Delegate to existing shutdown helper
@@ -0,0 +1,352 @@
+using System;
+using System.Collections.Generic;
+using System.IO;
+using System.Net;
+using System.Net.Http;
+using System.Text;
+using System.Threading;
+using System.Threading.Tasks;
+using Verse;
+using RimTalk.Util;
+
+namespace RimTalk.TTS.Service.FishAudioService;
+
+/// <summary>
+/// HttpClient handler that sends requests to the Python server over its stdin/stdout (--transport stdio)
+/// instead of a local TCP port. Requests are multiplexed as length-prefixed frames with a stream ID each,
+/// and responses complete in whatever order the server finishes them. See StdioTransport in fish_audio_tts.py.
+/// </summary>
+internal sealed class FishAudioStdioHandler : HttpMessageHandler
+{
+    // Frame header: payload length (u32), stream ID (u32), frame type (u8), little endian
+    private const int FrameHeaderSize = 9;
+    private const int MaxFrameSize = 64 * 1024 * 1024;
+    private const byte FrameRequest = 1;
+    private const byte FrameCancel = 2;
+    private const byte FrameResponse = 3;
+    private const byte FrameData = 4;
+    private const byte FrameEnd = 5;
+    private const byte FrameStatus = 6;
+    private const byte ResponseMore = 0x01;
+
+    private readonly Stream _input;
+    private readonly Stream _output;
+    private readonly SemaphoreSlim _writeLock = new SemaphoreSlim(1, 1);
+    private readonly Dictionary<uint, PendingRequest> _pending = new Dictionary<uint, PendingRequest>();
+    private int _nextStreamId = 0;
+    private bool _closed = false;
+
+    /// <summary>
+    /// JSON startup messages of the server ("ready", "error"), which it sends on stream 0
+    /// </summary>
+    public event Action<string> StatusReceived;
+
+    private class PendingRequest
+    {
+        public readonly TaskCompletionSource<HttpResponseMessage> Completion = new TaskCompletionSource<HttpResponseMessage>();
+        public HttpRequestMessage Request;
+        public HttpResponseMessage Response;
+        public MemoryStream Body;
+    }
+
+    /// <param name="input">Standard input of the server process</param>
+    /// <param name="output">Standard output of the server process</param>
+    public FishAudioStdioHandler(Stream input, Stream output)
+    {
+        _input = input;
+        _output = output;
+    }
+
+    /// <summary>
+    /// Start reading frames from the server on a background thread
+    /// </summary>
+    public void Start()
+    {
+        var thread = new Thread(ReadFrames) { IsBackground = true, Name = "FishAudio TTS stdio reader" };
+        thread.Start();
+    }
+
+    protected override async Task<HttpResponseMessage> SendAsync(HttpRequestMessage request, CancellationToken cancellationToken)
+    {
+        uint streamId = (uint)Interlocked.Increment(ref _nextStreamId);
+        var pending = new PendingRequest { Request = request };
+        lock (_pending)
+        {
+            if (_closed)
+            {
+                throw new HttpRequestException("FishAudio TTS server closed its output");
+            }
+            _pending[streamId] = pending;
+        }
+
+        try
+        {
+            byte[] body = request.Content != null ? await request.Content.ReadAsByteArrayAsync() : new byte[0];
+            var head = new StringBuilder(request.RequestUri.PathAndQuery);
+            foreach (var header in request.Headers)
+            {
+                head.Append($"\r\n{header.Key}: {string.Join(", ", header.Value)}");
+            }
+            if (request.Content != null)
+            {
+                foreach (var header in request.Content.Headers)
+                {
+                    head.Append($"\r\n{header.Key}: {string.Join(", ", header.Value)}");
+                }
+            }
+            byte[] headBytes = Encoding.UTF8.GetBytes(head.ToString());
+
+            // Method (u8), head length (u16), head, body
+            var payload = new byte[3 + headBytes.Length + body.Length];
+            payload[0] = request.Method == HttpMethod.Get ? (byte)0 : (byte)1;
+            WriteUInt16(payload, 1, headBytes.Length);
+            Buffer.BlockCopy(headBytes, 0, payload, 3, headBytes.Length);
+            Buffer.BlockCopy(body, 0, payload, 3 + headBytes.Length, body.Length);
+            await WriteFrameAsync(streamId, FrameRequest, payload);
+        }
+        catch (Exception ex) when (!(ex is HttpRequestException))
+        {
+            Remove(streamId);
+            throw new HttpRequestException($"Failed to send request to FishAudio TTS server - {ex.Message}", ex);
+        }
+
+        // Cancelling aborts the request on the server too; its late response is discarded
+        using (cancellationToken.Register(() =>
+               {
+                   if (pending.Completion.TrySetCanceled())
+                   {
+                       SendCancel(streamId);
+                   }
+               }))
+        {
+            return await pending.Completion.Task;
+        }
+    }
+
+    private void SendCancel(uint streamId)
+    {
+        WriteFrameAsync(streamId, FrameCancel, new byte[0]).ContinueWith(t =>
+        {
+            if (t.IsFaulted)
+            {
+                Logger.Debug($"FishAudio TTS: Failed to send cancel frame - {t.Exception?.GetBaseException().Message}");
+            }
+        });
+    }
+
+    private async Task WriteFrameAsync(uint streamId, byte frameType, byte[] payload)
+    {
+        var frame = new byte[FrameHeaderSize + payload.Length];
+        WriteUInt32(frame, 0, (uint)payload.Length);
+        WriteUInt32(frame, 4, streamId);
+        frame[8] = frameType;
+        Buffer.BlockCopy(payload, 0, frame, FrameHeaderSize, payload.Length);
+
+        await _writeLock.WaitAsync();
+        try
+        {
+            await _input.WriteAsync(frame, 0, frame.Length);
+            await _input.FlushAsync();
+        }
+        finally
+        {
+            _writeLock.Release();
+        }
+    }
+
+    private void ReadFrames()
+    {
+        var header = new byte[FrameHeaderSize];
+        try
+        {
+            while (ReadExactly(header, header.Length))
+            {
+                int length = (int)ReadUInt32(header, 0);
+                uint streamId = ReadUInt32(header, 4);
+                byte frameType = header[8];
+                if (length < 0 || length > MaxFrameSize)
+                {
+                    Log.Error($"FishAudio TTS: Invalid frame of {length} bytes from server");
+                    break;
+                }
+                var payload = new byte[length];
+                if (!ReadExactly(payload, length))
+                {
+                    break;
+                }
+                HandleFrame(streamId, frameType, payload);
+            }
+        }
+        catch (Exception ex)
+        {
+            Logger.Debug($"FishAudio TTS: Stopped reading from server - {ex.Message}");
+        }
+        Close();
+    }
+
+    private void HandleFrame(uint streamId, byte frameType, byte[] payload)
+    {
+        if (frameType == FrameStatus)
+        {
+            StatusReceived?.Invoke(Encoding.UTF8.GetString(payload));
+            return;
+        }
+
+        PendingRequest pending;
+        lock (_pending)
+        {
+            if (!_pending.TryGetValue(streamId, out pending))
+            {
+                return;
+            }
+        }
+
+        switch (frameType)
+        {
+            case FrameResponse:
+            {
+                // Status (u16), flags (u8), head length (u16), header lines, body
+                int headLength = ReadUInt16(payload, 3);
+                var response = new HttpResponseMessage((HttpStatusCode)ReadUInt16(payload, 0)) { RequestMessage = pending.Request };
+                int bodyOffset = 5 + headLength;
+                var content = new ByteArrayContent(payload, bodyOffset, payload.Length - bodyOffset);
+                string head = Encoding.UTF8.GetString(payload, 5, headLength);
+                foreach (var line in head.Split(new[] { "\r\n" }, StringSplitOptions.RemoveEmptyEntries))
+                {
+                    int colon = line.IndexOf(':');
+                    if (colon <= 0)
+                    {
+                        continue;
+                    }
+                    string name = line.Substring(0, colon).Trim();
+                    string value = line.Substring(colon + 1).Trim();
+                    if (!response.Headers.TryAddWithoutValidation(name, value))
+                    {
+                        content.Headers.TryAddWithoutValidation(name, value);
+                    }
+                }
+                response.Content = content;
+
+                if ((payload[2] & ResponseMore) == 0)
+                {
+                    Remove(streamId);
+                    pending.Completion.TrySetResult(response);
+                }
+                else
+                {
+                    // Streamed response: collect DATA frames until END
+                    pending.Response = response;
+                    pending.Body = new MemoryStream();
+                }
+                break;
+            }
+            case FrameData:
+                pending.Body?.Write(payload, 0, payload.Length);
+                break;
+            case FrameEnd:
+                Remove(streamId);
+                if (pending.Response == null)
+                {
+                    pending.Completion.TrySetException(new HttpRequestException("FishAudio TTS server ended a stream without a response"));
+                }
+                else if (payload.Length > 0)
+                {
+                    pending.Completion.TrySetException(new HttpRequestException($"FishAudio TTS stream aborted - {Encoding.UTF8.GetString(payload)}"));
+                }
+                else
+                {
+                    var content = new ByteArrayContent(pending.Body.ToArray());
+                    foreach (var header in pending.Response.Content.Headers)
+                    {
+                        content.Headers.TryAddWithoutValidation(header.Key, header.Value);
+                    }
+                    pending.Response.Content = content;
+                    pending.Completion.TrySetResult(pending.Response);
+                }
+                break;
+        }
+    }
+
+    private void Remove(uint streamId)
+    {
+        lock (_pending)
+        {
+            _pending.Remove(streamId);
+        }
+    }
+
+    /// <summary>
+    /// Fail every outstanding request; called when the server's output ends
+    /// </summary>
+    private void Close()
+    {
+        List<PendingRequest> pending;
+        lock (_pending)
+        {
+            _closed = true;
+            pending = new List<PendingRequest>(_pending.Values);
+            _pending.Clear();
+        }
+        foreach (var request in pending)
+        {
+            request.Completion.TrySetException(new HttpRequestException("FishAudio TTS server closed its output"));
+        }
+    }
+
+    private bool ReadExactly(byte[] buffer, int count)
+    {
+        int read = 0;
+        while (read < count)
+        {
+            int n = _output.Read(buffer, read, count - read);
+            if (n <= 0)
+            {
+                return false;
+            }
+            read += n;
+        }
+        return true;
+    }
+
+    protected override void Dispose(bool disposing)
+    {
+        if (disposing)
+        {
+            // EOF on its stdin also stops the server
+            try
+            {
+                _input.Dispose();
+            }
+            catch (Exception ex)
+            {
+                Logger.Debug($"FishAudio TTS: Failed to close server input - {ex.Message}");
+            }
+            Close();
+        }
+        base.Dispose(disposing);
+    }
+
+    private static void WriteUInt16(byte[] buffer, int offset, int value)
+    {
+        buffer[offset] = (byte)value;
+        buffer[offset + 1] = (byte)(value >> 8);
+    }
+
+    private static void WriteUInt32(byte[] buffer, int offset, uint value)
+    {
+        buffer[offset] = (byte)value;
+        buffer[offset + 1] = (byte)(value >> 8);
+        buffer[offset + 2] = (byte)(value >> 16);
+        buffer[offset + 3] = (byte)(value >> 24);
+    }
+
+    private static int ReadUInt16(byte[] buffer, int offset)
+    {
+        return buffer[offset] | (buffer[offset + 1] << 8);
+    }
+
+    private static uint ReadUInt32(byte[] buffer, int offset)
+    {
+        return (uint)(buffer[offset] | (buffer[offset + 1] << 8) | (buffer[offset + 2] << 16) | (buffer[offset + 3] << 24));
+    }
+}
@@ -3,6 +3,7 @@ using System.Threading.Tasks;
 using System.Diagnostics;
 using System.Text;
 using System.IO;
+using System.IO.MemoryMappedFiles;
 using System.Net.Http;
 using System.Runtime.Serialization;
 using System.Collections.Generic;
@@ -67,10 +68,82 @@ public static class FishAudioTTSClient
     
     private static Process _serverProcess;
     private static HttpClient _httpClient;
+    private static FishAudioStdioHandler _stdioChannel;
     private static readonly object _lock = new object();
     private static bool _serverStarting = false;
     private const int ServerPort = 5678;
     private static readonly string ServerUrl = $"http://127.0.0.1:{ServerPort}";
+    
+    // Spool handoff: the server leaves finished audio in a memory-mapped file instead of sending it over the socket.
+    // One file per server worker process, so mappings are kept per path.
+    private static readonly Dictionary<string, MemoryMappedFile> _spoolFiles = new Dictionary<string, MemoryMappedFile>();
+    private static readonly Dictionary<string, MemoryMappedViewAccessor> _spoolViews = new Dictionary<string, MemoryMappedViewAccessor>();
+    private static readonly object _spoolLock = new object();
+    private const int MaxSpoolMappings = 16;
+    
+    /// <summary>
+    /// Number of Python worker processes (--workers); more than one spreads request handling across CPU cores.
+    /// FishAudioProvider sets the client options from TTSSettings before each request.
+    /// </summary>
+    public static int ServerWorkers { get; set; } = 1;
+    
+    /// <summary>
+    /// Most workers the server runs with its default limits: each one needs at least one of the
+    /// --max-concurrency (5) upstream slots per API key, so it clamps larger counts (see max_workers)
+    /// </summary>
+    public const int MaxServerWorkers = 5;
+    
+    /// <summary>
+    /// Serve HTTP from the server's event loop with keep-alive connections (--server-mode asyncio)
+    /// instead of one thread per connection
+    /// </summary>
+    public static bool UseAsyncioServer { get; set; } = false;
+    
+    /// <summary>
+    /// Open the connection to the Fish Audio API when the server starts (--warmup), which makes one
+    /// extra upstream call per launch but saves the connection setup on the first line
+    /// </summary>
+    public static bool WarmUpOnStart { get; set; } = false;
+    
+    /// <summary>
+    /// Talk to the Python server over its stdin/stdout instead of a local TCP port.
+    /// Avoids port conflicts and firewall prompts; requests keep the same semantics. Ignores ServerWorkers.
+    /// </summary>
+    public static bool UseStdioTransport { get; set; } = false;
+    
+    /// <summary>
+    /// Read audio from the server's shared spool file instead of receiving it over HTTP.
+    /// The server falls back to a normal response when its spool is full or disabled.
+    /// Not zero-copy: the clip is still copied out of the mapping, since callers take a byte[].
+    /// It only saves the base64 round trip and socket transfer, so it is off by default.
+    /// </summary>
+    public static bool UseSpoolHandoff { get; set; } = false;
+    
+    /// <summary>
+    /// Time budget of a line in milliseconds, 0 for none. Lines the server can no longer
+    /// voice in time are dropped instead of finishing after the conversation has moved on.
+    /// </summary>
+    public static int RequestDeadlineMs { get; set; } = 0;
+    
+    /// <summary>
+    /// Synthesize long lines as sentence segments in parallel and stitch them into one clip.
+    /// Lines at or below the server's segment length are sent in one piece either way.
+    /// </summary>
+    public static bool SplitLongLines { get; set; } = false;
+    
+    /// <summary>
+    /// Let the server switch to Fish Audio's "balanced" latency mode while it is under load, and back to "normal" after
+    /// </summary>
+    public static bool AdaptiveLatency { get; set; } = false;
+    
+    // Set from the server's 503 responses while its circuit breaker refuses calls to the Fish Audio API
+    private static DateTime _upstreamUnavailableUntil = DateTime.MinValue;
+    
+    /// <summary>
+    /// False while the Fish Audio API is failing and the server is refusing calls to it.
+    /// TTSService rejects new lines up front while it is false, before translating them.
+    /// </summary>
+    public static bool IsUpstreamAvailable => DateTime.UtcNow >= _upstreamUnavailableUntil;
 
     /// <summary>
     /// Resolve Python executable path. Prefer bundled virtualenv under the mod, then env override, then system python.
@@ -155,66 +228,6 @@ public static class FishAudioTTSClient
         return "";
     }
     
-    /// <summary>
-    /// Check if required Python dependencies are installed
-    /// </summary>
-    private static async Task<bool> CheckPythonDependenciesAsync(string pythonExe)
-    {
-        try
-        {
-            string checkScript = Path.Combine(Path.GetDirectoryName(PythonScriptPath), "check_dependencies.py");
-            
-            // If check script doesn't exist, skip the check (backward compatibility)
-            if (!File.Exists(checkScript))
-            {
-                Log.Warning("FishAudio TTS: Dependency check script not found, skipping validation");
-                return true;
-            }
-            
-            var processInfo = new ProcessStartInfo
-            {
-                FileName = pythonExe,
-                Arguments = $"\"{checkScript}\"",
-                UseShellExecute = false,
-                RedirectStandardOutput = true,
-                RedirectStandardError = true,
-                CreateNoWindow = true,
-                StandardOutputEncoding = Encoding.UTF8,
-                StandardErrorEncoding = Encoding.UTF8
-            };
-            
-            using (var process = new Process { StartInfo = processInfo })
-            {
-                process.Start();
-                string output = await process.StandardOutput.ReadToEndAsync();
-                string error = await process.StandardError.ReadToEndAsync();
-                
-                bool exited = process.WaitForExit(5000); // 5 second timeout
-                
-                if (!exited)
-                {
-                    Log.Warning("FishAudio TTS: Dependency check timed out");
-                    process.Kill();
-                    return true; // Don't block if check fails
-                }
-                
-                if (process.ExitCode != 0)
-                {
-                    Log.Error($"FishAudio TTS: Dependency check failed:\n{output}\n{error}");
-                    return false;
-                }
-                
-                Log.Message($"FishAudio TTS: Dependencies verified:\n{output}");
-                return true;
-            }
-        }
-        catch (Exception ex)
-        {
-            Log.Warning($"FishAudio TTS: Failed to check dependencies - {ex.Message}");
-            return true; // Don't block on check failure
-        }
-    }
-    
     /// <summary>
     /// Start the Python TTS server if not already running
     /// </summary>
@@ -295,23 +308,23 @@ public static class FishAudioTTSClient
                 return false;
             }
             
-            // Check Python dependencies before starting server
-            if (!await CheckPythonDependenciesAsync(pythonExe))
-            {
-                Log.Error("FishAudio TTS: Python dependencies check failed. Please install: pip install fish-audio-sdk");
-                return false;
-            }
-            
             Log.Message("FishAudio TTS: Starting Python server...");
             
             // Get current process ID to pass to Python server
             int currentProcessId = Process.GetCurrentProcess().Id;
             
+            bool useStdio = UseStdioTransport;
+            string warmup = WarmUpOnStart ? " --warmup" : "";
             var processInfo = new ProcessStartInfo
             {
                 FileName = pythonExe,
-                Arguments = $"\"{PythonScriptPath}\" {ServerPort} {currentProcessId}",
+                Arguments = useStdio
+                    ? $"\"{PythonScriptPath}\" 0 {currentProcessId}{warmup} --transport stdio"
+                    : $"\"{PythonScriptPath}\" {ServerPort} {currentProcessId}{warmup}" +
+                      (UseAsyncioServer ? " --server-mode asyncio" : "") +
+                      (ServerWorkers > 1 ? $" --workers {Math.Min(ServerWorkers, MaxServerWorkers)}" : ""),
                 UseShellExecute = false,
+                RedirectStandardInput = useStdio,
                 RedirectStandardOutput = true,
                 RedirectStandardError = true,
                 CreateNoWindow = true,
@@ -325,17 +338,25 @@ public static class FishAudioTTSClient
             bool hasFatalError = false;
             StringBuilder errorOutput = new StringBuilder();
             
-            process.OutputDataReceived += (sender, e) =>
+            // Startup messages: stdout lines, or STATUS frames with the stdio transport
+            Action<string> handleStatus = line =>
             {
-                if (!string.IsNullOrEmpty(e.Data))
+                if (!string.IsNullOrEmpty(line))
                 {
-                    Log.Message($"FishAudio TTS Server: {e.Data}");
-                    if (e.Data.Contains("\"status\": \"ready\""))
+                    Log.Message($"FishAudio TTS Server: {line}");
+                    if (line.Contains("\"status\": \"ready\""))
                     {
                         started = true;
                     }
+                    else if (line.Contains("\"status\": \"error\""))
+                    {
+                        // The server checks its own dependencies before binding the port
+                        hasFatalError = true;
+                        Log.Error($"FishAudio TTS: Server reported a startup error - {line}");
+                    }
                 }
             };
+            process.OutputDataReceived += (sender, e) => handleStatus(e.Data);
             
             process.ErrorDataReceived += (sender, e) =>
             {
@@ -369,7 +390,18 @@ public static class FishAudioTTSClient
             };
 
             process.Start();
-            process.BeginOutputReadLine();
+            FishAudioStdioHandler stdioChannel = null;
+            if (useStdio)
+            {
+                // stdout carries binary frames, so it is read by the handler instead of line by line
+                stdioChannel = new FishAudioStdioHandler(process.StandardInput.BaseStream, process.StandardOutput.BaseStream);
+                stdioChannel.StatusReceived += handleStatus;
+                stdioChannel.Start();
+            }
+            else
+            {
+                process.BeginOutputReadLine();
+            }
             process.BeginErrorReadLine();
             
             // Wait for server to be ready (max 15 seconds - increased for slow systems)
@@ -382,6 +414,10 @@ public static class FishAudioTTSClient
                 // Check if process crashed during startup
                 if (process.HasExited)
                 {
+                    if (hasFatalError)
+                    {
+                        Log.Error("FishAudio TTS: Python dependencies missing. Please install: pip install fish-audio-sdk");
+                    }
                     Log.Error($"FishAudio TTS: Python process exited during startup with code {process.ExitCode}");
                     return false;
                 }
@@ -416,13 +452,21 @@ public static class FishAudioTTSClient
                 {
                     Log.Warning($"FishAudio TTS: Failed to kill non-responsive process - {killEx.Message}");
                 }
+                stdioChannel?.Dispose();
                 return false;
             }
             
             lock (_lock)
             {
                 _serverProcess = process;
+                _stdioChannel = stdioChannel;
                 // Use InfiniteTimeSpan - timeout is controlled per-request via CancellationToken
+                if (stdioChannel != null)
+                {
+                    // Requests still address ServerUrl; the handler only uses its path
+                    _httpClient = new HttpClient(stdioChannel) { Timeout = System.Threading.Timeout.InfiniteTimeSpan };
+                    return true;
+                }
                 // Create HttpClient with cookies disabled to avoid Mono/Win32 cookie/container codepaths
                 try
                 {
@@ -467,6 +511,12 @@ public static class FishAudioTTSClient
             Log.Warning("FishAudio TTS: Text or API key is empty");
             return null;
         }
+        if (!IsUpstreamAvailable)
+        {
+            // Lines already past TTSService's check when the circuit opened
+            Logger.Debug($"FishAudio TTS: Fish Audio API unavailable, skipping line - {request.Input}");
+            return null;
+        }
         try
         {
             // Ensure server is running, with retry on failure
@@ -487,6 +537,7 @@ public static class FishAudioTTSClient
                         catch { }
                     }
                     _serverProcess = null;
+                    _stdioChannel = null;
                     _httpClient?.Dispose();
                     _httpClient = null;
                 }
@@ -503,18 +554,16 @@ public static class FishAudioTTSClient
             }
             
             // Build request object mapping from TTSRequest
-            var requestData = new PythonTTSRequest
-            {
-                api_key = request.ApiKey,
-                text = request.Input,
-                reference_id = request.Voice,
-                model = request.Model,
-                latency = "normal",
-                speed = request.Speed,
-                normalize = false,
-                temperature = request.Temperature,
-                top_p = request.TopP
-            };
+            string requestId = Guid.NewGuid().ToString("N");
+            var requestData = BuildPythonRequest(request, requestId);
+            if (UseSpoolHandoff)
+            {
+                requestData.response_format = "spool";
+            }
+            if (RequestDeadlineMs > 0)
+            {
+                requestData.deadline_ms = RequestDeadlineMs;
+            }
             
             string jsonContent = JsonUtil.SerializeToJson(requestData);
             var content = new StringContent(jsonContent, Encoding.UTF8, "application/json");
@@ -524,12 +573,63 @@ public static class FishAudioTTSClient
 
             Logger.Debug($"FishAudio TTS: Sending request - {request.Input}");
             
-            // Send HTTP request
-            var response = await _httpClient.PostAsync(ServerUrl, content, cancellationToken);
+            // Ask for raw WAV bytes instead of base64-in-JSON; errors still come back as JSON
+            var httpRequest = new HttpRequestMessage(HttpMethod.Post, ServerUrl) { Content = content };
+            httpRequest.Headers.Accept.Add(new System.Net.Http.Headers.MediaTypeWithQualityHeaderValue("audio/wav"));
+            
+            // Send HTTP request; if the caller cancels, also tell the server to abort the upstream call
+            HttpResponseMessage response;
+            using (cancellationToken.Register(() => SendCancelCommand(requestId)))
+            {
+                response = await _httpClient.SendAsync(httpRequest, cancellationToken);
+            }
+            
+            if (response.IsSuccessStatusCode && response.Content.Headers.ContentType?.MediaType == "audio/wav")
+            {
+                byte[] audioBytes = await response.Content.ReadAsByteArrayAsync();
+                if (audioBytes.Length == 0)
+                {
+                    Log.Error("FishAudio TTS: Server returned empty audio");
+                    return null;
+                }
+                
+                IEnumerable<string> cacheStatus;
+                if (response.Headers.TryGetValues("X-Cache", out cacheStatus))
+                {
+                    Logger.Debug($"FishAudio TTS: Received {audioBytes.Length} bytes (cache {string.Join(",", cacheStatus)})");
+                }
+                return audioBytes;
+            }
+            
+            // Older servers and error responses use the JSON format
             string responseText = await response.Content.ReadAsStringAsync();
             
             if (!response.IsSuccessStatusCode)
             {
+                IEnumerable<string> circuitState;
+                if (response.StatusCode == System.Net.HttpStatusCode.ServiceUnavailable &&
+                    response.Headers.TryGetValues("X-Circuit-State", out circuitState))
+                {
+                    var retryAfter = response.Headers.RetryAfter?.Delta ?? TimeSpan.FromSeconds(10);
+                    _upstreamUnavailableUntil = DateTime.UtcNow + retryAfter;
+                    Log.Warning($"FishAudio TTS: Fish Audio API is failing, pausing requests for {retryAfter.TotalSeconds:0}s");
+                    return null;
+                }
+                
+                if (response.StatusCode == System.Net.HttpStatusCode.ServiceUnavailable &&
+                    responseText.Contains("\"overloaded\": true"))
+                {
+                    // Admission control refused the line during a burst; later lines are let in as it drains
+                    Logger.Debug($"FishAudio TTS: Server overloaded, line skipped - {request.Input}");
+                    return null;
+                }
+                
+                if (responseText.Contains("\"deadline_exceeded\": true"))
+                {
+                    Logger.Debug($"FishAudio TTS: Line dropped, deadline of {RequestDeadlineMs} ms passed - {request.Input}");
+                    return null;
+                }
+                
                 // Parse error response to extract meaningful message
                 string errorMessage = ExtractErrorMessage(responseText, response.StatusCode);
                 Log.Error($"FishAudio TTS: {errorMessage}");
@@ -545,6 +645,11 @@ public static class FishAudioTTSClient
                 return null;
             }
             
+            if (result.success && result.spool != null)
+            {
+                return ReadSpool(result.spool);
+            }
+            
             if (result.success && !string.IsNullOrEmpty(result.audio))
             {
                 try
@@ -601,6 +706,224 @@ public static class FishAudioTTSClient
         }
     }
 
+    /// <summary>
+    /// Map a TTSRequest to the JSON request of the Python server
+    /// </summary>
+    private static PythonTTSRequest BuildPythonRequest(TTSRequest request, string requestId)
+    {
+        return new PythonTTSRequest
+        {
+            request_id = requestId,
+            api_key = request.ApiKey,
+            text = request.Input,
+            reference_id = request.Voice,
+            model = request.Model,
+            latency = AdaptiveLatency ? "auto" : "normal",
+            speed = request.Speed,
+            normalize = false,
+            temperature = request.Temperature,
+            top_p = request.TopP,
+            split = SplitLongLines
+        };
+    }
+    
+    /// <summary>
+    /// Ask the server to render lines that are expected to be spoken soon into its audio cache.
+    /// Prefetching only uses idle capacity and gives way to real requests; a later
+    /// GenerateSpeechAsync call for the same line is then served from the cache.
+    /// </summary>
+    /// <returns>Number of lines queued, or 0 if the server is not running</returns>
+    public static async Task<int> PrefetchAsync(IEnumerable<TTSRequest> requests)
+    {
+        HttpClient client;
+        lock (_lock)
+        {
+            client = _httpClient;
+        }
+        if (client == null || requests == null)
+        {
+            return 0;
+        }
+        
+        var lines = new List<PythonTTSRequest>();
+        foreach (var request in requests)
+        {
+            if (request != null && !string.IsNullOrEmpty(request.Input) && !string.IsNullOrEmpty(request.ApiKey))
+            {
+                lines.Add(BuildPythonRequest(request, null));
+            }
+        }
+        if (lines.Count == 0)
+        {
+            return 0;
+        }
+        
+        try
+        {
+            var prefetchRequest = new PythonPrefetchRequest { lines = lines };
+            var content = new StringContent(JsonUtil.SerializeToJson(prefetchRequest), Encoding.UTF8, "application/json");
+            using (var response = await client.PostAsync(ServerUrl + "/prefetch", content))
+            {
+                string responseText = await response.Content.ReadAsStringAsync();
+                var result = JsonUtil.DeserializeFromJson<PythonPrefetchResponse>(responseText);
+                if (result == null || !result.success)
+                {
+                    Logger.Debug($"FishAudio TTS: Prefetch rejected - {result?.error ?? responseText}");
+                    return 0;
+                }
+                Logger.Debug($"FishAudio TTS: Prefetch queued {result.queued} of {lines.Count} lines ({result.cached} already cached)");
+                return result.queued;
+            }
+        }
+        catch (Exception ex)
+        {
+            Logger.Debug($"FishAudio TTS: Failed to send prefetch request - {ex.Message}");
+            return 0;
+        }
+    }
+    
+    /// <summary>
+    /// Copy a clip out of the server's memory-mapped spool file and release its lease.
+    /// Mappings stay open across calls; stale ones from restarted server processes are dropped in bulk.
+    /// </summary>
+    private static byte[] ReadSpool(PythonSpoolHandle spool)
+    {
+        try
+        {
+            lock (_spoolLock)
+            {
+                MemoryMappedViewAccessor view;
+                if (!_spoolViews.TryGetValue(spool.path, out view))
+                {
+                    if (_spoolViews.Count >= MaxSpoolMappings)
+                    {
+                        CloseSpool();
+                    }
+                    // FileShare.Delete lets the server remove the file on shutdown while it is still mapped here
+                    var stream = new FileStream(spool.path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite | FileShare.Delete);
+                    var file = MemoryMappedFile.CreateFromFile(stream, null, 0, MemoryMappedFileAccess.Read, null, HandleInheritability.None, false);
+                    view = file.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+                    _spoolFiles[spool.path] = file;
+                    _spoolViews[spool.path] = view;
+                }
+                
+                if (spool.offset < 0 || spool.length <= 0 || spool.offset + spool.length > view.Capacity)
+                {
+                    Log.Error($"FishAudio TTS: Spool region out of range ({spool.offset}+{spool.length})");
+                    return null;
+                }
+                
+                byte[] audioBytes = new byte[spool.length];
+                view.ReadArray(spool.offset, audioBytes, 0, spool.length);
+                return audioBytes;
+            }
+        }
+        catch (Exception ex)
+        {
+            Log.Error($"FishAudio TTS: Failed to read spool file '{spool.path}' - {ex.Message}");
+            return null;
+        }
+        finally
+        {
+            SendReleaseCommand(spool.lease);
+        }
+    }
+    
+    private static void CloseSpool()
+    {
+        lock (_spoolLock)
+        {
+            foreach (var view in _spoolViews.Values)
+            {
+                view.Dispose();
+            }
+            foreach (var file in _spoolFiles.Values)
+            {
+                file.Dispose();
+            }
+            _spoolViews.Clear();
+            _spoolFiles.Clear();
+        }
+    }
+    
+    /// <summary>
+    /// Tell the server a spool lease has been read so its region can be reused (fire-and-forget)
+    /// </summary>
+    private static void SendReleaseCommand(string lease)
+    {
+        HttpClient client;
+        lock (_lock)
+        {
+            client = _httpClient;
+        }
+        if (client == null || string.IsNullOrEmpty(lease))
+        {
+            return;
+        }
+        
+        try
+        {
+            var releaseRequest = new PythonReleaseRequest { command = "release", leases = new List<string> { lease } };
+            var content = new StringContent(JsonUtil.SerializeToJson(releaseRequest), Encoding.UTF8, "application/json");
+            client.PostAsync(ServerUrl, content).ContinueWith(t =>
+            {
+                if (t.IsFaulted)
+                {
+                    Logger.Debug($"FishAudio TTS: Failed to release spool lease - {t.Exception?.GetBaseException().Message}");
+                }
+                else
+                {
+                    t.Result.Dispose();
+                }
+            });
+        }
+        catch (Exception ex)
+        {
+            Logger.Debug($"FishAudio TTS: Failed to release spool lease - {ex.Message}");
+        }
+    }
+    
+    /// <summary>
+    /// Ask the server to cancel a running request so it stops waiting on Fish Audio (fire-and-forget)
+    /// </summary>
+    private static void SendCancelCommand(string requestId)
+    {
+        HttpClient client;
+        lock (_lock)
+        {
+            client = _httpClient;
+        }
+        if (client == null)
+        {
+            return;
+        }
+        
+        try
+        {
+            var cancelRequest = new Dictionary<string, string>
+            {
+                { "command", "cancel" },
+                { "request_id", requestId }
+            };
+            var content = new StringContent(JsonUtil.SerializeToJson(cancelRequest), Encoding.UTF8, "application/json");
+            client.PostAsync(ServerUrl, content).ContinueWith(t =>
+            {
+                if (t.IsFaulted)
+                {
+                    Logger.Debug($"FishAudio TTS: Failed to send cancel command - {t.Exception?.GetBaseException().Message}");
+                }
+                else
+                {
+                    t.Result.Dispose();
+                }
+            });
+        }
+        catch (Exception ex)
+        {
+            Logger.Debug($"FishAudio TTS: Failed to send cancel command - {ex.Message}");
+        }
+    }
+
     /// <summary>
     /// Extract user-friendly error message from server response
     /// </summary>
@@ -668,7 +991,8 @@ public static class FishAudioTTSClient
                     var shortHandler = new HttpClientHandler { UseCookies = false };
                     using (var timeoutClient = new HttpClient(shortHandler) { Timeout = TimeSpan.FromSeconds(2) })
                     {
-                        var task = timeoutClient.PostAsync(ServerUrl, content);
+                        // With the stdio transport there is no port; the command goes down the server's stdin like any request
+                        var task = (_stdioChannel != null ? _httpClient : timeoutClient).PostAsync(ServerUrl, content);
                         task.Wait(TimeSpan.FromSeconds(2));
 
                         if (task.IsCompleted && task.Result.IsSuccessStatusCode)
@@ -707,8 +1031,10 @@ public static class FishAudioTTSClient
             finally
             {
                 _serverProcess = null;
+                _stdioChannel = null;
                 _httpClient?.Dispose();
                 _httpClient = null;
+                CloseSpool();
             }
         }
     }
@@ -716,6 +1042,9 @@ public static class FishAudioTTSClient
     [DataContract]
     private class PythonTTSRequest
     {
+        [DataMember(Name = "request_id")]
+        public string request_id { get; set; }
+        
         [DataMember(Name = "api_key")]
         public string api_key { get; set; }
         
@@ -742,6 +1071,64 @@ public static class FishAudioTTSClient
         
         [DataMember(Name = "top_p")]
         public float top_p { get; set; }
+        
+        [DataMember(Name = "split", EmitDefaultValue = false)]
+        public bool split { get; set; }
+        
+        [DataMember(Name = "response_format", EmitDefaultValue = false)]
+        public string response_format { get; set; }
+        
+        [DataMember(Name = "deadline_ms", EmitDefaultValue = false)]
+        public int deadline_ms { get; set; }
+    }
+    
+    [DataContract]
+    private class PythonReleaseRequest
+    {
+        [DataMember(Name = "command")]
+        public string command { get; set; }
+        
+        [DataMember(Name = "leases")]
+        public List<string> leases { get; set; }
+    }
+    
+    [DataContract]
+    private class PythonSpoolHandle
+    {
+        [DataMember(Name = "path")]
+        public string path { get; set; }
+        
+        [DataMember(Name = "offset")]
+        public long offset { get; set; }
+        
+        [DataMember(Name = "length")]
+        public int length { get; set; }
+        
+        [DataMember(Name = "lease")]
+        public string lease { get; set; }
+    }
+    
+    [DataContract]
+    private class PythonPrefetchRequest
+    {
+        [DataMember(Name = "lines")]
+        public List<PythonTTSRequest> lines { get; set; }
+    }
+    
+    [DataContract]
+    private class PythonPrefetchResponse
+    {
+        [DataMember(Name = "success")]
+        public bool success { get; set; }
+        
+        [DataMember(Name = "queued")]
+        public int queued { get; set; }
+        
+        [DataMember(Name = "cached")]
+        public int cached { get; set; }
+        
+        [DataMember(Name = "error")]
+        public string error { get; set; }
     }
     
     [DataContract]
@@ -761,5 +1148,8 @@ public static class FishAudioTTSClient
         
         [DataMember(Name = "traceback")]
         public string traceback { get; set; }
+        
+        [DataMember(Name = "spool")]
+        public PythonSpoolHandle spool { get; set; }
     }
 }
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Fish Audio TTS Server Benchmark
+Runs fish_audio_tts.py against a local stand-in for api.fish.audio and reports
+latency percentiles, throughput, server CPU and peak memory as JSON.
+
+No network access or API key is needed. Examples:
+    python benchmark_tts.py --concurrency 8 --requests 400
+    python benchmark_tts.py --server-mode threading,asyncio --latency 300 --jitter 100
+    python benchmark_tts.py --rate-limited 0.05 --error-rate 0.02 --output bench_output.txt
+"""
+
+import sys
+import os
+import json
+import time
+import math
+import random
+import socket
+import struct
+import argparse
+import tempfile
+import subprocess
+import http.client
+from threading import Thread, Lock, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import ormsgpack
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fish_audio_tts.py")
+WORDS = ("the colonist hauls steel to the stockpile while raiders gather near the northern hills "
+         "and the doctor tends wounds in the hospital as night falls over the quiet colony").split()
+
+
+def free_port():
+    """Ask the OS for an unused local port"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values):
+    """p50/p95/p99, mean and max of a list of seconds (nearest rank), or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(q):
+        return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 6)
+
+    return {
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "max": round(ordered[-1], 6)
+    }
+
+
+def mock_wav(seconds, sample_rate=44100):
+    """16-bit mono WAV of the given duration (a quiet tone, so post-processing has work to do)"""
+    frames = max(1, int(seconds * sample_rate))
+    period = b"".join(struct.pack("<h", int(3000 * math.sin(2 * math.pi * i / 100))) for i in range(100))
+    data = (period * (frames // 100 + 1))[:frames * 2]
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(data)
+    ) + data
+
+
+class MockUpstream:
+    """
+    Local stand-in for the Fish Audio TTS API (POST /v1/tts, msgpack body)
+
+    Each request waits latency + per_char * len(text) +/- jitter seconds and
+    returns a chunked WAV of audio_per_char seconds per character. A share of
+    requests fails with 429 (with Retry-After) or 500 instead.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, per_char=0.0, audio_per_char=0.06,
+                 error_rate=0.0, rate_limited=0.0, retry_after=0.2, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.per_char = per_char
+        self.audio_per_char = audio_per_char
+        self.error_rate = error_rate
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "bytes": 0}
+        self._lock = Lock()
+        self._wavs = {}
+        self.httpd = None
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def _audio(self, text):
+        seconds = round(len(text) * self.audio_per_char, 1)
+        with self._lock:
+            wav = self._wavs.get(seconds)
+            if wav is None:
+                wav = self._wavs[seconds] = mock_wav(seconds)
+        return wav
+
+    def start(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                text = ormsgpack.unpackb(body).get("text", "") if body else ""
+                upstream._count("requests")
+                with upstream._lock:
+                    roll = upstream.random.random()
+                    jitter = upstream.random.uniform(-upstream.jitter, upstream.jitter)
+
+                if roll < upstream.rate_limited:
+                    upstream._count("rate_limited")
+                    self._send_error(429, {"Retry-After": str(upstream.retry_after)})
+                    return
+                time.sleep(max(0.0, upstream.latency + upstream.per_char * len(text) + jitter))
+                if roll < upstream.rate_limited + upstream.error_rate:
+                    upstream._count("errors")
+                    self._send_error(500)
+                    return
+
+                wav = upstream._audio(text)
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                step = 16 * 1024
+                for i in range(0, len(wav), step):
+                    chunk = wav[i:i + step]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+                upstream._count("ok")
+                upstream._count("bytes", len(wav))
+
+            def _send_error(self, status, headers=None):
+                payload = json.dumps({"status": status, "message": "mock error"}).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:%d" % self.httpd.server_address[1]
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+class ProcessSampler:
+    """
+    Samples CPU time and resident memory of a process and its children
+    (--workers processes), using psutil if installed, else /proc
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = None
+        self._stop = Event()
+        self._thread = None
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except Exception:
+            self._process = None
+
+    def _pids(self):
+        """The process and its live descendants"""
+        if self._process is not None:
+            return [self._process] + self._process.children(recursive=True)
+        parents = {}
+        for name in os.listdir("/proc"):
+            if name.isdigit():
+                try:
+                    with open(f"/proc/{name}/stat") as f:
+                        parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, ValueError, IndexError):
+                    pass
+        tree = [self.pid]
+        for pid in tree:
+            tree.extend(child for child, parent in parents.items() if parent == pid)
+        return tree
+
+    def cpu_seconds(self):
+        try:
+            if self._process is not None:
+                return sum(sum(p.cpu_times()[:2]) for p in self._pids())
+            total = 0
+            for pid in self._pids():
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            return total / os.sysconf("SC_CLK_TCK")
+        except Exception:
+            return None
+
+    def rss(self):
+        try:
+            if self._process is not None:
+                return sum(p.memory_info().rss for p in self._pids())
+            total = 0
+            for pid in self._pids():
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            return total
+        except Exception:
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def parse_mix(value):
+    """Parse a line length mix like '20:5,80:3,300:1' into [(length, weight)]"""
+    mix = []
+    for part in value.split(","):
+        length, _, weight = part.partition(":")
+        mix.append((int(length), float(weight or 1)))
+    return mix
+
+
+def make_text(rng, length, index):
+    """Pseudo-random sentence of about length characters, unique per index"""
+    words = [f"line{index}"]
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:max(length, len(words[0]))].rstrip() + "."
+
+
+def build_workload(options):
+    """List of request payloads, with options.repeat share of lines repeating earlier ones"""
+    rng = random.Random(options.seed)
+    lengths, weights = zip(*parse_mix(options.line_mix))
+    payloads = []
+    for index in range(options.requests):
+        if payloads and rng.random() < options.repeat:
+            payloads.append(dict(rng.choice(payloads)))
+            continue
+        payload = {
+            "api_key": "benchmark-key",
+            "reference_id": "benchmark-voice",
+            "text": make_text(rng, rng.choices(lengths, weights)[0], index)
+        }
+        if options.split:
+            payload["split"] = True
+        if options.postprocess:
+            payload["postprocess"] = json.loads(options.postprocess)
+        payloads.append(payload)
+    return payloads
+
+
+def start_server(mode, base_url, port, options, cache_dir):
+    """Launch fish_audio_tts.py and wait for its ready message; returns (process, startup seconds)"""
+    args = [sys.executable, SERVER_SCRIPT, str(port), str(os.getpid()),
+            "--base-url", base_url, "--server-mode", mode]
+    if options.no_cache:
+        args.append("--no-cache")
+    else:
+        args += ["--cache-dir", cache_dir]
+    args += options.server_args
+
+    started = time.monotonic()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for line in process.stdout:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if message.get("status") == "ready":
+            return process, time.monotonic() - started
+        if message.get("status") == "error":
+            break
+    process.kill()
+    raise RuntimeError(f"Server failed to start in {mode} mode")
+
+
+def stop_server(process, port):
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        connection.request("POST", "/", json.dumps({"command": "shutdown"}))
+        connection.getresponse().read()
+    except Exception:
+        pass
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def fetch_metrics(port):
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        connection.request("GET", "/metrics?format=json")
+        return json.loads(connection.getresponse().read())
+    except Exception:
+        return None
+
+
+def drive(port, payloads, options):
+    """
+    Send payloads from options.concurrency keep-alive connections
+
+    Returns:
+        Dictionary with per-request latencies, time to first byte, statuses and bytes
+    """
+    path = "/" if options.endpoint == "tts" else "/" + options.endpoint
+    headers = {"Content-Type": "application/json"}
+    if options.endpoint == "tts" and not options.json:
+        headers["Accept"] = "audio/wav"
+
+    lock = Lock()
+    cursor = iter(range(len(payloads)))
+    results = {"latency": [], "ttfb": [], "statuses": {}, "failures": 0, "bytes": 0}
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=options.timeout)
+        while True:
+            with lock:
+                index = next(cursor, None)
+            if index is None:
+                break
+            body = json.dumps(payloads[index])
+            started = time.perf_counter()
+            try:
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                first = response.read(1)
+                ttfb = time.perf_counter() - started
+                size = len(first) + len(response.read())
+                elapsed = time.perf_counter() - started
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=options.timeout)
+                with lock:
+                    results["failures"] += 1
+                continue
+            with lock:
+                results["statuses"][str(status)] = results["statuses"].get(str(status), 0) + 1
+                if status == 200:
+                    results["latency"].append(elapsed)
+                    results["ttfb"].append(ttfb)
+                    results["bytes"] += size
+        connection.close()
+
+    threads = [Thread(target=worker) for _ in range(options.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_benchmark(mode, options):
+    upstream = MockUpstream(
+        latency=options.latency / 1000.0,
+        jitter=options.jitter / 1000.0,
+        per_char=options.per_char / 1000.0,
+        audio_per_char=options.audio_per_char,
+        error_rate=options.error_rate,
+        rate_limited=options.rate_limited,
+        retry_after=options.retry_after,
+        seed=options.seed
+    )
+    base_url = upstream.start()
+    port = free_port()
+    payloads = build_workload(options)
+
+    with tempfile.TemporaryDirectory(prefix="tts_bench_cache_") as cache_dir:
+        process, startup = start_server(mode, base_url, port, options, cache_dir)
+        sampler = ProcessSampler(process.pid)
+        sampler.start()
+        try:
+            if options.warmup_requests:
+                drive(port, build_workload(argparse.Namespace(**{**vars(options), "requests": options.warmup_requests,
+                                                                   "seed": (options.seed or 0) + 1})), options)
+            cpu_before = sampler.cpu_seconds()
+            started = time.perf_counter()
+            results = drive(port, payloads, options)
+            wall = time.perf_counter() - started
+            cpu_after = sampler.cpu_seconds()
+            server_metrics = fetch_metrics(port)
+        finally:
+            sampler.stop()
+            stop_server(process, port)
+            upstream.stop()
+
+    completed = len(results["latency"])
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "server_mode": mode,
+        "startup_seconds": round(startup, 4),
+        "requests": {
+            "sent": len(payloads),
+            "ok": completed,
+            "statuses": results["statuses"],
+            "connection_failures": results["failures"],
+            "bytes_received": results["bytes"]
+        },
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(completed / wall, 3) if wall > 0 else None,
+        "latency_seconds": percentiles(results["latency"]),
+        "ttfb_seconds": percentiles(results["ttfb"]),
+        "server": {
+            "cpu_seconds": round(cpu, 4) if cpu is not None else None,
+            "cpu_percent": round(100.0 * cpu / wall, 2) if cpu is not None and wall > 0 else None,
+            "peak_rss_bytes": sampler.peak_rss
+        },
+        "upstream": dict(upstream.counts),
+        "server_metrics": server_metrics
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark fish_audio_tts.py against a local mock Fish Audio API")
+    parser.add_argument("--server-mode", default="asyncio",
+                        help="Server mode(s) to run, comma separated (threading, asyncio)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client connections")
+    parser.add_argument("--warmup-requests", type=int, default=10, help="Requests sent before measuring")
+    parser.add_argument("--endpoint", choices=("tts", "stream"), default="tts", help="Endpoint to drive")
+    parser.add_argument("--json", action="store_true", help="Use JSON/base64 responses instead of binary WAV")
+    parser.add_argument("--line-mix", default="20:5,80:3,300:1",
+                        help="Line lengths in characters with relative weights (length:weight,...)")
+    parser.add_argument("--repeat", type=float, default=0.0, help="Share of requests repeating an earlier line")
+    parser.add_argument("--split", action="store_true", help="Send split: true (sentence-level parallel synthesis)")
+    parser.add_argument("--postprocess", default=None, help="JSON object sent as 'postprocess' with every request")
+    parser.add_argument("--no-cache", action="store_true", help="Run the server without its audio cache")
+    parser.add_argument("--latency", type=float, default=200.0, help="Mock upstream base latency (ms)")
+    parser.add_argument("--jitter", type=float, default=50.0, help="Mock upstream latency jitter, +/- (ms)")
+    parser.add_argument("--per-char", type=float, default=2.0, help="Mock upstream latency per character (ms)")
+    parser.add_argument("--audio-per-char", type=float, default=0.06, help="Seconds of mock audio per character")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock upstream 500 responses")
+    parser.add_argument("--rate-limited", type=float, default=0.0, help="Share of mock upstream 429 responses")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After of mock 429 responses (s)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request (s)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the workload and the mock")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("server_args", nargs=argparse.REMAINDER,
+                        help="Extra fish_audio_tts.py arguments after '--'")
+    options = parser.parse_args(argv)
+    if options.server_args and options.server_args[0] == "--":
+        options.server_args = options.server_args[1:]
+    return options
+
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    runs = []
+    for mode in options.server_mode.split(","):
+        sys.stderr.write(f"[Benchmark] {mode}: {options.requests} requests, concurrency {options.concurrency}\n")
+        sys.stderr.flush()
+        runs.append(run_benchmark(mode.strip(), options))
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "config": {k: v for k, v in vars(options).items() if k != "output"},
+        "runs": runs
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
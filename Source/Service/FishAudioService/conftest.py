@@ -0,0 +1,2 @@
+# test_fishaudio.py is a manual check against the live API (python test_fishaudio.py), not a pytest module
+collect_ignore = ["test_fishaudio.py"]
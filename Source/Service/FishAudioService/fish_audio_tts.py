@@ -1,185 +1,3308 @@
+import time
+# Process start reference for the startup timings in the ready message
+STARTUP_STARTED = time.perf_counter()
 import asyncio
 import json
 import base64
 import sys
 import os
-import time
+import importlib.util
+import argparse
+import select
+import socket
+import concurrent.futures
+import queue
+import multiprocessing
+import multiprocessing.connection
+import hashlib
+import heapq
+import itertools
+import random
+import bisect
+import contextvars
+import weakref
+import functools
+import math
+import re
+import io
+import mmap
+import tempfile
+import http.client
+from http import HTTPStatus
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from threading import Lock
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
-from threading import Thread
-from fishaudio import AsyncFishAudio
-from fishaudio.types import TTSConfig, Prosody
+from threading import Thread, Event
+from urllib.parse import urlparse, parse_qs
+import struct
 
+# Loaded by DeferredImports while the server binds its socket (the SDK alone takes ~0.3 s)
+AsyncFishAudio = APIError = ServerError = TTSConfig = TTSRequest = Prosody = None
+httpx = ormsgpack = None  # The SDK's HTTP client and the msgpack encoder of the streaming endpoint
+np = None  # Optional: only needed for audio post-processing
 
-class TTSRequestHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for TTS conversion"""
+
+DEFAULT_BASE_URL = "https://api.fish.audio"
+# Max wait for a buffered upstream call; also the implicit deadline of requests without one when ordering the queue
+UPSTREAM_TIMEOUT = 45.0
+# Work is dropped before its upstream call when the deadline leaves less than this share of the recent upstream latency
+DEADLINE_DROP_FRACTION = 0.5
+# Streaming: max wait for the first audio chunk, and between later chunks
+STREAM_FIRST_CHUNK_TIMEOUT = 45.0
+STREAM_CHUNK_TIMEOUT = 15.0
+# How often a waiting request checks whether its client has disconnected
+DISCONNECT_POLL_INTERVAL = 0.25
+# Asyncio front end: idle keep-alive connections are closed after this many seconds
+KEEPALIVE_IDLE_TIMEOUT = 120.0
+MAX_REQUEST_HEADERS = 100
+# Pending connections the listening socket queues; a burst beyond it gets connection resets instead of 503s
+LISTEN_BACKLOG = 128
+MAX_REQUEST_LINE = 65536
+# Refused bodies up to this size are read and thrown away (not buffered) so the client sees the response
+# instead of a reset connection; larger ones close the connection right away
+MAX_DISCARDED_BODY = 64 * 1024 * 1024
+# Bodies up to this size may be commands (cancel, release, shutdown), which admission control lets through
+MAX_COMMAND_BODY = 4096
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_cache")
+
+# Request fields that determine the synthesized audio, used for content addressing
+SYNTHESIS_PARAM_DEFAULTS = {
+    "text": None,
+    "reference_id": None,
+    "model": "s1",
+    "speed": 1.0,
+    "normalize": False,
+    "temperature": 0.9,
+    "top_p": 0.9,
+}
+
+
+def synthesis_params(request_data):
+    """Extract the synthesis parameters of a request with defaults applied"""
+    return {name: request_data.get(name, default) for name, default in SYNTHESIS_PARAM_DEFAULTS.items()}
+
+
+def params_hash(params):
+    """Stable SHA-256 hash of synthesis parameters"""
+    canonical = {
+        "text": params["text"],
+        "reference_id": params["reference_id"],
+        "model": params["model"],
+        "speed": round(float(params["speed"]), 4),
+        "normalize": bool(params["normalize"]),
+        "temperature": round(float(params["temperature"]), 4),
+        "top_p": round(float(params["top_p"]), 4),
+        "format": "wav",
+    }
+    encoded = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class EventLoopThread:
+    """Long-lived asyncio event loop running on a background thread"""
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, name="tts-event-loop", daemon=True)
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    def start(self):
+        self._thread.start()
+    
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop from another thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+    
+    def submit(self, coro):
+        """Schedule a coroutine on the loop without waiting for it"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        if not self.loop.is_running():
+            self.loop.close()
+
+
+class UpstreamRateLimited(Exception):
+    """Fish Audio answered 429; carries the Retry-After delay in seconds if one was sent"""
+    
+    def __init__(self, retry_after=None):
+        self.retry_after = retry_after
+        detail = f" (retry after {retry_after:.1f}s)" if retry_after is not None else ""
+        super().__init__(f"HTTP 429: Too Many Requests{detail}")
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delay in seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Per-attempt upstream timing record ({"start": ..., "ttfb": ...}) of the current task
+_upstream_timing = contextvars.ContextVar("upstream_timing", default=None)
+# Trace record of the current request (--trace), filled in as it is handled
+_request_trace = contextvars.ContextVar("request_trace", default=None)
+# Deadline (time.monotonic()) of the current request, picked up by every SynthesisJob it creates
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+async def _on_upstream_response(response):
+    """
+    httpx response hook: record time to first byte, and surface 429s with
+    their Retry-After before the SDK drops the headers
+    """
+    timing = _upstream_timing.get()
+    if timing is not None and "ttfb" not in timing:
+        timing["ttfb"] = time.monotonic() - timing["start"]
+    if response.status_code == 429:
+        await response.aread()
+        raise UpstreamRateLimited(parse_retry_after(response.headers.get("Retry-After")))
+
+
+class UpstreamClientPool:
+    """
+    Keyed pool of long-lived AsyncFishAudio clients
+    
+    Clients are keyed by (api_key, base_url) and evicted after being idle for
+    idle_timeout seconds. All clients for the same base_url share one httpx
+    connection pool, so TCP+TLS connections stay warm across dialogue lines and
+    across API keys (the SDK sends the Authorization header per request).
+    Must only be used from the event loop thread.
+    """
+    
+    def __init__(self, idle_timeout=300.0, keepalive_expiry=120.0, max_connections=16):
+        self.idle_timeout = idle_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self.max_connections = max_connections
+        self._clients = {}  # (api_key, base_url) -> [AsyncFishAudio, last_used]
+        self._transports = {}  # base_url -> httpx.AsyncClient
+    
+    def _get_transport(self, base_url):
+        transport = self._transports.get(base_url)
+        if transport is None or transport.is_closed:
+            transport = httpx.AsyncClient(
+                base_url=base_url,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                event_hooks={"response": [_on_upstream_response]}
+            )
+            self._transports[base_url] = transport
+        return transport
+    
+    def transport(self, base_url=DEFAULT_BASE_URL):
+        """Shared keep-alive httpx client for base_url"""
+        return self._get_transport(base_url)
+    
+    def get(self, api_key, base_url=DEFAULT_BASE_URL):
+        """Return a pooled client for the given key, creating it if needed"""
+        key = (api_key, base_url)
+        entry = self._clients.get(key)
+        if entry is None:
+            client = AsyncFishAudio(
+                api_key=api_key,
+                base_url=base_url,
+                httpx_client=self._get_transport(base_url)
+            )
+            entry = [client, 0.0]
+            self._clients[key] = entry
+        entry[1] = time.monotonic()
+        return entry[0]
+    
+    async def warm_up(self, base_url=DEFAULT_BASE_URL):
+        """Open a keep-alive connection to the upstream host ahead of the first request"""
+        started = time.monotonic()
+        try:
+            if not deferred_imports.loaded:
+                await asyncio.to_thread(deferred_imports.wait)
+            # Any response will do - we only want the TCP+TLS handshake done
+            await self._get_transport(base_url).head("/", timeout=10.0)
+            sys.stderr.write(f"[TTS Server] Warmed up connection to {base_url} in {(time.monotonic() - started) * 1000:.0f} ms\n")
+        except Exception as e:
+            sys.stderr.write(f"[TTS Server] Warm-up of {base_url} failed: {e}\n")
+        sys.stderr.flush()
+    
+    def evict_idle(self):
+        """Drop clients that have not been used within idle_timeout"""
+        now = time.monotonic()
+        stale = [key for key, entry in self._clients.items() if now - entry[1] > self.idle_timeout]
+        for key in stale:
+            # Do not close the client: it shares its transport with other keys
+            del self._clients[key]
+        return len(stale)
+    
+    async def run_evictor(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+    
+    async def close(self):
+        self._clients.clear()
+        transports = list(self._transports.values())
+        self._transports.clear()
+        for transport in transports:
+            try:
+                await transport.aclose()
+            except Exception:
+                pass
+
+
+class AudioCache:
+    """
+    Content-addressed audio cache with an in-memory hot tier and LRU eviction
+    
+    Entries are stored as <cache_dir>/<key[:2]>/<key>.wav. Recency is kept in the
+    file modification time, so the LRU order survives server restarts.
+    Thread-safe; disk access happens on the calling thread.
+    
+    With processes > 1 the directory is shared with other processes (--workers):
+    lookups that miss the index check the disk for entries written by another
+    process, and temporary files are left alone since they may be in use.
+    max_bytes applies to the whole directory: each process rescans it once it
+    has written its share (1/processes) of the room left at its last scan, and
+    then evicts the least recently used entries of every process.
+    """
+    
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, memory_bytes=32 * 1024 * 1024, processes=1):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.processes = max(1, processes)
+        self.shared = self.processes > 1
+        self._lock = Lock()
+        self._index = OrderedDict()  # key -> size on disk, least recently used first
+        self._disk_total = 0
+        self._scanned_total = 0  # directory size at the last scan
+        self._written = 0  # bytes written by this process since then
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_total = 0
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".wav")
+    
+    def _scan(self):
+        """Entries on disk as (mtime, key, size), least recently used first"""
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith(".tmp"):
+                        if self.shared:
+                            continue
+                        # Left over from an interrupted write
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                        continue
+                    if not name.endswith(".wav"):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, name[:-4], st.st_size))
+        entries.sort()
+        return entries
+    
+    def _load_index(self):
+        for _, key, size in self._scan():
+            self._index[key] = size
+            self._disk_total += size
+        self._evict_locked()
+        self._scanned_total = self._disk_total
+    
+    def _rescan(self):
+        """Rebuild the index from the shared directory, so entries of every process count toward max_bytes"""
+        entries = self._scan()
+        with self._lock:
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            for key in self._memory:
+                # The hot tier holds this process's most recently used entries
+                if key in self._index:
+                    self._index.move_to_end(key)
+            self._disk_total = sum(self._index.values())
+            # Free a tenth of the cap, so a full directory is not rescanned on every write
+            self._evict_locked(self.max_bytes - self.max_bytes // 10)
+            self._scanned_total = self._disk_total
+            self._written = 0
+    
+    def _remember_locked(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_total -= len(old)
+        self._memory[key] = data
+        self._memory_total += len(data)
+        while self._memory_total > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_total -= len(evicted)
+    
+    def _evict_locked(self, limit=None):
+        limit = self.max_bytes if limit is None else limit
+        while self._disk_total > limit and self._index:
+            key, size = self._index.popitem(last=False)
+            self._disk_total -= size
+            evicted = self._memory.pop(key, None)
+            if evicted is not None:
+                self._memory_total -= len(evicted)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+    
+    def contains(self, key):
+        """Whether key is cached, without touching recency or hit statistics"""
+        with self._lock:
+            if key in self._memory or key in self._index:
+                return True
+        return self.shared and os.path.exists(self._path(key))
+    
+    def get(self, key):
+        """Return cached audio bytes or None"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._index:
+                    self._index.move_to_end(key)
+                self.hits += 1
+                return data
+            if key not in self._index and not self.shared:
+                self.misses += 1
+                return None
+        
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Persist recency for the next server start
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._disk_total -= size
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # Written by another process sharing the directory
+                self._index[key] = len(data)
+                self._disk_total += len(data)
+            self._remember_locked(key, data)
+            self.hits += 1
+            self._evict_locked()
+        return data
+    
+    def put(self, key, data):
+        """Store audio bytes under key, evicting least recently used entries"""
+        if not data or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            sys.stderr.write(f"[TTS Server] Failed to write cache entry: {e}\n")
+            sys.stderr.flush()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._disk_total -= old_size
+            self._index[key] = len(data)
+            self._disk_total += len(data)
+            self._remember_locked(key, data)
+            self._evict_locked()
+            self._written += len(data)
+            rescan = self.shared and self._written > (self.max_bytes - self._scanned_total) / self.processes
+        if rescan:
+            self._rescan()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._disk_total,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+DEFAULT_SPOOL_DIR = os.path.join(tempfile.gettempdir(), "rimtalk_tts_spool")
+
+
+class AudioSpool:
+    """
+    Ring buffer of finished clips in a memory-mapped file shared with the client
+    
+    A clip is written once and handed out as a lease on (path, offset, length);
+    the client maps the file, copies the clip out and releases the lease.
+    Regions are reclaimed oldest first once no lease holds them, so the file
+    never grows past max_bytes. Leases that are never released expire after
+    lease_timeout seconds. Identical clips still in the ring share a region
+    (each lease counts as one reference). The file is created on first use.
+    Must only be used from the event loop thread.
+    """
+    
+    def __init__(self, directory=DEFAULT_SPOOL_DIR, max_bytes=64 * 1024 * 1024, lease_timeout=30.0):
+        self.directory = directory
+        self.path = os.path.join(directory, f"spool-{os.getpid()}.bin")
+        self.max_bytes = max_bytes
+        self.lease_timeout = lease_timeout
+        self._file = None
+        self._map = None
+        self._regions = deque()  # [offset, length, key, references], oldest first
+        self._by_key = {}  # key -> region
+        self._leases = {}  # lease id -> [region, expires]
+        self._lease_ids = itertools.count(1)
+        self._head = 0  # next write offset
+        self.counts = {"spooled": 0, "shared": 0, "full": 0, "expired": 0, "released": 0}
+    
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_stale()
+        self._file = open(self.path, "w+b")
+        self._file.truncate(self.max_bytes)
+        self._map = mmap.mmap(self._file.fileno(), self.max_bytes)
+    
+    def _remove_stale(self):
+        """Delete spool files left behind by servers that are no longer running"""
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r"spool-(\d+)\.bin", name)
+            if match is None or int(match.group(1)) == os.getpid():
+                continue
+            if os.name != 'nt':
+                try:
+                    os.kill(int(match.group(1)), 0)
+                    continue
+                except OSError:
+                    pass
+            try:
+                # On Windows this fails while the owning server still has the file open
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+    
+    def _expire(self):
+        now = time.monotonic()
+        for lease, (region, expires) in list(self._leases.items()):
+            if expires <= now:
+                del self._leases[lease]
+                region[3] -= 1
+                self.counts["expired"] += 1
+    
+    def _reclaim_oldest(self):
+        """Drop the oldest region if nothing references it; returns whether space was freed"""
+        region = self._regions[0]
+        if region[3] > 0:
+            self._expire()
+            if region[3] > 0:
+                return False
+        self._regions.popleft()
+        if self._by_key.get(region[2]) is region:
+            del self._by_key[region[2]]
+        if not self._regions:
+            self._head = 0
+        return True
+    
+    def _allocate(self, size):
+        """Offset of a free region of size bytes, or None if the oldest clips are still leased"""
+        while True:
+            if not self._regions:
+                return 0
+            tail = self._regions[0][0]
+            if self._head > tail:
+                # Free space is after the head and before the tail (wrapping to 0)
+                if self._head + size <= self.max_bytes:
+                    return self._head
+                if size <= tail:
+                    return 0
+            elif size <= tail - self._head:
+                return self._head
+            if not self._reclaim_oldest():
+                return None
+    
+    def lease(self, key, audio_bytes):
+        """
+        Store audio_bytes (or reuse the region of an identical clip) and lease it
+        
+        Returns:
+            Dictionary with path, offset, length and lease id, or None if the spool is full
+        """
+        size = len(audio_bytes)
+        region = self._by_key.get(key)
+        if region is not None:
+            self.counts["shared"] += 1
+        else:
+            if size == 0 or size > self.max_bytes:
+                self.counts["full"] += 1
+                return None
+            if self._map is None:
+                self._open()
+            offset = self._allocate(size)
+            if offset is None:
+                self.counts["full"] += 1
+                return None
+            self._map[offset:offset + size] = audio_bytes
+            region = [offset, size, key, 0]
+            self._regions.append(region)
+            self._by_key[key] = region
+            self._head = offset + size
+            self.counts["spooled"] += 1
+        
+        region[3] += 1
+        lease = f"{os.getpid():x}-{next(self._lease_ids):x}"
+        self._leases[lease] = [region, time.monotonic() + self.lease_timeout]
+        return {"path": self.path, "offset": region[0], "length": region[1], "lease": lease}
+    
+    def release(self, leases):
+        """Drop the references held by the given lease ids; returns how many were held"""
+        released = 0
+        for lease in leases:
+            entry = self._leases.pop(lease, None)
+            if entry is not None:
+                entry[0][3] -= 1
+                released += 1
+        self.counts["released"] += released
+        return released
+    
+    def stats(self):
+        used = sum(region[1] for region in self._regions)
+        return dict(self.counts, path=self.path if self._map is not None else None, max_bytes=self.max_bytes,
+                    used_bytes=used, regions=len(self._regions), leases=len(self._leases))
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self._regions.clear()
+        self._by_key.clear()
+        self._leases.clear()
+
+
+class Histogram:
+    """Fixed-bucket histogram; callers hold the owning Metrics lock"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Approximate quantile (upper bound of the bucket containing it)"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """
+    Request counters, per-phase latency histograms and gauges
+    
+    Phases: queue_wait (scheduler admission), upstream_ttfb, upstream_total,
+    postprocess (PCM post-processing), encode (base64/JSON or binary
+    response) and total. Recording is a lock
+    plus a bisect, cheap enough to stay on in production.
+    """
+    
+    LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    PHASES = ("queue_wait", "upstream_ttfb", "upstream_total", "postprocess", "encode", "total")
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}  # (name, (label pairs)) -> value
+        self._histograms = {phase: Histogram(self.LATENCY_BUCKETS) for phase in self.PHASES}
+        self._gauges = {}
+        self.started = time.time()
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram(self.LATENCY_BUCKETS)
+            histogram.observe(seconds)
+        trace = _request_trace.get()
+        if trace is not None:
+            phases = trace["phases_ms"]
+            phases[phase] = round(phases.get(phase, 0.0) + seconds * 1000, 3)
+    
+    def add_gauge(self, name, delta):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + delta
+    
+    def snapshot(self, gauges=None):
+        """JSON-friendly view of all metrics, with extra point-in-time gauges merged in"""
+        with self._lock:
+            counters = {}
+            for (name, labels), value in self._counters.items():
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters.setdefault(name, {})[label_text or "total"] = value
+            histograms = {
+                phase: {
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts))
+                }
+                for phase, h in self._histograms.items()
+            }
+            all_gauges = dict(self._gauges)
+        all_gauges.update(gauges or {})
+        return {
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "counters": counters,
+            "latency_seconds": histograms,
+            "gauges": all_gauges
+        }
+    
+    def render_prometheus(self, gauges=None):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                lines.append(f"# TYPE rimtalk_tts_{name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter != name:
+                        continue
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"rimtalk_tts_{name}{{{label_text}}} {value}" if label_text else f"rimtalk_tts_{name} {value}")
+            
+            lines.append("# TYPE rimtalk_tts_phase_seconds histogram")
+            for phase, h in self._histograms.items():
+                cumulative = 0
+                for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append(f'rimtalk_tts_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'rimtalk_tts_phase_seconds_sum{{phase="{phase}"}} {h.sum:.6f}')
+                lines.append(f'rimtalk_tts_phase_seconds_count{{phase="{phase}"}} {h.count}')
+            all_gauges = dict(self._gauges)
+        all_gauges.update(gauges or {})
+        for name, value in sorted(all_gauges.items()):
+            lines.append(f"# TYPE rimtalk_tts_{name} gauge")
+            lines.append(f"rimtalk_tts_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Request fields copied into trace records as they are (the API key and text never are)
+TRACE_PARAMS = ("reference_id", "model", "latency", "speed", "normalize", "temperature", "top_p",
+                "priority", "split", "postprocess", "response_format", "ordered", "max_concurrency", "deadline_ms")
+
+
+def trace_fields(request_data):
+    """Redacted description of a request for the trace: text length and hashes instead of the text and API key"""
+    fields = {}
+    if "command" in request_data:
+        fields["command"] = request_data["command"]
+        return fields
+    text = request_data.get("text")
+    if isinstance(text, str):
+        fields["text_chars"] = len(text)
+        try:
+            fields["params_hash"] = params_hash(synthesis_params(request_data))[:16]
+        except (TypeError, ValueError):
+            pass
+    if request_data.get("api_key"):
+        fields["key_id"] = hashlib.sha256(str(request_data["api_key"]).encode("utf-8")).hexdigest()[:8]
+    params = {name: request_data[name] for name in TRACE_PARAMS if name in request_data}
+    if params:
+        fields["params"] = params
+    lines = request_data.get("lines")
+    if isinstance(lines, list):
+        shared = {k: v for k, v in request_data.items() if k not in ("lines", "ordered", "max_concurrency", "request_id")}
+        fields["lines"] = [trace_fields({**shared, **line}) for line in lines if isinstance(line, dict)]
+    return fields
+
+
+class TraceRecorder:
+    """
+    Opt-in JSONL request trace (--trace) for replaying a session with replay_trace.py
+    
+    One line per request with its arrival time, endpoint, outcome, response
+    size, total and per-phase timings and a redacted description of the
+    request (see trace_fields). Lines are written and flushed by a background
+    thread; the file is moved to <path>.1 once it grows past max_bytes.
+    """
+    
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+    
+    def start(self, **info):
+        """Start the writer thread; info is written in the first record of the trace"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._thread = Thread(target=self._run, name="tts-trace", daemon=True)
+        self._thread.start()
+        self._queue.put(json.dumps({"type": "start", "ts": round(time.time(), 6), "pid": os.getpid(), **info}, separators=(",", ":")))
+    
+    def record(self, trace, endpoint, outcome, bytes_sent, total):
+        # Copy first: a coalesced upstream call may still add phases to the live dict
+        record = {"type": "request", **trace, "phases_ms": dict(trace["phases_ms"])}
+        record.update(endpoint=endpoint, outcome=outcome, bytes=bytes_sent, total_ms=round(total * 1000, 3))
+        self._queue.put(json.dumps(record, separators=(",", ":")))
+    
+    def _run(self):
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    break
+                f.write(line + "\n")
+                f.flush()
+                self.records += 1
+                if f.tell() > self.max_bytes:
+                    f.close()
+                    os.replace(self.path, self.path + ".1")
+                    f = open(self.path, "a", encoding="utf-8")
+        except OSError as e:
+            sys.stderr.write(f"[TTS Server] Trace recording stopped: {e}\n")
+            sys.stderr.flush()
+        finally:
+            f.close()
+    
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+PRIORITY_LEVELS = {"high": 0, "normal": 1, "low": 2, "prefetch": 3}
+PREFETCH_PRIORITY = PRIORITY_LEVELS["prefetch"]
+
+
+def parse_priority(value):
+    """Map a request priority ('high', 'normal', 'low', 'prefetch' or an integer, lower first) to an int"""
+    if isinstance(value, str):
+        return PRIORITY_LEVELS.get(value.lower(), PRIORITY_LEVELS["normal"])
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    return PRIORITY_LEVELS["normal"]
+
+
+class UpstreamScheduler:
+    """
+    Admits upstream calls per API key in priority order
+    
+    Each key has a token bucket (rate calls/second, up to burst) and a cap on
+    concurrent calls. Waiting calls are served lowest priority value first,
+    earliest deadline first within a level (calls without a deadline count as
+    due UPSTREAM_TIMEOUT after they were queued, so they are FIFO among
+    themselves). A 429 pauses the whole key for its Retry-After delay.
+    
+    Prefetch calls (PREFETCH_PRIORITY and below) only use idle capacity: they
+    leave one concurrency slot and half the token bucket to other calls, and
+    a running prefetch is cancelled (preempted) when another call is waiting
+    for its slot. Must only be used from the event loop thread.
+    """
+    
+    def __init__(self, rate=0.0, burst=5, max_concurrency=5, max_retries=3,
+                 backoff_base=0.5, backoff_max=10.0, metrics=None):
+        self.metrics = metrics
+        self.rate = rate  # 0 disables the token bucket
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self.preemptions = 0
+        self._keys = {}
+        self._sequence = itertools.count()
+        self._promoted = weakref.WeakKeyDictionary()  # task -> priority raised by promote()
+    
+    def _state(self, api_key):
+        state = self._keys.get(api_key)
+        if state is None:
+            state = {
+                "tokens": float(self.burst),
+                "refilled": time.monotonic(),
+                "active": 0,
+                "paused_until": 0.0,
+                "queue": [],  # heap of (priority, due, sequence, future)
+                "timer": None,
+                "waiting": {},  # task -> (future of its queued acquire(), due)
+                "preemptible": {}  # running prefetch tasks, oldest first
+            }
+            self._keys[api_key] = state
+        return state
+    
+    def _dispatch(self, api_key):
+        state = self._keys.get(api_key)
+        if state is None:
+            return
+        state["timer"] = None
+        queue = state["queue"]
+        now = time.monotonic()
+        if self.rate > 0:
+            state["tokens"] = min(float(self.burst), state["tokens"] + (now - state["refilled"]) * self.rate)
+        state["refilled"] = now
+        
+        while queue and state["active"] < self.max_concurrency:
+            if queue[0][3].done():
+                # Waiter was cancelled while queued
+                heapq.heappop(queue)
+                continue
+            priority = queue[0][0]
+            if priority >= PREFETCH_PRIORITY and state["active"] >= self.max_concurrency - 1 and self.max_concurrency > 1:
+                # Keep a slot free for real requests; release() dispatches again
+                break
+            needed = 1.0
+            if priority >= PREFETCH_PRIORITY:
+                # Prefetches leave half the burst for real requests, but never need more than a full bucket
+                needed = min(float(self.burst), needed + self.burst / 2.0)
+            wait = state["paused_until"] - now
+            if self.rate > 0 and state["tokens"] < needed:
+                wait = max(wait, (needed - state["tokens"]) / self.rate)
+            if wait > 0:
+                state["timer"] = asyncio.get_running_loop().call_later(wait, self._dispatch, api_key)
+                return
+            future = heapq.heappop(queue)[3]
+            if self.rate > 0:
+                state["tokens"] -= 1.0
+            state["active"] += 1
+            future.set_result(None)
+        
+        self._preempt(state)
+        
+        if not queue and state["active"] == 0 and state["tokens"] >= self.burst and state["paused_until"] <= now:
+            # Idle key with a full bucket and no 429 pause - nothing worth remembering
+            del self._keys[api_key]
+    
+    def _preempt(self, state):
+        """Cancel the newest running prefetch if a more important call is waiting for a slot"""
+        queue = state["queue"]
+        while queue and queue[0][3].done():
+            heapq.heappop(queue)
+        if not queue or queue[0][0] >= PREFETCH_PRIORITY or not state["preemptible"]:
+            return
+        if state["active"] < self.max_concurrency:
+            return
+        task = next(reversed(state["preemptible"]))
+        del state["preemptible"][task]
+        task.cancel()
+        self.preemptions += 1
+        if self.metrics is not None:
+            self.metrics.inc("upstream_preemptions_total")
+    
+    async def acquire(self, api_key, priority=PRIORITY_LEVELS["normal"], deadline=None):
+        """Wait until a call for api_key may start; pair with release()"""
+        task = asyncio.current_task()
+        priority = min(priority, self._promoted.get(task, priority))
+        state = self._state(api_key)
+        future = asyncio.get_running_loop().create_future()
+        due = deadline if deadline is not None else time.monotonic() + UPSTREAM_TIMEOUT
+        heapq.heappush(state["queue"], (priority, due, next(self._sequence), future))
+        state["waiting"][task] = (future, due)
+        if state["timer"] is None:
+            self._dispatch(api_key)
+        started = time.monotonic()
+        try:
+            await future
+            if self.metrics is not None:
+                self.metrics.observe("queue_wait", time.monotonic() - started)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just as we were cancelled - hand it back
+                self.release(api_key)
+            raise
+        finally:
+            state["waiting"].pop(task, None)
+        if min(priority, self._promoted.get(task, priority)) >= PREFETCH_PRIORITY:
+            state["preemptible"][task] = None
+    
+    def release(self, api_key):
+        state = self._keys.get(api_key)
+        if state is None:
+            return
+        state["preemptible"].pop(asyncio.current_task(), None)
+        state["active"] -= 1
+        if state["timer"] is None:
+            self._dispatch(api_key)
+    
+    def promote(self, api_key, task, priority):
+        """
+        Raise the priority of the calls made by task, queued or running
+        
+        Used when a real request joins an in-flight prefetch: the call is
+        moved up the queue and can no longer be preempted.
+        """
+        priority = min(priority, self._promoted.get(task, priority))
+        self._promoted[task] = priority
+        state = self._keys.get(api_key)
+        if state is None:
+            return
+        if priority < PREFETCH_PRIORITY:
+            state["preemptible"].pop(task, None)
+        future, due = state["waiting"].get(task, (None, None))
+        if future is not None and not future.done():
+            # The old heap entry is skipped once the future is resolved
+            heapq.heappush(state["queue"], (priority, due, next(self._sequence), future))
+            if state["timer"] is None:
+                self._dispatch(api_key)
+    
+    def pause(self, api_key, delay):
+        """Hold back every call for api_key for delay seconds (after a 429)"""
+        state = self._state(api_key)
+        state["paused_until"] = max(state["paused_until"], time.monotonic() + delay)
+    
+    def backoff(self, attempt, retry_after=None):
+        """Delay before retry number attempt: Retry-After if given, else jittered exponential"""
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def retry_delay(self, api_key, attempt, error):
+        """
+        Delay before retrying a failed attempt, or None if error should not be retried
+        
+        Rate-limited keys are paused for the delay so queued calls wait as well.
+        """
+        if not isinstance(error, (UpstreamRateLimited, ServerError)) or attempt >= self.max_retries:
+            return None
+        if self.metrics is not None:
+            self.metrics.inc("upstream_retries_total", reason="rate_limited" if isinstance(error, UpstreamRateLimited) else "server_error")
+        delay = self.backoff(attempt, getattr(error, "retry_after", None))
+        if isinstance(error, UpstreamRateLimited):
+            self.pause(api_key, delay)
+        self.retries += 1
+        sys.stderr.write(f"[TTS Server] Upstream call failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s\n")
+        sys.stderr.flush()
+        return delay
+    
+    async def call(self, api_key, priority, fn, deadline=None):
+        """
+        Run fn() under the scheduler, retrying 429s and 5xx errors with backoff
+        
+        Args:
+            api_key: Key whose rate limit and concurrency cap apply
+            priority: Lower values are served first
+            fn: Coroutine function performing one upstream attempt
+            deadline: time.monotonic() the result is needed by, orders calls within a priority level
+        """
+        attempt = 0
+        while True:
+            await self.acquire(api_key, priority, deadline)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self.retry_delay(api_key, attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release(api_key)
+            attempt += 1
+            await asyncio.sleep(delay)
+    
+    def queued(self):
+        """Number of calls waiting for a slot, over all keys; also safe to call from other threads"""
+        return sum(len(state["waiting"]) for state in list(self._keys.values()))
+    
+    def stats(self):
+        queued = {}
+        active = 0
+        for state in self._keys.values():
+            active += state["active"]
+            seen = set()
+            for priority, _, _, future in sorted(state["queue"], key=lambda entry: entry[:3]):
+                if not future.done() and id(future) not in seen:
+                    seen.add(id(future))
+                    name = next((k for k, v in PRIORITY_LEVELS.items() if v == priority), str(priority))
+                    queued[name] = queued.get(name, 0) + 1
+        return {
+            "queue_depth": sum(queued.values()),
+            "queued_by_priority": queued,
+            "active": active,
+            "keys": len(self._keys),
+            "retries": self.retries,
+            "preemptions": self.preemptions,
+            "rate_limit": self.rate,
+            "max_concurrency_per_key": self.max_concurrency
+        }
+
+
+class LatencyModeSelector:
+    """
+    Picks Fish Audio's latency mode for requests sent with latency 'auto'
+    
+    'balanced' returns audio sooner at some cost in quality. It is chosen
+    while queue_depth or more upstream calls are waiting or the recent
+    upstream time to audio (moving average) exceeds slow_seconds, and goes
+    back to 'normal' once the queue is empty and latency is under half of
+    slow_seconds. A request whose deadline leaves less than twice the recent
+    latency gets 'balanced' regardless. Must only be used from the event loop thread.
+    """
+    
+    def __init__(self, queue_depth=3, slow_seconds=3.0, smoothing=0.2, metrics=None):
+        self.queue_depth = max(1, queue_depth)
+        self.slow_seconds = slow_seconds
+        self.smoothing = smoothing
+        self.metrics = metrics
+        self.mode = "normal"
+        self.switches = 0
+        self._latency = None
+    
+    def observe(self, seconds):
+        """Record the time a successful upstream call took to produce audio"""
+        if self._latency is None:
+            self._latency = seconds
+        else:
+            self._latency += self.smoothing * (seconds - self._latency)
+    
+    def expected(self):
+        """Recent upstream time to audio in seconds, or None before the first call"""
+        return self._latency
+    
+    def select(self, queued, remaining=None):
+        """
+        Latency mode for an upstream call about to start
+        
+        Args:
+            queued: Calls currently waiting in the scheduler
+            remaining: Seconds left before the request's deadline, if it has one
+        """
+        latency = self._latency or 0.0
+        if self.mode == "normal" and (queued >= self.queue_depth or latency > self.slow_seconds):
+            self.mode = "balanced"
+            self.switches += 1
+        elif self.mode == "balanced" and queued == 0 and latency < self.slow_seconds / 2:
+            self.mode = "normal"
+            self.switches += 1
+        mode = self.mode
+        if remaining is not None and self._latency is not None and remaining < 2 * self._latency:
+            mode = "balanced"
+        if self.metrics is not None:
+            self.metrics.inc("latency_mode_total", mode=mode)
+        return mode
+    
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "upstream_latency": round(self._latency, 4) if self._latency is not None else None,
+            "switches": self.switches,
+            "queue_depth_threshold": self.queue_depth,
+            "slow_seconds": self.slow_seconds
+        }
+
+
+def is_upstream_outage(error):
+    """Whether error means the Fish Audio API itself is failing (5xx, timeout, connection) rather than the request"""
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status >= 500
+    if isinstance(error, (asyncio.TimeoutError, OSError)):
+        return True
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+class NegativeCache:
+    """
+    Remembers recent auth and unknown-voice failures for ttl seconds
+    
+    A 401 marks the whole API key as failing, a 403 or 404 only the key with
+    that voice and model. Lines hitting a remembered failure get the same
+    error at once instead of another doomed upstream call. Must only be used
+    from the event loop thread.
+    """
+    
+    STATUSES = (401, 403, 404)
+    
+    def __init__(self, ttl=30.0, max_entries=1024, metrics=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self._entries = {}  # (api_key, reference_id, model) -> (expires, message)
+    
+    @staticmethod
+    def _keys(job):
+        return (job.api_key, None, None), (job.api_key, job.reference_id, job.model)
+    
+    def get(self, job):
+        """Error message of a remembered failure that applies to job, or None"""
+        now = time.monotonic()
+        for key in self._keys(job):
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if entry[0] <= now:
+                del self._entries[key]
+                continue
+            if self.metrics is not None:
+                self.metrics.inc("negative_cache_total", outcome="hit")
+            return entry[1]
+        return None
+    
+    def put(self, job, error, message):
+        """Remember error for job if it is an auth or unknown-voice failure"""
+        status = getattr(error, "status", None)
+        if self.ttl <= 0 or status not in self.STATUSES:
+            return
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        key = self._keys(job)[0 if status == 401 else 1]
+        self._entries[key] = (now + self.ttl, message)
+        if self.metrics is not None:
+            self.metrics.inc("negative_cache_total", outcome="stored")
+    
+    def stats(self):
+        now = time.monotonic()
+        return {"entries": sum(1 for expires, _ in self._entries.values() if expires > now), "ttl": self.ttl}
+
+
+class CircuitBreaker:
+    """
+    Per upstream host circuit breaker
+    
+    After failure_threshold consecutive outage errors (see is_upstream_outage)
+    the circuit opens and calls fail at once with UpstreamUnavailable. Once
+    the reset timeout has passed, one call at a time is let through as a
+    probe (half-open): a response closes the circuit again, another outage
+    reopens it with the timeout doubled, up to max_reset_timeout. Any
+    response from the host, including 4xx errors, counts as a success. Must
+    only be used from the event loop thread.
+    """
+    
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+    
+    def __init__(self, failure_threshold=5, reset_timeout=10.0, max_reset_timeout=60.0, metrics=None):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max(reset_timeout, max_reset_timeout)
+        self.metrics = metrics
+        self._hosts = {}
+    
+    def _set_state(self, host, state, name):
+        state["state"] = name
+        if self.metrics is not None:
+            self.metrics.inc("circuit_transitions_total", state=name)
+        sys.stderr.write(f"[TTS Server] Upstream circuit for {host} is now {name.replace('_', '-')}\n")
+        sys.stderr.flush()
+    
+    def _open(self, host, state, timeout):
+        state.update(timeout=timeout, retry_at=time.monotonic() + timeout, probing=False)
+        self._set_state(host, state, "open")
+    
+    def check(self, host):
+        """
+        Fail fast while calls to host are being refused
+        
+        Raises:
+            UpstreamUnavailable: The circuit is open, or half-open with its probe in flight
+        """
+        state = self._hosts.get(host)
+        if state is None or state["state"] == "closed":
+            return
+        retry_after = state["retry_at"] - time.monotonic()
+        if (state["state"] == "open" and retry_after > 0) or state["probing"]:
+            raise UpstreamUnavailable(max(retry_after, 1.0))
+    
+    def allow(self, host):
+        """
+        check(), then take the probe if the circuit is due for one; pair with record()
+        
+        Returns:
+            Whether this call is the half-open probe
+        """
+        self.check(host)
+        state = self._hosts.get(host)
+        if state is None or state["state"] == "closed":
+            return False
+        if state["state"] == "open":
+            self._set_state(host, state, "half_open")
+        state["probing"] = True
+        return True
+    
+    def record(self, host, error=None, probe=False):
+        """Record the outcome of an upstream call (error None: success) started after allow()"""
+        state = self._hosts.get(host)
+        if error is not None and not isinstance(error, Exception):
+            # Cancelled: says nothing about the host, but frees the probe
+            if probe and state is not None:
+                state["probing"] = False
+            return
+        if error is None or not is_upstream_outage(error):
+            if state is not None and (probe or state["state"] == "closed"):
+                del self._hosts[host]
+                if probe:
+                    self._set_state(host, state, "closed")
+            return
+        if state is None:
+            state = self._hosts[host] = {"state": "closed", "failures": 0, "timeout": self.reset_timeout,
+                                         "retry_at": 0.0, "probing": False}
+        if probe:
+            self._open(host, state, min(self.max_reset_timeout, state["timeout"] * 2))
+        elif state["state"] == "closed":
+            state["failures"] += 1
+            if state["failures"] >= self.failure_threshold:
+                self._open(host, state, self.reset_timeout)
+    
+    def open_hosts(self):
+        return sum(1 for state in self._hosts.values() if state["state"] != "closed")
+    
+    def stats(self):
+        now = time.monotonic()
+        return {
+            host: {
+                "state": state["state"],
+                "failures": state["failures"],
+                "retry_after": round(max(0.0, state["retry_at"] - now), 1) if state["state"] != "closed" else 0.0
+            }
+            for host, state in self._hosts.items()
+        }
+
+
+class AdmissionControl:
+    """
+    Bounds what a burst of requests can pile onto the server
+    
+    Limits the size of a request body, the requests being worked on and the
+    bytes buffered for their request and response bodies (buffered responses
+    hold whole clips; streamed ones are sent chunk by chunk and not counted).
+    Front ends check body_allowed() before reading a body and acquire() before
+    dispatching; a refused request gets an immediate overloaded response
+    instead of queueing, so memory and threads stay bounded under load. A limit
+    of 0 disables it. Thread-safe (the threaded front end calls it from its
+    handler threads).
+    """
+    
+    def __init__(self, max_body_bytes=1024 * 1024, max_in_flight=64, max_buffered_bytes=64 * 1024 * 1024, metrics=None):
+        self.max_body_bytes = max_body_bytes
+        self.max_in_flight = max_in_flight
+        self.max_buffered_bytes = max_buffered_bytes
+        self.metrics = metrics
+        self.in_flight = 0
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self._lock = Lock()
+    
+    def _count(self, outcome):
+        if self.metrics is not None:
+            self.metrics.inc("admission_total", outcome=outcome)
+    
+    def body_allowed(self, length):
+        """Whether a request body of length bytes may be read"""
+        if self.max_body_bytes and length > self.max_body_bytes:
+            self._count("body_too_large")
+            return False
+        return True
+    
+    def acquire(self, body_bytes):
+        """
+        Admit a request whose body holds body_bytes; pair with release()
+        
+        Returns:
+            None when admitted, else the exhausted limit ("in_flight" or "buffered_bytes")
+        """
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                reason = "in_flight"
+            elif (self.max_buffered_bytes and self.in_flight
+                  and self.buffered_bytes + body_bytes > self.max_buffered_bytes):
+                # A lone request is always let in, even if it is larger than the budget
+                reason = "buffered_bytes"
+            else:
+                self.in_flight += 1
+                self.buffered_bytes += body_bytes
+                self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+                reason = None
+        self._count(reason or "admitted")
+        return reason
+    
+    def hold(self, nbytes):
+        """Count nbytes more buffered for an admitted request (its response body)"""
+        with self._lock:
+            self.buffered_bytes += nbytes
+            self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+    
+    def release(self, nbytes):
+        """Finish an admitted request that buffered nbytes in total"""
+        with self._lock:
+            self.in_flight -= 1
+            self.buffered_bytes -= nbytes
+    
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "max_in_flight": self.max_in_flight,
+            "max_buffered_bytes": self.max_buffered_bytes,
+            "max_body_bytes": self.max_body_bytes
+        }
+
+
+class PrefetchQueue:
+    """
+    Lines expected to be needed soon, rendered into the audio cache in idle capacity
+    
+    Lines are queued per API key and taken round-robin by a few worker tasks
+    that synthesize them at PREFETCH_PRIORITY, so the scheduler admits real
+    requests first and may preempt a running prefetch (which is requeued).
+    Each key has a budget of upstream calls per minute (a token bucket) and
+    a queue size limit. Must only be used from the event loop thread.
+    """
+    
+    def __init__(self, backend, concurrency=2, budget_per_minute=20, max_queued=64, max_attempts=3):
+        self.backend = backend
+        self.concurrency = max(0, concurrency)
+        self.budget_per_minute = budget_per_minute
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self._queues = OrderedDict()  # api_key -> deque of [request_data, cache_key, attempts]
+        self._budgets = {}  # api_key -> (tokens, refilled)
+        self._pending = set()  # (api_key, cache_key) queued or running
+        self._wakeup = None
+        self._workers = []
+        self._closed = False
+        self.counts = {}
+    
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+    
+    async def stop(self):
+        self._closed = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    def _count(self, outcome, value=1):
+        self.counts[outcome] = self.counts.get(outcome, 0) + value
+        self.backend.metrics.inc("prefetch_total", value, outcome=outcome)
+    
+    def add(self, lines):
+        """
+        Queue lines for prefetching
+        
+        Lines that are invalid, already cached, already queued or over the
+        key's queue limit are skipped. Split lines are queued per segment.
+        
+        Returns:
+            Dictionary with the number of lines per outcome
+        """
+        result = {"queued": 0, "cached": 0, "duplicate": 0, "rejected": 0, "invalid": 0}
+        for line in lines:
+            job = SynthesisJob(line, self.backend.cache)
+            if job.error or not job.use_cache:
+                result["invalid"] += 1
+                continue
+            for text in job.segments():
+                segment = segment_request(line, text)
+                segment["priority"] = PREFETCH_PRIORITY
+                segment.pop("request_id", None)
+                cache_key = params_hash(synthesis_params(segment))
+                queue = self._queues.setdefault(job.api_key, deque())
+                if (job.api_key, cache_key) in self._pending:
+                    result["duplicate"] += 1
+                elif self.backend.cache.contains(cache_key):
+                    result["cached"] += 1
+                elif len(queue) >= self.max_queued:
+                    result["rejected"] += 1
+                else:
+                    queue.append([segment, cache_key, 0])
+                    self._pending.add((job.api_key, cache_key))
+                    result["queued"] += 1
+                if not queue:
+                    del self._queues[job.api_key]
+        for outcome, value in result.items():
+            if value and outcome != "queued":
+                self._count(outcome, value)
+        if result["queued"] and self._wakeup is not None:
+            self._wakeup.set()
+        return result
+    
+    def _take_budget(self, api_key, now):
+        """Spend one call of api_key's budget; returns seconds until one is available if there is none"""
+        rate = self.budget_per_minute / 60.0
+        tokens, refilled = self._budgets.get(api_key, (float(self.budget_per_minute), now))
+        tokens = min(float(self.budget_per_minute), tokens + (now - refilled) * rate)
+        if tokens < 1.0:
+            self._budgets[api_key] = (tokens, now)
+            return (1.0 - tokens) / rate if rate > 0 else None
+        self._budgets[api_key] = (tokens - 1.0, now)
+        return 0.0
+    
+    def _refund_budget(self, api_key):
+        tokens, refilled = self._budgets.get(api_key, (0.0, time.monotonic()))
+        self._budgets[api_key] = (min(float(self.budget_per_minute), tokens + 1.0), refilled)
+    
+    def _next(self):
+        """
+        Take the next line of the first key (round-robin) that has budget left
+        
+        Returns:
+            Tuple of (api_key, item), or (None, seconds to wait or None)
+        """
+        now = time.monotonic()
+        wait = None
+        for api_key in list(self._queues):
+            delay = self._take_budget(api_key, now)
+            if delay == 0.0:
+                queue = self._queues.pop(api_key)
+                item = queue.popleft()
+                if queue:
+                    # Re-insert at the end so keys take turns
+                    self._queues[api_key] = queue
+                return api_key, item
+            if delay is not None:
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+    
+    async def _work(self):
+        while True:
+            api_key, item = self._next()
+            if api_key is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=item)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(api_key, item)
+    
+    async def _run(self, api_key, item):
+        request_data, cache_key, attempts = item
+        try:
+            result = await self.backend.synthesize(request_data)
+        except asyncio.CancelledError:
+            if self._closed:
+                raise
+            # Preempted by a real request - try again later unless it keeps happening
+            item[2] += 1
+            if item[2] < self.max_attempts:
+                self._queues.setdefault(api_key, deque()).appendleft(item)
+                self._count("preempted")
+                return
+            self._pending.discard((api_key, cache_key))
+            self._count("dropped")
+            return
+        self._pending.discard((api_key, cache_key))
+        if not result.get("success"):
+            # Likely a bad key or voice - don't spend the rest of the budget on it
+            dropped = self._queues.pop(api_key, ())
+            for other in dropped:
+                self._pending.discard((api_key, other[1]))
+            self._count("error")
+            if dropped:
+                self._count("dropped", len(dropped))
+            sys.stderr.write(f"[TTS Server] Prefetch failed, dropped {len(dropped)} queued lines: {result.get('error')}\n")
+            sys.stderr.flush()
+        elif result.get("cache") == "hit" or result.get("coalesced"):
+            self._refund_budget(api_key)
+            self._count("cached")
+        else:
+            self._count("rendered")
+    
+    def stats(self):
+        return {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "pending": len(self._pending),
+            "workers": self.concurrency,
+            "budget_per_minute": self.budget_per_minute,
+            "counts": dict(self.counts)
+        }
+
+
+class TTSBackend:
+    """Shared state for all requests: event loop, upstream client pool, scheduler, audio cache and spool"""
+    
+    def __init__(self, base_url=DEFAULT_BASE_URL, idle_timeout=300.0, cache=None, batch_concurrency=4,
+                 scheduler=None, prefetch_concurrency=2, prefetch_budget=20, prefetch_queue_size=64, spool=None,
+                 trace=None, latency_mode=None, negative_cache=None, breaker=None, admission=None):
+        self.base_url = base_url
+        self.cache = cache
+        self.spool = spool
+        self.trace = trace
+        self.peers = None  # WorkerLink to the other --workers processes, if any
+        self.metrics = Metrics()
+        self.scheduler = scheduler or UpstreamScheduler()
+        self.scheduler.metrics = self.metrics
+        self.latency_mode = latency_mode or LatencyModeSelector()
+        self.latency_mode.metrics = self.metrics
+        self.negative_cache = negative_cache or NegativeCache()
+        self.negative_cache.metrics = self.metrics
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.metrics = self.metrics
+        self.admission = admission or AdmissionControl()
+        self.admission.metrics = self.metrics
+        self.upstream_host = urlparse(base_url).netloc
+        self.batch_concurrency = batch_concurrency
+        self._inflight = {}  # (api_key, cache key) -> [upstream task, waiter count, priority, job]
+        self._requests = {}  # request_id -> task, for cancellation
+        self.loop_thread = EventLoopThread()
+        self.client_pool = UpstreamClientPool(idle_timeout=idle_timeout)
+        self.prefetch = PrefetchQueue(self, prefetch_concurrency, prefetch_budget, prefetch_queue_size) if cache is not None else None
+        self._evictor = None
+    
+    async def _start_prefetch(self):
+        self.prefetch.start()
+    
+    def start(self):
+        self.loop_thread.start()
+        self._evictor = self.loop_thread.submit(self.client_pool.run_evictor())
+        if self.prefetch is not None:
+            self.loop_thread.run(self._start_prefetch())
+    
+    def warm_up(self):
+        """Open the upstream connection in the background (after the socket is bound, so it does not delay it)"""
+        self.loop_thread.submit(self.client_pool.warm_up(self.base_url))
+    
+    def stop(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+        try:
+            if self.prefetch is not None:
+                self.loop_thread.run(self.prefetch.stop(), timeout=5)
+            if self.spool is not None:
+                self.loop_thread.loop.call_soon_threadsafe(self.spool.close)
+            if self.trace is not None:
+                self.trace.close()
+            self.loop_thread.run(self.client_pool.close(), timeout=5)
+        except Exception as e:
+            sys.stderr.write(f"[TTS Server] Error closing upstream clients: {e}\n")
+        self.loop_thread.stop()
+    
+    def run(self, coro, timeout=None):
+        return self.loop_thread.run(coro, timeout)
+    
+    async def run_tracked(self, request_id, coro):
+        """
+        Run a request coroutine as a task that cancel(request_id) can abort
+        
+        Raises:
+            RequestCancelled: The request was cancelled through cancel()
+        """
+        if request_id is None:
+            return await coro
+        task = asyncio.ensure_future(coro)
+        self._requests[request_id] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            raise RequestCancelled(f"Request '{request_id}' was cancelled")
+        finally:
+            if self._requests.get(request_id) is task:
+                del self._requests[request_id]
+    
+    async def run_with_deadline(self, deadline, coro):
+        """
+        Await coro, cancelling it (and the upstream work it waits on) once deadline passes
+        
+        Raises:
+            DeadlineExceeded: The deadline passed first
+        """
+        if deadline is None:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro, deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            self.metrics.inc("deadline_total", outcome="expired")
+            raise DeadlineExceeded("Request deadline passed before the audio was ready") from None
+    
+    def _check_upstream(self, job):
+        """
+        Fail job fast, before it queues, if its upstream call is known to fail
+        
+        Raises:
+            SynthesisError: The key or voice failed recently (negative cache)
+            UpstreamUnavailable: The circuit breaker is open
+        """
+        message = self.negative_cache.get(job)
+        if message is not None:
+            raise SynthesisError(message)
+        self.breaker.check(self.upstream_host)
+    
+    def _prepare_call(self, job):
+        """
+        Last step before an upstream call for job: drop it if its deadline can no
+        longer be met, resolve the 'auto' latency mode and pass the circuit breaker
+        
+        Returns:
+            Whether the call is the circuit breaker's probe, for breaker.record()
+        
+        Raises:
+            DeadlineExceeded: The deadline leaves too little time for the call
+            UpstreamUnavailable: The circuit breaker is open
+        """
+        remaining = job.remaining()
+        expected = self.latency_mode.expected()
+        if remaining is not None and (remaining <= 0 or (expected is not None and remaining < DEADLINE_DROP_FRACTION * expected)):
+            self.metrics.inc("deadline_total", outcome="dropped")
+            raise DeadlineExceeded(f"Dropped: {max(remaining, 0.0):.1f}s left before the deadline, "
+                                   f"upstream calls currently take {expected or 0.0:.1f}s")
+        probe = self.breaker.allow(self.upstream_host)
+        if job.adaptive:
+            job.latency = self.latency_mode.select(self.scheduler.queued(), remaining)
+        return probe
+    
+    async def cancel(self, request_id):
+        """Cancel a running request and its upstream call; returns whether it was found"""
+        task = self._requests.get(request_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+    
+    async def gauges(self):
+        """Point-in-time gauges for the metrics endpoint"""
+        scheduler = self.scheduler.stats()
+        gauges = {
+            "queue_depth": scheduler["queue_depth"],
+            "latency_mode_balanced": 1 if self.latency_mode.mode == "balanced" else 0,
+            "upstream_circuits_open": self.breaker.open_hosts(),
+            "admission_buffered_bytes": self.admission.buffered_bytes,
+            "upstream_active": scheduler["active"],
+            "upstream_inflight_unique": len(self._inflight),
+            "tracked_requests": len(self._requests)
+        }
+        if self.prefetch is not None:
+            gauges["prefetch_queued"] = self.prefetch.stats()["queued"]
+        if self.spool is not None:
+            spool = self.spool.stats()
+            gauges.update({
+                "spool_bytes": spool["used_bytes"],
+                "spool_leases": spool["leases"]
+            })
+        if self.cache is not None:
+            cache = self.cache.stats()
+            gauges.update({
+                "cache_entries": cache["entries"],
+                "cache_bytes": cache["bytes"],
+                "cache_hit_rate": round(cache["hit_rate"], 4),
+                "cache_hits": cache["hits"],
+                "cache_misses": cache["misses"]
+            })
+        return gauges
+    
+    def start_trace(self, method, target):
+        """
+        Begin the trace record of a request arriving now; called by the front end
+        before dispatch() so everything the request runs records its phases into it
+        
+        Returns:
+            The trace dictionary, or None when tracing is off
+        """
+        trace = None
+        if self.trace is not None:
+            trace = {"ts": round(time.time(), 6), "method": method, "path": urlparse(target).path, "phases_ms": {}}
+        _request_trace.set(trace)
+        return trace
+    
+    def admit(self, method, target, body):
+        """
+        Admission control for a request whose body has been read; called by the front ends before dispatch()
+        
+        Status, metrics and commands (cancel, release, shutdown) are never refused, so
+        they keep working while the server is overloaded.
+        
+        Returns:
+            (reserved, refused): bytes to hand to finish_admitted() once the response is
+            written (None when the request was not admitted), and the response to send
+            instead of dispatching if it was refused
+        """
+        if not admission_applies(method, target, body):
+            return None, None
+        reason = self.admission.acquire(len(body))
+        if reason is not None:
+            return None, self.overloaded_response(reason)
+        return len(body), None
+    
+    def hold_response(self, reserved, response):
+        """Count a buffered response body against the admitted request until it is written"""
+        if reserved is None or response.chunks is not None:
+            return reserved
+        self.admission.hold(len(response.body))
+        return reserved + len(response.body)
+    
+    def finish_admitted(self, reserved):
+        if reserved is not None:
+            self.admission.release(reserved)
+    
+    def overloaded_response(self, reason, body_bytes=0):
+        """
+        Immediate answer to a request refused by admission control: 413 for a body
+        over the size limit, else 503 with a retry hint and the current queue depth
+        """
+        if reason == "body_too_large":
+            return HttpResponse.json(413, {
+                "success": False,
+                "error": f"Request body of {body_bytes} bytes exceeds the {self.admission.max_body_bytes} byte limit"
+            }, endpoint="unknown", outcome="rejected")
+        queue_depth = self.scheduler.queued()
+        # Roughly when the work ahead of it has drained: recent upstream latency, at least a second
+        retry_after = max(1, math.ceil(self.latency_mode.expected() or 1.0))
+        return HttpResponse.json(503, {
+            "success": False,
+            "overloaded": True,
+            "error": f"Server overloaded ({reason.replace('_', ' ')} limit reached), retry in {retry_after}s",
+            "retry_after": retry_after,
+            "queue_depth": queue_depth,
+            "in_flight": self.admission.in_flight
+        }, headers={"Retry-After": str(retry_after), "X-Queue-Depth": str(queue_depth)},
+            endpoint="unknown", outcome="overloaded")
+    
+    def record_request(self, endpoint, outcome, bytes_sent, started, trace=None):
+        """Record request metrics (and the trace record, if any) once a front end has finished a response"""
+        if endpoint == "unknown" and outcome == "disconnected":
+            return
+        total = time.monotonic() - started
+        if trace is not None:
+            self.trace.record(trace, endpoint, outcome, bytes_sent, total)
+        self.metrics.inc("requests_total", endpoint=endpoint, outcome=outcome)
+        self.metrics.inc("bytes_served_total", bytes_sent)
+        self.metrics.observe("total", total)
+    
+    async def dispatch(self, method, target, headers, body):
+        """
+        Route one HTTP request; shared by the threaded and asyncio front ends
+        
+        Args:
+            method: "GET" or "POST"
+            target: Request target (path and query)
+            headers: Mapping with case-insensitive get()
+            body: Raw request body
+        
+        Returns:
+            HttpResponse
+        """
+        if not deferred_imports.loaded:
+            # Requests that arrive right after startup wait for the SDK import to finish
+            await asyncio.to_thread(deferred_imports.wait)
+        
+        url = urlparse(target)
+        path = url.path.rstrip('/')
+        
+        if method == "GET":
+            if path == '/status':
+                return HttpResponse.json(200, await self.status(), endpoint="status")
+            if path == '/metrics':
+                gauges = await self.gauges()
+                if parse_qs(url.query).get("format", [""])[0] == "json":
+                    return HttpResponse.json(200, self.metrics.snapshot(gauges), endpoint="metrics")
+                return HttpResponse(200, self.metrics.render_prometheus(gauges).encode(),
+                                    content_type='text/plain; version=0.0.4', endpoint="metrics")
+            return HttpResponse.json(404, {"success": False, "error": f"Unknown path: {target}"}, endpoint="unknown", outcome="error")
+        
+        if method != "POST":
+            return HttpResponse.json(405, {"success": False, "error": f"Method not allowed: {method}"}, endpoint="unknown", outcome="error")
+        
+        request_data = json.loads(body.decode('utf-8'))
+        request_id = request_data.get("request_id")
+        trace = _request_trace.get()
+        if trace is not None:
+            trace.update(trace_fields(request_data))
+        
+        # Handle shutdown request
+        if request_data.get("command") == "shutdown":
+            response = HttpResponse.json(200, {"success": True, "message": "Shutting down"}, endpoint="command")
+            response.shutdown = True
+            if self.peers is not None:
+                self.peers.send("shutdown")
+            return response
+        
+        # Cancel a running request by its ID (it may be running in another worker process)
+        if request_data.get("command") == "cancel" or path == '/cancel':
+            cancelled = await self.cancel(request_data.get("request_id"))
+            if not cancelled and self.peers is not None:
+                self.peers.send("cancel", request_data.get("request_id"))
+            return HttpResponse.json(200, {"success": True, "cancelled": cancelled}, endpoint="command")
+        
+        # Release spool leases once the client has read the audio
+        if request_data.get("command") == "release":
+            released = self.spool.release(request_data.get("leases") or []) if self.spool is not None else 0
+            return HttpResponse.json(200, {"success": True, "released": released}, endpoint="command")
+        
+        try:
+            # Streaming endpoint: forward audio chunks as they are synthesized
+            if path == '/stream':
+                deadline, error = parse_deadline(request_data)
+                if error:
+                    return HttpResponse.json(400, {"success": False, "error": error}, endpoint="stream", outcome="error")
+                _request_deadline.set(deadline)
+                result, chunks = await self.run_tracked(request_id, self.run_with_deadline(deadline, self.open_stream(request_data)))
+                if trace is not None:
+                    trace["cache"] = result.get("cache")
+                if chunks is None:
+                    return error_response(result, endpoint="stream")
+                return HttpResponse(200, content_type='audio/wav', headers={'X-Cache': result.get("cache", "bypass")},
+                                    chunks=chunks, request_id=request_id, endpoint="stream")
+            
+            # Prefetch endpoint: queue lines for background rendering into the cache
+            if path == '/prefetch':
+                result = self.open_prefetch(request_data)
+                return HttpResponse.json(200 if result.get("success") else 400, result, endpoint="prefetch",
+                                         outcome="success" if result.get("success") else "error")
+            
+            # Batch endpoint: one JSON result per line (NDJSON), streamed as lines finish
+            if path == '/batch':
+                result, results = await self.run_tracked(request_id, self.open_batch(request_data))
+                if results is None:
+                    return HttpResponse.json(400, result, endpoint="batch", outcome="error")
+                return HttpResponse(200, content_type='application/x-ndjson', headers={'X-Batch-Count': str(result["count"])},
+                                    chunks=results, encode=lambda r: (json.dumps(encode_json_result(r)) + "\n").encode(),
+                                    request_id=request_id, endpoint="batch")
+            
+            # Process TTS request on the shared event loop
+            deadline, error = parse_deadline(request_data)
+            if error:
+                return HttpResponse.json(400, {"success": False, "error": error}, outcome="error")
+            _request_deadline.set(deadline)
+            binary = wants_binary_response(headers, request_data)
+            response = await self.run_tracked(request_id, self.run_with_deadline(deadline, self.synthesize(request_data)))
+        except RequestCancelled as e:
+            return HttpResponse.json(400, {"success": False, "cancelled": True, "error": str(e)}, outcome="cancelled")
+        except DeadlineExceeded as e:
+            return error_response(error_result(e), endpoint="stream" if path == '/stream' else "tts")
+        
+        if request_id is not None:
+            response["request_id"] = request_id
+        if trace is not None:
+            trace.update(cache=response.get("cache"), coalesced=response.get("coalesced", False), binary=binary)
+        
+        # Spool handoff: the client reads the audio from the shared file; falls back to inline audio when full
+        if request_data.get("response_format") == "spool" and response.get("success") and self.spool is not None:
+            spooled = self.spool.lease(spool_key(request_data), response["audio_bytes"])
+            self.metrics.inc("spool_total", outcome="spooled" if spooled is not None else "full")
+            if spooled is not None:
+                result = {"success": True, "size": spooled["length"], "cache": response.get("cache", "bypass"), "spool": spooled}
+                if request_id is not None:
+                    result["request_id"] = request_id
+                return HttpResponse.json(200, result)
+        
+        # Send response - errors are always JSON so clients can report them
+        if binary and response.get("success"):
+            encode_started = time.monotonic()
+            audio_bytes = response["audio_bytes"]
+            wav_response = HttpResponse(200, audio_bytes, content_type='audio/wav', headers={
+                'X-Audio-Size': str(len(audio_bytes)),
+                'X-Cache': response.get("cache", "bypass")
+            })
+            self.metrics.observe("encode", time.monotonic() - encode_started)
+            return wav_response
+        
+        if not response.get("success"):
+            return error_response(response)
+        encode_started = time.monotonic()
+        body = encode_json_body(response)
+        self.metrics.observe("encode", time.monotonic() - encode_started)
+        return HttpResponse(200, body)
+    
+    async def status(self):
+        return {
+            "success": True,
+            "pid": os.getpid(),
+            "scheduler": self.scheduler.stats(),
+            "latency_mode": self.latency_mode.stats(),
+            "circuit": self.breaker.stats(),
+            "negative_cache": self.negative_cache.stats(),
+            "admission": self.admission.stats(),
+            "inflight": len(self._inflight),
+            "requests": len(self._requests),
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "prefetch": self.prefetch.stats() if self.prefetch is not None else None,
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "postprocess_available": np is not None
+        }
+    
+    async def handle_tts_request(self, request_data):
+        """
+        Convert text to speech and return the legacy JSON result with base64 audio
+        
+        Args:
+            request_data: Dictionary with api_key, text, reference_id, etc.
+        
+        Returns:
+            Dictionary with success status and audio data or error
+        """
+        return encode_json_result(await self.synthesize(request_data))
+    
+    async def synthesize(self, request_data):
+        """
+        Convert text to speech asynchronously with timeout protection
+        
+        Args:
+            request_data: Dictionary with api_key, text, reference_id, etc.
+        
+        Returns:
+            Dictionary with success status and raw audio_bytes or error
+        """
+        try:
+            job = SynthesisJob(request_data, self.cache)
+            if job.error:
+                return {"success": False, "error": job.error}
+            
+            # Long lines are synthesized as concurrent segments and stitched
+            segments = job.segments()
+            if len(segments) > 1:
+                return await self._postprocess(job, await self._synthesize_segments(request_data, segments, job.split))
+            
+            # Serve repeated lines from the audio cache without calling the API
+            if job.use_cache:
+                cached = await asyncio.to_thread(self.cache.get, job.cache_key)
+                if cached is not None:
+                    return await self._postprocess(job, {
+                        "success": True,
+                        "audio_bytes": cached,
+                        "size": len(cached),
+                        "cache": "hit"
+                    })
+            
+            # Identical requests already in flight share one upstream call
+            try:
+                audio_bytes, coalesced = await self._fetch_coalesced(job)
+            except SynthesisError as e:
+                return error_result(e)
+            
+            result = {
+                "success": True,
+                "audio_bytes": audio_bytes,
+                "size": len(audio_bytes),
+                "cache": "miss" if job.use_cache else "bypass"
+            }
+            if coalesced:
+                result["coalesced"] = True
+            return await self._postprocess(job, result)
+            
+        except Exception as e:
+            import traceback
+            return {
+                "success": False,
+                "error": str(e),
+                "traceback": traceback.format_exc()
+            }
+    
+    async def _fetch_coalesced(self, job):
+        """
+        Fetch audio for job, joining an identical upstream call if one is in flight
+        
+        The shared call is shielded from waiter cancellation and only cancelled
+        once every waiter has gone away.
+        
+        Returns:
+            Tuple of (audio bytes, whether an existing call was joined)
+        """
+        key = (job.api_key, job.cache_key)
+        entry = self._inflight.get(key)
+        coalesced = entry is not None
+        if entry is None:
+            task = asyncio.ensure_future(self._fetch_audio(job))
+            entry = [task, 0, job.priority, job]
+            self._inflight[key] = entry
+            
+            def _forget(_, key=key, entry=entry):
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+            task.add_done_callback(_forget)
+        elif job.priority < entry[2]:
+            # A more urgent request joined (e.g. a real request joining a prefetch)
+            entry[2] = job.priority
+            self.scheduler.promote(job.api_key, entry[0], job.priority)
+        if coalesced:
+            # The shared call is only dropped for a deadline none of its waiters can still meet
+            entry[3].extend_deadline(job.deadline)
+        
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0]), coalesced
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if entry[1] == 0:
+                # Forget the call now so an identical request starts a fresh one
+                # instead of joining a call that is already cancelled
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                entry[0].cancel()
+            raise
+    
+    def _record_upstream(self, timing):
+        if "ttfb" in timing:
+            self.metrics.observe("upstream_ttfb", timing["ttfb"])
+        self.metrics.observe("upstream_total", time.monotonic() - timing["start"])
+    
+    async def _fetch_audio(self, job):
+        """
+        Call the Fish Audio API for job and store the result in the cache
+        
+        Raises:
+            SynthesisError: For expected failures with a user-facing message
+        """
+        # Reuse a pooled client so the upstream connection stays warm
+        client = self.client_pool.get(job.api_key, self.base_url)
+        
+        async def convert():
+            probe = self._prepare_call(job)
+            timing = {"start": time.monotonic()}
+            _upstream_timing.set(timing)
+            try:
+                # Convert text to speech with timeout (45 seconds max - increased for slow networks)
+                audio_data = await asyncio.wait_for(
+                    client.tts.convert(text=job.text, config=job.config(), model=job.model),
+                    timeout=UPSTREAM_TIMEOUT
+                )
+            except BaseException as error:
+                self.breaker.record(self.upstream_host, error, probe)
+                raise
+            finally:
+                self._record_upstream(timing)
+            self.breaker.record(self.upstream_host, probe=probe)
+            self.latency_mode.observe(time.monotonic() - timing["start"])
+            return audio_data
+        
+        self._check_upstream(job)
+        try:
+            audio_data = await self.scheduler.call(job.api_key, job.priority, convert, job.deadline)
+        except asyncio.TimeoutError:
+            raise SynthesisError("TTS generation timed out after 45 seconds. This may be due to slow network or Fish Audio API issues.")
+        except SynthesisError:
+            raise
+        except Exception as api_error:
+            # Catch specific API errors
+            error_msg = describe_upstream_error(api_error, job.reference_id)
+            if error_msg is None:
+                raise  # Re-raise unknown errors to be caught by outer exception handler
+            self.negative_cache.put(job, api_error, error_msg)
+            raise SynthesisError(error_msg)
+        
+        # Collect all chunks if it's a stream
+        if hasattr(audio_data, 'collect'):
+            audio_bytes = audio_data.collect()
+        else:
+            audio_bytes = audio_data
+        
+        # Ensure audio_bytes is bytes type
+        if not isinstance(audio_bytes, bytes):
+            # Try to convert to bytes if it's a different type
+            if isinstance(audio_bytes, (list, tuple)):
+                audio_bytes = b''.join(audio_bytes)
+            else:
+                raise SynthesisError(f"Invalid audio data type: {type(audio_bytes).__name__}")
+        
+        # Validate audio data
+        if len(audio_bytes) == 0:
+            raise SynthesisError("Audio data is empty")
+        
+        if job.use_cache:
+            await asyncio.to_thread(self.cache.put, job.cache_key, audio_bytes)
+        
+        return audio_bytes
     
-    async def handle_tts_request(self, request_data):
+    async def _synthesize_segments(self, request_data, segments, split):
         """
-        Convert text to speech asynchronously with timeout protection
+        Synthesize text segments concurrently with the same voice and config and stitch them
         
-        Args:
-            request_data: Dictionary with api_key, text, reference_id, etc.
+        Each segment is an ordinary synthesis, so segments are cached,
+        coalesced and scheduled (per-key concurrency) individually.
+        """
+        results = await asyncio.gather(*(
+            self.synthesize(segment_request(request_data, text)) for text in segments
+        ))
+        failed = next((result for result in results if not result.get("success")), None)
+        if failed is not None:
+            return failed
+        try:
+            audio_bytes = WavStitcher(split["crossfade_ms"]).join([result["audio_bytes"] for result in results])
+        except ValueError as e:
+            return {"success": False, "error": f"Could not stitch audio segments: {e}"}
+        caches = {result.get("cache") for result in results}
+        return {
+            "success": True,
+            "audio_bytes": audio_bytes,
+            "size": len(audio_bytes),
+            "cache": caches.pop() if len(caches) == 1 else "miss",
+            "segments": len(segments)
+        }
+    
+    async def _stream_segments(self, first, tasks, split):
+        """Yield stitched audio of segments in order, each as soon as it and the ones before it are done"""
+        stitcher = WavStitcher(split["crossfade_ms"])
+        yield stitcher.add(first["audio_bytes"])
+        for task in tasks:
+            result = await task
+            if not result.get("success"):
+                raise SynthesisError(result.get("error"))
+            yield stitcher.add(result["audio_bytes"])
+        tail = stitcher.finish()
+        if tail:
+            yield tail
+    
+    async def _open_segment_stream(self, request_data, segments, split):
+        tasks = [asyncio.ensure_future(self.synthesize(segment_request(request_data, text))) for text in segments]
+        
+        async def cancel_pending():
+            for task in tasks:
+                task.cancel()
+        
+        try:
+            first = await tasks[0]
+        except BaseException:
+            await cancel_pending()
+            raise
+        if not first.get("success"):
+            await cancel_pending()
+            return first, None
+        return {"success": True, "cache": first.get("cache", "bypass"), "segments": len(segments)}, \
+            ChunkStream(self._stream_segments(first, tasks[1:], split), cancel_pending)
+    
+    async def _postprocess(self, job, result):
+        """
+        Run the requested PCM post-processing on a successful result
+        
+        The cache keeps the unprocessed audio, so one cached line can be
+        served with different post-processing options.
+        """
+        if job.postprocess is None or not result.get("success"):
+            return result
+        started = time.monotonic()
+        try:
+            audio_bytes = await asyncio.to_thread(postprocess_audio, result["audio_bytes"], job.postprocess)
+        except ValueError as e:
+            return {"success": False, "error": f"Audio post-processing failed: {e}"}
+        finally:
+            self.metrics.observe("postprocess", time.monotonic() - started)
+        result["audio_bytes"] = audio_bytes
+        result["size"] = len(audio_bytes)
+        result["postprocessed"] = True
+        return result
+    
+    async def open_stream(self, request_data):
+        """
+        Start a streaming synthesis and wait for its first audio chunk
+        
+        Errors that happen before any audio arrives are returned as a normal
+        result so they can still be reported as JSON. Errors after that are
+        raised from the chunk iterator.
         
         Returns:
-            Dictionary with success status and audio data or error
+            Tuple of (result dict, async iterator of audio chunks or None)
         """
         try:
-            api_key = request_data.get("api_key")
-            text = request_data.get("text")
-            reference_id = request_data.get("reference_id")
-            model = request_data.get("model", "s1")
-            latency = request_data.get("latency", "normal")
-            speed = request_data.get("speed", 1.0)
-            normalize = request_data.get("normalize", False)
-            temperature = request_data.get("temperature", 0.9)
-            top_p = request_data.get("top_p", 0.9)
+            job = SynthesisJob(request_data, self.cache)
+            if job.error:
+                return {"success": False, "error": job.error}, None
             
-            if not api_key or not text or not reference_id:
-                return {
-                    "success": False,
-                    "error": "Missing required parameters: api_key, text, or reference_id"
-                }
-            
-            # Create client with proper base_url to avoid SSL hostname mismatch
-            client = AsyncFishAudio(
-                api_key=api_key,
-                base_url="https://api.fish.audio"
-            )
+            # Post-processing needs the whole clip (trailing silence, loudness),
+            # so it is synthesized in full and then sent in chunks
+            if job.postprocess is not None:
+                result = await self.synthesize(request_data)
+                if not result.get("success"):
+                    return result, None
+                return {"success": True, "cache": result.get("cache", "bypass")}, iter_chunks(result.pop("audio_bytes"))
             
-            config = TTSConfig(
-                prosody=Prosody(speed=float(speed), volume=0),
-                reference_id=reference_id,
-                format="wav",
-                latency=latency,
-                normalize=normalize,
-                model=model,
-                temperature=temperature,
-                top_p=top_p
-            )
+            # Split lines stream their segments in order as they complete
+            segments = job.segments()
+            if len(segments) > 1:
+                return await self._open_segment_stream(request_data, segments, job.split)
             
-            # Convert text to speech with timeout (45 seconds max - increased for slow networks)
-            try:
-                audio_data = await asyncio.wait_for(
-                    client.tts.convert(text=text, config=config),
-                    timeout=45.0
-                )
-            except asyncio.TimeoutError:
-                return {
-                    "success": False,
-                    "error": "TTS generation timed out after 45 seconds. This may be due to slow network or Fish Audio API issues."
-                }
-            except Exception as api_error:
-                # Catch specific API errors
-                error_msg = str(api_error)
-                if "401" in error_msg or "Unauthorized" in error_msg:
-                    return {
-                        "success": False,
-                        "error": "Invalid API key. Please check your Fish Audio API key."
-                    }
-                elif "403" in error_msg or "Forbidden" in error_msg:
-                    return {
-                        "success": False,
-                        "error": "Access forbidden. Your API key may not have permission to use this feature."
-                    }
-                elif "404" in error_msg or "Not Found" in error_msg:
-                    return {
-                        "success": False,
-                        "error": f"Reference voice ID '{reference_id}' not found. Please check the voice ID."
-                    }
-                elif "429" in error_msg or "Too Many Requests" in error_msg:
-                    return {
-                        "success": False,
-                        "error": "Rate limit exceeded. Please wait a moment and try again."
-                    }
-                elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-                    return {
-                        "success": False,
-                        "error": f"Network timeout: {error_msg}. Check your internet connection."
-                    }
-                elif "connection" in error_msg.lower():
-                    return {
-                        "success": False,
-                        "error": f"Connection error: {error_msg}. Check your internet connection and firewall."
-                    }
-                else:
-                    raise  # Re-raise unknown errors to be caught by outer exception handler
+            if job.use_cache:
+                cached = await asyncio.to_thread(self.cache.get, job.cache_key)
+                if cached is not None:
+                    return {"success": True, "cache": "hit"}, iter_chunks(cached)
             
-            # Collect all chunks if it's a stream
-            if hasattr(audio_data, 'collect'):
-                audio_bytes = audio_data.collect()
-            else:
-                audio_bytes = audio_data
+            # A buffered synthesis of the same line is already running - wait for it instead
+            if (job.api_key, job.cache_key) in self._inflight:
+                try:
+                    audio_bytes, _ = await self._fetch_coalesced(job)
+                except SynthesisError as e:
+                    return error_result(e), None
+                return {"success": True, "cache": "miss", "coalesced": True}, iter_chunks(audio_bytes)
             
-            # Ensure audio_bytes is bytes type
-            if not isinstance(audio_bytes, bytes):
-                # Try to convert to bytes if it's a different type
-                if isinstance(audio_bytes, (list, tuple)):
-                    audio_bytes = b''.join(audio_bytes)
-                else:
-                    return {
-                        "success": False,
-                        "error": f"Invalid audio data type: {type(audio_bytes).__name__}"
-                    }
+            # The scheduler slot is held until the stream ends; retries only
+            # happen before the first chunk, while nothing has been sent yet
+            try:
+                self._check_upstream(job)
+            except SynthesisError as e:
+                return error_result(e), None
+            attempt = 0
+            while True:
+                await self.scheduler.acquire(job.api_key, job.priority, job.deadline)
+                try:
+                    probe = self._prepare_call(job)
+                except SynthesisError as e:
+                    self.scheduler.release(job.api_key)
+                    return error_result(e), None
+                stream_started = time.monotonic()
+                chunks = self._stream_upstream(job)
+                try:
+                    first_chunk = await asyncio.wait_for(chunks.__anext__(), timeout=STREAM_FIRST_CHUNK_TIMEOUT)
+                    self.metrics.observe("upstream_ttfb", time.monotonic() - stream_started)
+                    self.latency_mode.observe(time.monotonic() - stream_started)
+                    self.breaker.record(self.upstream_host, probe=probe)
+                    break
+                except BaseException as error:
+                    self.breaker.record(self.upstream_host, error, probe)
+                    self.scheduler.release(job.api_key)
+                    self.metrics.observe("upstream_total", time.monotonic() - stream_started)
+                    await chunks.aclose()
+                    if not isinstance(error, Exception):
+                        raise
+                    delay = self.scheduler.retry_delay(job.api_key, attempt, error)
+                    if delay is None:
+                        return self._stream_error(job, error), None
+                attempt += 1
+                await asyncio.sleep(delay)
             
-            # Validate audio data
-            if len(audio_bytes) == 0:
-                return {
-                    "success": False,
-                    "error": "Audio data is empty"
-                }
+            closed = False
             
-            # Encode audio as base64
-            audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+            async def close_upstream():
+                nonlocal closed
+                if not closed:
+                    closed = True
+                    self.scheduler.release(job.api_key)
+                    self.metrics.observe("upstream_total", time.monotonic() - stream_started)
+                    await chunks.aclose()
             
             return {
                 "success": True,
-                "audio": audio_base64,
-                "size": len(audio_bytes)
-            }
-            
+                "cache": "miss" if job.use_cache else "bypass"
+            }, ChunkStream(self._continue_stream(job, first_chunk, chunks, close_upstream), close_upstream)
+        
         except Exception as e:
             import traceback
             return {
                 "success": False,
                 "error": str(e),
                 "traceback": traceback.format_exc()
+            }, None
+    
+    def _stream_error(self, job, error):
+        """Result for a stream that failed before its first chunk"""
+        if isinstance(error, StopAsyncIteration):
+            return {"success": False, "error": "Audio data is empty"}
+        if isinstance(error, asyncio.TimeoutError):
+            return {
+                "success": False,
+                "error": f"TTS generation produced no audio within {STREAM_FIRST_CHUNK_TIMEOUT:.0f} seconds. This may be due to slow network or Fish Audio API issues."
             }
+        error_msg = describe_upstream_error(error, job.reference_id)
+        if error_msg is None:
+            raise error
+        self.negative_cache.put(job, error, error_msg)
+        return {"success": False, "error": error_msg}
+    
+    async def open_batch(self, request_data):
+        """
+        Start synthesizing a list of lines concurrently
+        
+        Top-level fields other than 'lines' are defaults shared by every line.
+        At most batch_concurrency lines (or the smaller 'max_concurrency' of the
+        request) are in flight at once. With 'ordered' (default) results are
+        produced in line order, each as soon as it and the lines before it are
+        done; otherwise in completion order. A 'deadline_ms' counts from the
+        arrival of the batch, for each line separately.
+        
+        Returns:
+            Tuple of (result dict, async iterator of per-line results or None)
+        """
+        lines = request_data.get("lines")
+        if not isinstance(lines, list) or not lines:
+            return {"success": False, "error": "Batch request requires a non-empty 'lines' list"}, None
+        if not all(isinstance(line, dict) for line in lines):
+            return {"success": False, "error": "Every batch line must be an object"}, None
+        
+        shared = {k: v for k, v in request_data.items() if k not in ("lines", "ordered", "max_concurrency")}
+        concurrency = self.batch_concurrency
+        try:
+            concurrency = max(1, min(concurrency, int(request_data.get("max_concurrency", concurrency))))
+        except (TypeError, ValueError):
+            pass
+        
+        return {"success": True, "count": len(lines)}, self._run_batch(
+            [{**shared, **line} for line in lines],
+            concurrency,
+            bool(request_data.get("ordered", True)),
+            time.monotonic()
+        )
+    
+    def open_prefetch(self, request_data):
+        """
+        Queue lines (a 'lines' list, or the request itself) for prefetching
+        
+        Top-level fields other than 'lines' are defaults shared by every line,
+        as for batches. Returns immediately with the number of lines queued.
+        """
+        if self.prefetch is None:
+            return {"success": False, "error": "Prefetching requires the audio cache"}
+        lines = request_data.get("lines")
+        if lines is None:
+            lines = [request_data]
+        elif not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+            return {"success": False, "error": "'lines' must be a list of objects"}
+        shared = {k: v for k, v in request_data.items() if k not in ("lines", "request_id", "command")}
+        return {"success": True, **self.prefetch.add([{**shared, **line} for line in lines])}
+    
+    async def _run_batch(self, lines, concurrency, ordered, arrived):
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def synthesize_line(line_data):
+            async with semaphore:
+                return await self.synthesize(line_data)
+        
+        async def run_line(index, line_data):
+            deadline, error = parse_deadline(line_data, arrived)
+            if error:
+                result = {"success": False, "error": error}
+            else:
+                _request_deadline.set(deadline)
+                try:
+                    result = await self.run_with_deadline(deadline, synthesize_line(line_data))
+                except DeadlineExceeded as e:
+                    result = error_result(e)
+            result["index"] = index
+            return result
+        
+        tasks = [asyncio.ensure_future(run_line(i, line)) for i, line in enumerate(lines)]
+        try:
+            for next_result in (tasks if ordered else asyncio.as_completed(tasks)):
+                yield await next_result
+        finally:
+            # Client went away or the batch failed - stop the remaining lines
+            for task in tasks:
+                task.cancel()
+    
+    async def _stream_upstream(self, job):
+        """Yield audio chunks from the Fish Audio HTTP API as they arrive"""
+        transport = self.client_pool.transport(self.base_url)
+        payload = TTSRequest(text=job.text, **job.config().model_dump()).model_dump(exclude_none=True)
+        headers = {
+            "Authorization": f"Bearer {job.api_key}",
+            "Content-Type": "application/msgpack",
+            "model": job.model
+        }
+        async with transport.stream("POST", "/v1/tts", headers=headers, content=ormsgpack.packb(payload),
+                                    timeout=httpx.Timeout(STREAM_FIRST_CHUNK_TIMEOUT, connect=10.0)) as response:
+            if not response.is_success:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                raise APIError(response.status_code, body or response.reason_phrase, body)
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield chunk
+    
+    async def _continue_stream(self, job, first_chunk, chunks, close_upstream):
+        """Relay the rest of an upstream stream with an idle timeout, caching the complete audio"""
+        received = [first_chunk]
+        try:
+            yield first_chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=STREAM_CHUNK_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"No audio received from Fish Audio for {STREAM_CHUNK_TIMEOUT:.0f} seconds")
+                received.append(chunk)
+                yield chunk
+        finally:
+            await close_upstream()
+        
+        if job.use_cache:
+            await asyncio.to_thread(self.cache.put, job.cache_key, b''.join(received))
+
+
+class RequestCancelled(Exception):
+    """A request was cancelled by its client"""
+
+
+class SynthesisError(Exception):
+    """Expected synthesis failure carrying a user-facing message"""
+
+
+class DeadlineExceeded(SynthesisError):
+    """A request's deadline passed, or would pass before its upstream call could finish"""
+
+
+class UpstreamUnavailable(SynthesisError):
+    """The circuit breaker is refusing upstream calls; carries the seconds until it lets a probe through"""
+    
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Fish Audio API is unavailable after repeated failures, retrying in {retry_after:.0f}s")
+
+
+def error_result(error):
+    """Failure result for a SynthesisError, flagged with its kind"""
+    result = {"success": False, "error": str(error)}
+    if isinstance(error, DeadlineExceeded):
+        result["deadline_exceeded"] = True
+    elif isinstance(error, UpstreamUnavailable):
+        result["circuit_open"] = True
+        result["retry_after"] = round(error.retry_after, 1)
+    return result
+
+
+def error_response(result, endpoint="tts"):
+    """
+    HTTP response for a failed result: 503 with Retry-After while the circuit
+    breaker is open, so clients can switch to another provider, else 400
+    """
+    if result.get("circuit_open"):
+        headers = {"Retry-After": str(max(1, math.ceil(result["retry_after"]))), "X-Circuit-State": "open"}
+        return HttpResponse.json(503, result, headers=headers, endpoint=endpoint, outcome="circuit_open")
+    return HttpResponse.json(400, encode_json_result(result), endpoint=endpoint,
+                             outcome="deadline" if result.get("deadline_exceeded") else "error")
+
+
+def parse_deadline(request_data, arrived=None):
+    """
+    Absolute deadline of a request from its optional 'deadline_ms' time budget
+    
+    Args:
+        request_data: Request fields
+        arrived: time.monotonic() the budget counts from (default: now)
+    
+    Returns:
+        Tuple of (deadline or None, error message or None)
+    """
+    budget = request_data.get("deadline_ms")
+    if budget is None:
+        return None, None
+    if isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0:
+        return None, "Invalid 'deadline_ms': expected a positive number of milliseconds"
+    return (arrived if arrived is not None else time.monotonic()) + budget / 1000.0, None
+
+
+class SynthesisJob:
+    """Validated synthesis parameters of one request"""
+    
+    def __init__(self, request_data, cache=None):
+        self.api_key = request_data.get("api_key")
+        self.params = synthesis_params(request_data)
+        self.text = self.params["text"]
+        self.reference_id = self.params["reference_id"]
+        self.model = self.params["model"]
+        self.latency = request_data.get("latency", "normal")
+        self.adaptive = self.latency == "auto"  # resolved by LatencyModeSelector before each upstream call
+        if self.adaptive:
+            self.latency = "normal"
+        self.deadline = _request_deadline.get()
+        self.cache_key = params_hash(self.params) if self.text and self.reference_id else None
+        self.use_cache = cache is not None and bool(request_data.get("cache", True))
+        self.priority = parse_priority(request_data.get("priority"))
+        self.postprocess, self.error = parse_postprocess_options(request_data.get("postprocess"))
+        self.split, split_error = parse_split_options(request_data.get("split"))
+        self.error = self.error or split_error
+        if not self.api_key or not self.text or not self.reference_id:
+            self.error = "Missing required parameters: api_key, text, or reference_id"
+    
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        return self.deadline - time.monotonic() if self.deadline is not None else None
+    
+    def extend_deadline(self, deadline):
+        """Move the deadline out to another request's (None: no deadline) when it shares this job's upstream call"""
+        if self.deadline is not None and (deadline is None or deadline > self.deadline):
+            self.deadline = deadline
+    
+    def segments(self):
+        """Text segments to synthesize separately; a single one unless splitting applies"""
+        if self.split is None or len(self.text) <= self.split["max_chars"]:
+            return [self.text]
+        return split_text(self.text, self.split["max_chars"])
+    
+    def config(self):
+        return TTSConfig(
+            prosody=Prosody(speed=float(self.params["speed"]), volume=0),
+            reference_id=self.reference_id,
+            format="wav",
+            latency=self.latency,
+            normalize=self.params["normalize"],
+            temperature=self.params["temperature"],
+            top_p=self.params["top_p"]
+        )
+
+
+class ChunkStream:
+    """Async chunk iterator whose cleanup also runs if it is closed before iteration starts"""
+    
+    def __init__(self, chunks, cleanup):
+        self._chunks = chunks
+        self._cleanup = cleanup
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        return await self._chunks.__anext__()
+    
+    async def aclose(self):
+        try:
+            await self._chunks.aclose()
+        finally:
+            await self._cleanup()
+
+
+def segment_request(request_data, text):
+    """Request for one segment of a split line: same voice and config, no splitting or post-processing"""
+    return {**request_data, "text": text, "split": None, "postprocess": None}
+
+
+def iter_chunks(data, chunk_size=64 * 1024):
+    """Async iterator over a bytes object in fixed-size chunks"""
+    async def _iterate():
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+    return _iterate()
+
+
+def describe_upstream_error(error, reference_id):
+    """Map a Fish Audio API error to a user-facing message, or None if it is not recognized"""
+    # Some transport errors (e.g. httpx.ReadTimeout) have an empty message
+    error_msg = str(error) or type(error).__name__
+    if "401" in error_msg or "Unauthorized" in error_msg:
+        return "Invalid API key. Please check your Fish Audio API key."
+    elif "403" in error_msg or "Forbidden" in error_msg:
+        return "Access forbidden. Your API key may not have permission to use this feature."
+    elif "404" in error_msg or "Not Found" in error_msg:
+        return f"Reference voice ID '{reference_id}' not found. Please check the voice ID."
+    elif "429" in error_msg or "Too Many Requests" in error_msg:
+        return "Rate limit exceeded. Please wait a moment and try again."
+    elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
+        return f"Network timeout: {error_msg}. Check your internet connection."
+    elif "connection" in error_msg.lower():
+        return f"Connection error: {error_msg}. Check your internet connection and firewall."
+    return None
+
+
+def encode_json_result(result):
+    """Convert a synthesis result into the JSON-serializable legacy format (base64 audio)"""
+    audio_bytes = result.pop("audio_bytes", None)
+    if audio_bytes is not None:
+        result["audio"] = base64.b64encode(audio_bytes).decode('utf-8')
+    return result
+
+
+def encode_json_body(result):
+    """
+    Serialize a synthesis result into a legacy JSON response body
+    
+    Same document as json.dumps(encode_json_result(result)), but the base64
+    audio is spliced in as bytes, so the clip is not also held as a str and
+    as part of a JSON str while the response is built.
+    """
+    audio_bytes = result.pop("audio_bytes", None)
+    head = json.dumps(result).encode()
+    if audio_bytes is None:
+        return head
+    return b"".join((head[:-1], b', "audio": "' if result else b'"audio": "', base64.b64encode(audio_bytes), b'"}'))
+
+
+def spool_key(request_data):
+    """Identity of the audio a request produces, so identical clips can share a spool region"""
+    options = json.dumps([request_data.get("postprocess"), request_data.get("split")], sort_keys=True)
+    return f"{params_hash(synthesis_params(request_data))}:{options}"
+
+
+def wants_binary_response(headers, request_data):
+    """Binary mode is negotiated with 'Accept: audio/wav' or a 'response_format': 'binary' field ('spool' is handled first)"""
+    if request_data.get("response_format") == "binary":
+        return True
+    accept = headers.get('Accept', '') or ''
+    return 'audio/wav' in accept
+
+
+def admission_applies(method, target, body):
+    """Whether admission control covers a request: synthesis work, not status, metrics or commands"""
+    if method != "POST" or urlparse(target).path.rstrip('/') == '/cancel':
+        return False
+    # Commands are small JSON objects; looking for the key spares parsing every body twice
+    return not (len(body) <= MAX_COMMAND_BODY and b'"command"' in body)
+
+
+POSTPROCESS_OPTIONS = ("trim_silence", "silence_threshold_db", "target_lufs", "target_rms_db", "sample_rate", "mono")
+# Trimmed audio keeps this much of the silence around the speech
+TRIM_PADDING = 0.03
+# Loudness normalization never pushes peaks above this level (dBFS)
+PEAK_CEILING_DB = -1.0
+
+
+def parse_postprocess_options(options):
+    """
+    Validate the optional 'postprocess' object of a request
+    
+    Returns:
+        Tuple of (options dict or None, error message or None)
+    """
+    if options is None or options is False:
+        return None, None
+    if not isinstance(options, dict):
+        return None, "'postprocess' must be an object"
+    unknown = set(options) - set(POSTPROCESS_OPTIONS)
+    if unknown:
+        return None, f"Unknown postprocess options: {', '.join(sorted(unknown))}"
+    try:
+        parsed = {
+            "trim_silence": bool(options.get("trim_silence", False)),
+            "silence_threshold_db": float(options.get("silence_threshold_db", -50.0)),
+            "target_lufs": float(options["target_lufs"]) if options.get("target_lufs") is not None else None,
+            "target_rms_db": float(options["target_rms_db"]) if options.get("target_rms_db") is not None else None,
+            "sample_rate": int(options["sample_rate"]) if options.get("sample_rate") else None,
+            "mono": bool(options.get("mono", False))
+        }
+    except (TypeError, ValueError) as e:
+        return None, f"Invalid postprocess options: {e}"
+    if parsed["sample_rate"] is not None and not 8000 <= parsed["sample_rate"] <= 192000:
+        return None, "postprocess sample_rate must be between 8000 and 192000"
+    if not any((parsed["trim_silence"], parsed["target_lufs"] is not None, parsed["target_rms_db"] is not None,
+                parsed["sample_rate"], parsed["mono"])):
+        return None, None
+    if np is None:
+        return None, "Audio post-processing requires numpy. Please install: pip install numpy"
+    return parsed, None
+
+
+def parse_wav(data):
+    """
+    Split a WAV file into its format and sample data
+    
+    Returns:
+        Tuple of ((format, channels, sample_rate, bits), PCM bytes)
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, pos)
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            if audio_format == 0xFFFE and size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: the real format is the start of the sub-format GUID
+                audio_format = struct.unpack_from("<H", data, body + 24)[0]
+            fmt = (audio_format, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            # Streamed WAVs may carry a placeholder size - take what is there
+            pcm = data[body:body + size] if size and body + size <= len(data) else data[body:]
+            frame = max(1, fmt[1] * fmt[3] // 8)
+            return fmt, pcm[:len(pcm) - len(pcm) % frame]
+        pos = body + size + (size & 1)
+    raise ValueError("no data chunk")
+
+
+def wav_header(channels, sample_rate, bits=16, data_size=None, audio_format=1):
+    """
+    Canonical 44-byte WAV header
+    
+    Without data_size the RIFF and data sizes are set to 0xFFFFFFFF, the
+    usual placeholder for WAV streams whose length is not known yet.
+    """
+    riff_size = 0xFFFFFFFF if data_size is None else 36 + data_size
+    block_align = channels * bits // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, audio_format, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b"data", 0xFFFFFFFF if data_size is None else data_size
+    )
+
+
+def decode_wav(data):
+    """
+    Decode a PCM or float WAV file
+    
+    Returns:
+        Tuple of (float32 array shaped (frames, channels) in [-1, 1], sample rate)
+    """
+    fmt, pcm = parse_wav(data)
+    return _pcm_to_float(pcm, fmt), fmt[2]
+
+
+def _pcm_to_float(pcm, fmt):
+    audio_format, channels, _, bits = fmt
+    if audio_format == 3 and bits == 32:
+        samples = np.frombuffer(pcm, dtype="<f4")
+    elif audio_format == 1 and bits == 16:
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+    elif audio_format == 1 and bits == 8:
+        samples = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif audio_format == 1 and bits == 24:
+        raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.0
+    elif audio_format == 1 and bits == 32:
+        samples = np.frombuffer(pcm, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"unsupported WAV format {audio_format} with {bits} bits")
+    return samples.reshape(-1, channels)
+
+
+def float_to_pcm16(samples):
+    """Convert a float array in [-1, 1] to 16-bit little-endian PCM bytes"""
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).round().astype("<i2").tobytes()
+
+
+def encode_wav(samples, sample_rate):
+    """Encode a float array shaped (frames, channels) as a 16-bit PCM WAV file"""
+    pcm = float_to_pcm16(samples)
+    return wav_header(samples.shape[1], sample_rate, data_size=len(pcm)) + pcm
+
+
+def _db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+def trim_silence(samples, sample_rate, threshold_db):
+    """Cut leading and trailing audio whose 10 ms window peaks stay below threshold_db (dBFS)"""
+    window = max(1, sample_rate // 100)
+    frames = len(samples) - len(samples) % window
+    if frames == 0:
+        return samples
+    peaks = np.abs(samples[:frames]).max(axis=1).reshape(-1, window).max(axis=1)
+    loud = np.flatnonzero(peaks >= _db_to_gain(threshold_db))
+    if len(loud) == 0:
+        return samples
+    padding = int(TRIM_PADDING * sample_rate)
+    start = max(0, loud[0] * window - padding)
+    end = min(len(samples), (loud[-1] + 1) * window + padding)
+    return samples[start:end]
+
+
+def _fast_length(n):
+    """Smallest length >= n with no prime factor above 5, which FFTs handle fastest"""
+    best = 1 << max(0, (n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            length = p35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def resample(samples, sample_rate, target_rate):
+    """
+    Band-limited FFT resampling (ideal low-pass when reducing the rate)
+    
+    The input is zero-padded to a length that maps to a whole number of
+    output frames and factors into small primes, then cut back.
+    """
+    frames = len(samples)
+    target_frames = int(round(frames * target_rate / sample_rate))
+    if frames == 0 or target_frames == 0:
+        return samples[:0]
+    divisor = math.gcd(sample_rate, target_rate)
+    up, down = target_rate // divisor, sample_rate // divisor
+    blocks = _fast_length(-(-frames // down))
+    padded, padded_out = blocks * down, blocks * up
+    spectrum = np.fft.rfft(samples.astype(np.float64), n=padded, axis=0)
+    bins = padded_out // 2 + 1
+    if bins <= spectrum.shape[0]:
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros((bins - spectrum.shape[0], spectrum.shape[1]), spectrum.dtype)])
+    resampled = np.fft.irfft(spectrum, n=padded_out, axis=0)[:target_frames]
+    return (resampled * (padded_out / padded)).astype(np.float32)
+
+
+def _biquad_response(b, a, frequencies, sample_rate):
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+@functools.lru_cache(maxsize=8)
+def _k_weighting(sample_rate):
+    """
+    Magnitude response of the ITU-R BS.1770 K-weighting filter (shelf + high-pass)
+    
+    The biquads are designed for the actual sample rate; at 48 kHz they
+    reproduce the coefficients published in the standard. Returned as
+    (frequencies, magnitudes) on a log-spaced grid for interpolation.
+    """
+    frequencies = np.concatenate(([0.0], np.geomspace(1.0, sample_rate / 2, 1024)))
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10.0 ** (3.999843853973347 / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = _biquad_response(
+        ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+        (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+        frequencies, sample_rate)
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = _biquad_response(
+        (1.0, -2.0, 1.0),
+        (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+        frequencies, sample_rate)
+    return frequencies, np.abs(shelf * highpass)
+
+
+def integrated_loudness(samples, sample_rate):
+    """
+    BS.1770 integrated loudness in LUFS
+    
+    K-weighting is applied in the frequency domain (magnitude only, which
+    leaves block energies unchanged); 400 ms blocks with 75% overlap are
+    gated at -70 LUFS and then 10 LU below the ungated level. Clips shorter
+    than one block are measured as a single block.
+    """
+    frames = len(samples)
+    padded = _fast_length(frames)
+    spectrum = np.fft.rfft(samples.astype(np.float64), n=padded, axis=0)
+    spectrum *= np.interp(np.fft.rfftfreq(padded, 1.0 / sample_rate), *_k_weighting(sample_rate))[:, None]
+    power = np.square(np.fft.irfft(spectrum, n=padded, axis=0)[:frames]).sum(axis=1)
+    
+    block = int(0.4 * sample_rate)
+    if frames <= block:
+        energies = np.array([power.mean()])
+    else:
+        step = block // 4
+        cumulative = np.concatenate(([0.0], np.cumsum(power)))
+        starts = np.arange(0, frames - block + 1, step)
+        energies = (cumulative[starts + block] - cumulative[starts]) / block
+    
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(energies)
+    gated = energies[loudness > -70.0]
+    if len(gated) == 0:
+        return float("-inf")
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = energies[loudness > max(-70.0, relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def active_rms_db(samples, sample_rate, threshold_db):
+    """RMS level in dBFS over the 10 ms windows that are not silent"""
+    window = max(1, sample_rate // 100)
+    frames = len(samples) - len(samples) % window
+    if frames == 0:
+        return float("-inf")
+    power = np.square(samples[:frames]).mean(axis=1).reshape(-1, window).mean(axis=1)
+    active = power[power >= _db_to_gain(threshold_db) ** 2]
+    if len(active) == 0:
+        return float("-inf")
+    return float(10 * np.log10(active.mean()))
+
+
+def postprocess_audio(audio_bytes, options):
+    """
+    Apply the requested post-processing to a WAV file
+    
+    Steps run in the order downmix, trim, resample, normalize, so every step
+    works on as few samples as possible. The result is 16-bit PCM WAV.
+    
+    Args:
+        audio_bytes: WAV file from the API or the cache
+        options: Options from parse_postprocess_options
+    
+    Returns:
+        Processed WAV bytes
+    """
+    samples, sample_rate = decode_wav(audio_bytes)
+    
+    if options["mono"] and samples.shape[1] > 1:
+        samples = samples.mean(axis=1, keepdims=True)
+    
+    if options["trim_silence"]:
+        samples = trim_silence(samples, sample_rate, options["silence_threshold_db"])
+    
+    if options["sample_rate"] and options["sample_rate"] != sample_rate:
+        samples = resample(samples, sample_rate, options["sample_rate"])
+        sample_rate = options["sample_rate"]
+    
+    if len(samples) and (options["target_lufs"] is not None or options["target_rms_db"] is not None):
+        if options["target_lufs"] is not None:
+            gain_db = options["target_lufs"] - integrated_loudness(samples, sample_rate)
+        else:
+            gain_db = options["target_rms_db"] - active_rms_db(samples, sample_rate, options["silence_threshold_db"])
+        if np.isfinite(gain_db):
+            peak = float(np.abs(samples).max())
+            gain = _db_to_gain(gain_db)
+            if peak > 0:
+                gain = min(gain, _db_to_gain(PEAK_CEILING_DB) / peak)
+            samples = samples * np.float32(gain)
+    
+    return encode_wav(samples, sample_rate)
+
+
+SPLIT_DEFAULTS = {"max_chars": 150, "crossfade_ms": 10}
+# Sentence ends: ASCII terminators only before whitespace (so "3.5" and "e.g.x" stay whole)
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]”’]*(?=\s|$)|[。！？…]+["\'”’」』）]*|\n+')
+CLAUSE_BOUNDARY = re.compile(r'[,;:]["\')\]”’]*(?=\s)|[，；：、]|\s+[-–—]+(?=\s)')
+WORD_BOUNDARY = re.compile(r'\s+')
+
+
+def parse_split_options(options):
+    """
+    Validate the optional 'split' field of a request (true or an object)
+    
+    Returns:
+        Tuple of (options dict or None, error message or None)
+    """
+    if not options:
+        return None, None
+    if options is True:
+        return dict(SPLIT_DEFAULTS), None
+    if not isinstance(options, dict):
+        return None, "'split' must be true or an object"
+    try:
+        parsed = {
+            "max_chars": int(options.get("max_chars", SPLIT_DEFAULTS["max_chars"])),
+            "crossfade_ms": float(options.get("crossfade_ms", SPLIT_DEFAULTS["crossfade_ms"]))
+        }
+    except (TypeError, ValueError) as e:
+        return None, f"Invalid split options: {e}"
+    if parsed["max_chars"] < 20 or not 0 <= parsed["crossfade_ms"] <= 200:
+        return None, "split max_chars must be at least 20 and crossfade_ms between 0 and 200"
+    return parsed, None
+
+
+def _cut(text, start, end, pattern):
+    """Split text[start:end] after every match of pattern; returns (start, end) spans"""
+    spans = []
+    for match in pattern.finditer(text, start, end):
+        if match.end() > start:
+            spans.append((start, match.end()))
+            start = match.end()
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+
+def _split_spans(text, start, end, max_chars, patterns):
+    if end - start <= max_chars:
+        return [(start, end)]
+    if not patterns:
+        return [(i, min(i + max_chars, end)) for i in range(start, end, max_chars)]
+    spans = []
+    mergeable = False
+    for piece in _cut(text, start, end, patterns[0]):
+        parts = _split_spans(text, *piece, max_chars, patterns[1:])
+        # Only whole pieces are packed together, never fragments of a split one
+        if len(parts) == 1 and mergeable and parts[0][1] - spans[-1][0] <= max_chars:
+            spans[-1] = (spans[-1][0], parts[0][1])
+        else:
+            spans.extend(parts)
+        mergeable = len(parts) == 1
+    return spans
+
+
+def split_text(text, max_chars):
+    """
+    Split text into segments of at most max_chars at natural boundaries
+    
+    Sentences are preferred, then clauses, then words; only a single word
+    longer than max_chars (e.g. unspaced CJK text) is cut mid-way. Adjacent
+    pieces are packed back together while they fit, so the segment count
+    stays as low as possible.
+    """
+    spans = _split_spans(text, 0, len(text), max_chars, (SENTENCE_BOUNDARY, CLAUSE_BOUNDARY, WORD_BOUNDARY))
+    return [text[start:end].strip() for start, end in spans if text[start:end].strip()]
+
+
+class WavStitcher:
+    """
+    Joins WAV segments into one clip, in order, as they become available
+    
+    With numpy, segments are converted to the format of the first one and
+    joined with an equal-power crossfade; the output is 16-bit PCM. Without
+    numpy, segments must share one format and their samples are concatenated.
+    add() returns the bytes that are final so far, so the clip can be streamed.
+    """
+    
+    def __init__(self, crossfade_ms=0):
+        self.crossfade_ms = crossfade_ms
+        self.format = None
+        self.data_size = 0
+        self._tail = None
+    
+    def add(self, wav_bytes):
+        """Add the next segment; returns output bytes (the first call includes a streaming WAV header)"""
+        fmt, pcm = parse_wav(wav_bytes)
+        header = b""
+        if self.format is None:
+            self.format = fmt if np is None else (1, fmt[1], fmt[2], 16)
+            header = wav_header(self.format[1], self.format[2], self.format[3], audio_format=self.format[0])
+        if np is None:
+            if fmt != self.format:
+                raise ValueError("segments have different audio formats and numpy is not installed to convert them")
+            data = pcm
+        else:
+            data = self._crossfade(_pcm_to_float(pcm, fmt), fmt[2])
+        self.data_size += len(data)
+        return header + data
+    
+    def finish(self):
+        """Return the remaining output bytes after the last segment"""
+        if self._tail is None:
+            return b""
+        data = float_to_pcm16(self._tail)
+        self._tail = None
+        self.data_size += len(data)
+        return data
+    
+    def join(self, segments):
+        """Stitch complete segments into one WAV file with exact sizes"""
+        data = b"".join(self.add(segment) for segment in segments) + self.finish()
+        header = wav_header(self.format[1], self.format[2], self.format[3], self.data_size, self.format[0])
+        return header + data[len(header):]
+    
+    def _crossfade(self, samples, sample_rate):
+        _, channels, target_rate, _ = self.format
+        if sample_rate != target_rate:
+            samples = resample(samples, sample_rate, target_rate)
+        if samples.shape[1] != channels:
+            samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+        
+        if self._tail is not None:
+            overlap = min(len(self._tail), len(samples))
+            t = np.linspace(0.0, np.pi / 2, overlap, dtype=np.float32)[:, None]
+            mixed = self._tail[len(self._tail) - overlap:] * np.cos(t) + samples[:overlap] * np.sin(t)
+            samples = np.concatenate([self._tail[:len(self._tail) - overlap], mixed, samples[overlap:]])
+        
+        # Hold back the end of this segment to fade it into the next one
+        hold = min(len(samples), int(self.crossfade_ms * target_rate / 1000))
+        self._tail = samples[len(samples) - hold:]
+        return float_to_pcm16(samples[:len(samples) - hold])
+
+
+class HttpResponse:
+    """
+    Response produced by TTSBackend.dispatch, written out by either front end
+    
+    Either body is set, or chunks is an async iterator sent with chunked
+    transfer encoding (each item passed through encode first, if given).
+    """
+    
+    def __init__(self, status, body=b"", content_type="application/json", headers=None,
+                 chunks=None, encode=None, request_id=None, endpoint="tts", outcome="success"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.chunks = chunks
+        self.encode = encode
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.outcome = outcome
+        self.shutdown = False
+    
+    @classmethod
+    def json(cls, status, payload, **kwargs):
+        return cls(status, json.dumps(payload).encode(), **kwargs)
+
+
+class TTSRequestHandler(BaseHTTPRequestHandler):
+    """HTTP request handler for TTS conversion (threading mode)"""
+    
+    # HTTP/1.1 is required for chunked streaming responses; every other
+    # response carries a Content-Length so connections can be kept alive
+    protocol_version = "HTTP/1.1"
+    
+    def _write_response(self, response):
+        """Write a dispatched response; returns bytes sent"""
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        if response.chunks is None:
+            self.send_header('Content-Length', str(len(response.body)))
+            self.end_headers()
+            self.wfile.write(response.body)
+            return len(response.body)
+        
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return self._relay_chunks(response)
+    
+    def _relay_chunks(self, response):
+        """Relay items of an async iterator with chunked transfer encoding as they arrive"""
+        backend = self.server.backend
+        loop_thread = backend.loop_thread
+        sent = 0
+        try:
+            while True:
+                try:
+                    # Tracked, so a cancel request aborts the upstream stream while we wait
+                    chunk = loop_thread.run(backend.run_tracked(response.request_id, response.chunks.__anext__()))
+                except StopAsyncIteration:
+                    break
+                if response.encode is not None:
+                    chunk = response.encode(chunk)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+                sent += len(chunk)
+            self.wfile.write(b"0\r\n\r\n")
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError) as e:
+            sys.stderr.write(f"[TTS Server] Client disconnected during stream: {str(e)}\n")
+            response.outcome = "disconnected"
+            self.close_connection = True
+        except Exception as e:
+            # Headers are already sent - end the connection without the final chunk
+            # so the client sees a truncated transfer instead of a short clip
+            sys.stderr.write(f"[TTS Server] Stream aborted: {e}\n")
+            response.outcome = "cancelled" if isinstance(e, RequestCancelled) else "aborted"
+            self.close_connection = True
+        finally:
+            try:
+                loop_thread.run(response.chunks.aclose(), timeout=5)
+            except Exception:
+                pass
+        return sent
+    
+    def _discard_body(self, length):
+        """Skip a refused request body without buffering it, or close the connection if it is too large to bother"""
+        if length > MAX_DISCARDED_BODY or self.headers.get('Expect', '').lower() == '100-continue':
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            length -= len(chunk)
+    
+    def _client_disconnected(self):
+        """Check without blocking whether the client has closed its connection"""
+        if getattr(self, "_pipelined", False):
+            # Next request already buffered - the client is still there
+            return False
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if not readable:
+                return False
+            if self.connection.recv(1, socket.MSG_PEEK) == b'':
+                return True
+            self._pipelined = True
+            return False
+        except (OSError, ValueError):
+            return True
+    
+    def _run_request(self, coro):
+        """
+        Run a request on the shared loop, cancelling it if the client disconnects
+        
+        Raises:
+            ConnectionAbortedError: The client went away and the request was cancelled
+        """
+        future = self.server.backend.loop_thread.submit(coro)
+        self._pipelined = False
+        while True:
+            try:
+                return future.result(timeout=DISCONNECT_POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                pass
+            if self._client_disconnected():
+                future.cancel()
+                raise ConnectionAbortedError("client disconnected, request cancelled")
     
-    def do_POST(self):
-        """Handle POST requests"""
+    def _handle(self, method):
+        backend = self.server.backend
+        metrics = backend.metrics
+        started = time.monotonic()
+        endpoint, outcome, sent = "unknown", "error", 0
+        trace = backend.start_trace(method, self.path)
+        reserved = None
+        metrics.add_gauge("http_requests_in_flight", 1)
         try:
-            # Read request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            request_data = json.loads(body.decode('utf-8'))
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
+            if not backend.admission.body_allowed(content_length):
+                self._discard_body(content_length)
+                response = backend.overloaded_response("body_too_large", content_length)
+            else:
+                # Read request body
+                body = self.rfile.read(content_length) if content_length > 0 else b""
+                reserved, response = backend.admit(method, self.path, body)
+                if response is None:
+                    response = self._run_request(backend.dispatch(method, self.path, self.headers, body))
+                    reserved = backend.hold_response(reserved, response)
+            endpoint = response.endpoint
+            sent = self._write_response(response)
+            outcome = response.outcome
             
-            # Handle shutdown request
-            if request_data.get("command") == "shutdown":
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": True, "message": "Shutting down"}).encode())
+            if response.shutdown:
                 # Shutdown server in a separate thread to avoid blocking
                 Thread(target=self.server.shutdown).start()
-                return
-            
-            # Process TTS request asynchronously
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            response = loop.run_until_complete(self.handle_tts_request(request_data))
-            loop.close()
-            
-            # Send response
-            try:
-                self.send_response(200 if response.get("success") else 400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode())
-            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError) as e:
-                # Client disconnected, log but don't crash
-                sys.stderr.write(f"[TTS Server] Client disconnected during response send: {str(e)}\n")
-                return
-            
+        
+        except ConnectionAbortedError as e:
+            # Raised by _run_request when the client went away while waiting
+            sys.stderr.write(f"[TTS Server] Request aborted: {str(e)}\n")
+            outcome = "disconnected"
+            self.close_connection = True
+        
+        except (ConnectionResetError, BrokenPipeError) as e:
+            # Client disconnected, log but don't crash
+            sys.stderr.write(f"[TTS Server] Client disconnected during response send: {str(e)}\n")
+            outcome = "disconnected"
+            self.close_connection = True
+        
         except Exception as e:
             import traceback
             error_response = {
@@ -189,19 +3312,656 @@ class TTSRequestHandler(BaseHTTPRequestHandler):
             }
             
             try:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(error_response).encode())
+                self._write_response(HttpResponse.json(500, error_response))
             except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
                 # Client disconnected, log but don't crash
                 sys.stderr.write(f"[TTS Server] Client disconnected\n")
+                self.close_connection = True
+        
+        finally:
+            backend.finish_admitted(reserved)
+            metrics.add_gauge("http_requests_in_flight", -1)
+            backend.record_request(endpoint, outcome, sent, started, trace)
+    
+    def do_GET(self):
+        """Handle GET requests"""
+        self._handle("GET")
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        self._handle("POST")
     
     def log_message(self, format, *args):
         """Suppress HTTP access logs (200 OK responses are too verbose)"""
         # Silently ignore all HTTP request logs
         pass
 
+
+class TTSHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog for bursts (socketserver's default is 5)"""
+    
+    request_queue_size = LISTEN_BACKLOG
+
+
+class SharedSocketHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer accepting on a listening socket shared with other worker processes"""
+    
+    def __init__(self, sock):
+        super().__init__(sock.getsockname(), TTSRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        # Another worker may take the connection first - never block in accept()
+        self.socket.setblocking(False)
+    
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        conn.setblocking(True)
+        return conn, addr
+
+
+class BadRequest(Exception):
+    """Malformed HTTP request on the asyncio front end"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncHTTPServer:
+    """
+    HTTP/1.1 front end served from the backend's event loop (asyncio mode)
+    
+    Connections are persistent and requests on one connection are handled
+    strictly in order, so pipelined requests are answered in the order sent.
+    Exposes serve_forever/shutdown/server_close like ThreadingHTTPServer so
+    the shutdown command and parent process monitor work unchanged.
+    """
+    
+    def __init__(self, server_address, backend, sock=None):
+        self.server_address = server_address
+        self.backend = backend
+        self._server = None
+        self._connections = set()
+        self._stopped = Event()
+        backend.loop_thread.run(self._start(sock))
+    
+    async def _start(self, sock):
+        if sock is not None:
+            # Listening socket shared with other worker processes
+            self._server = await asyncio.start_server(self._handle_connection, sock=sock, limit=MAX_REQUEST_LINE)
+            return
+        host, port = self.server_address
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_REQUEST_LINE,
+                                                  backlog=LISTEN_BACKLOG)
+    
+    def serve_forever(self):
+        """Block until shutdown() is called"""
+        # Wait in short slices so KeyboardInterrupt is still delivered on Windows
+        while not self._stopped.wait(0.5):
+            pass
+    
+    def shutdown(self):
+        """Stop serve_forever; safe to call from any thread"""
+        self._stopped.set()
+    
+    def server_close(self):
+        """Stop listening and drop open connections"""
+        try:
+            self.backend.loop_thread.run(self._close(), timeout=5)
+        except Exception as e:
+            sys.stderr.write(f"[TTS Server] Error closing server: {e}\n")
+            sys.stderr.flush()
+    
+    async def _close(self):
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+    
+    async def _read_request(self, reader, writer):
+        """
+        Read one request from a connection
+        
+        Returns:
+            (method, target, version, headers, body), or None when the client closed the connection
+        """
+        line = await reader.readline()
+        while line in (b"\r\n", b"\n"):
+            # Tolerate stray blank lines between pipelined requests
+            line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise BadRequest(400, f"Bad request line: {line[:100]!r}")
+        method, target, version = parts
+        
+        raw_headers = []
+        while True:
+            header = await reader.readline()
+            if not header:
+                return None
+            if header in (b"\r\n", b"\n"):
+                break
+            raw_headers.append(header)
+            if len(raw_headers) > MAX_REQUEST_HEADERS:
+                raise BadRequest(431, "Too many headers")
+        headers = http.client.parse_headers(io.BytesIO(b"".join(raw_headers) + b"\r\n"))
+        
+        if headers.get('Transfer-Encoding'):
+            raise BadRequest(501, "Chunked request bodies are not supported")
+        try:
+            content_length = int(headers.get('Content-Length', 0) or 0)
+        except ValueError:
+            raise BadRequest(400, "Invalid Content-Length")
+        if not self.backend.admission.body_allowed(content_length):
+            if content_length <= MAX_DISCARDED_BODY and headers.get('Expect', '').lower() != '100-continue':
+                # Read and drop it, so the client sees the 413 instead of a reset connection
+                remaining = content_length
+                while remaining > 0:
+                    remaining -= len(await reader.readexactly(min(remaining, 64 * 1024)))
+            raise BadRequest(413, f"Request body of {content_length} bytes exceeds the {self.backend.admission.max_body_bytes} byte limit")
+        body = b""
+        if content_length > 0:
+            if headers.get('Expect', '').lower() == '100-continue':
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            body = await reader.readexactly(content_length)
+        return method, target, version, headers, body
+    
+    @staticmethod
+    def _keep_alive(version, headers):
+        connection = headers.get('Connection', '').lower()
+        if version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+    
+    async def _write_response(self, writer, response, keep_alive):
+        """Write a dispatched response; returns bytes sent"""
+        head = [f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}",
+                f"Content-Type: {response.content_type}"]
+        head += [f"{name}: {value}" for name, value in response.headers.items()]
+        if not keep_alive:
+            head.append("Connection: close")
+        
+        if response.chunks is None:
+            head.append(f"Content-Length: {len(response.body)}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+            await writer.drain()
+            return len(response.body)
+        
+        head.append("Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+        return await self._relay_chunks(writer, response)
+    
+    async def _relay_chunks(self, writer, response):
+        """Relay items of an async iterator with chunked transfer encoding as they arrive"""
+        sent = 0
+        try:
+            while True:
+                try:
+                    # Tracked, so a cancel request aborts the upstream stream while we wait
+                    chunk = await self.backend.run_tracked(response.request_id, response.chunks.__anext__())
+                except StopAsyncIteration:
+                    break
+                if response.encode is not None:
+                    chunk = response.encode(chunk)
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+                sent += len(chunk)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            response.outcome = "disconnected"
+            raise
+        except Exception as e:
+            # Headers are already sent - end the connection without the final chunk
+            # so the client sees a truncated transfer instead of a short clip
+            sys.stderr.write(f"[TTS Server] Stream aborted: {e}\n")
+            response.outcome = "cancelled" if isinstance(e, RequestCancelled) else "aborted"
+            raise ConnectionAbortedError("stream aborted")
+        finally:
+            await response.chunks.aclose()
+        return sent
+    
+    async def _dispatch(self, reader, method, target, headers, body):
+        """
+        Dispatch a request, cancelling it if the client disconnects meanwhile
+        
+        Raises:
+            ConnectionAbortedError: The client went away and the request was cancelled
+        """
+        task = asyncio.ensure_future(self.backend.dispatch(method, target, headers, body))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+                if done:
+                    return task.result()
+                # EOF is only reported once buffered (pipelined) requests are consumed,
+                # so a client that is still waiting never looks disconnected
+                if reader.at_eof():
+                    raise ConnectionAbortedError("client disconnected, request cancelled")
+        finally:
+            task.cancel()
+    
+    async def _handle_connection(self, reader, writer):
+        """Serve requests on one connection until it closes or goes idle"""
+        self._connections.add(writer)
+        metrics = self.backend.metrics
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader, writer), KEEPALIVE_IDLE_TIMEOUT)
+                except BadRequest as e:
+                    response = HttpResponse.json(e.status, {"success": False, "error": str(e)})
+                    await self._write_response(writer, response, keep_alive=False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    break
+                if request is None:
+                    break
+                
+                method, target, version, headers, body = request
+                keep_alive = self._keep_alive(version, headers)
+                started = time.monotonic()
+                endpoint, outcome, sent = "unknown", "error", 0
+                trace = self.backend.start_trace(method, target)
+                reserved = None
+                metrics.add_gauge("http_requests_in_flight", 1)
+                try:
+                    try:
+                        reserved, response = self.backend.admit(method, target, body)
+                        if response is None:
+                            response = await self._dispatch(reader, method, target, headers, body)
+                            reserved = self.backend.hold_response(reserved, response)
+                    except (ConnectionError, asyncio.CancelledError):
+                        raise
+                    except Exception as e:
+                        import traceback
+                        response = HttpResponse.json(500, {
+                            "success": False,
+                            "error": str(e),
+                            "traceback": traceback.format_exc()
+                        }, endpoint=endpoint, outcome="error")
+                    endpoint = response.endpoint
+                    try:
+                        sent = await self._write_response(writer, response, keep_alive)
+                    finally:
+                        outcome = response.outcome
+                except ConnectionError as e:
+                    sys.stderr.write(f"[TTS Server] Request aborted: {str(e)}\n")
+                    if endpoint == "unknown" or outcome == "success":
+                        outcome = "disconnected"
+                    break
+                finally:
+                    self.backend.finish_admitted(reserved)
+                    metrics.add_gauge("http_requests_in_flight", -1)
+                    self.backend.record_request(endpoint, outcome, sent, started, trace)
+                
+                if response.shutdown:
+                    self.shutdown()
+                    break
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+
+# --transport stdio: every frame starts with payload length, stream ID and frame type (little endian)
+STDIO_FRAME_HEADER = struct.Struct("<IIB")
+# REQUEST payload prefix: method, length of the head (target and header lines)
+STDIO_REQUEST_HEADER = struct.Struct("<BH")
+# RESPONSE payload prefix: status, flags, length of the head (header lines)
+STDIO_RESPONSE_HEADER = struct.Struct("<HBH")
+STDIO_MAX_FRAME = 64 * 1024 * 1024
+STDIO_METHODS = ("GET", "POST")
+STDIO_RESPONSE_MORE = 0x01  # RESPONSE flag: DATA frames and an END frame follow
+FRAME_REQUEST, FRAME_CANCEL, FRAME_RESPONSE, FRAME_DATA, FRAME_END, FRAME_STATUS = range(1, 7)
+
+
+def write_frame(stream, stream_id, frame_type, payload=b""):
+    """Write one stdio transport frame and flush it"""
+    stream.write(STDIO_FRAME_HEADER.pack(len(payload), stream_id, frame_type) + payload)
+    stream.flush()
+
+
+class StdioTransport:
+    """
+    Front end talking to the parent process over stdin/stdout (--transport stdio)
+
+    Each frame is a 9-byte header (payload length u32, stream ID u32, type u8)
+    and its payload. The parent opens a stream with REQUEST: method (u8, 0 GET,
+    1 POST), head length (u16), the head (target, then "Name: value" header
+    lines, separated by CRLF) and the raw body. The answer is RESPONSE: status
+    (u16), flags (u8), head length (u16), the header lines and the body; with
+    STDIO_RESPONSE_MORE set (/stream, /batch) DATA frames follow with one chunk
+    each, then END, which is empty on success and holds the error otherwise.
+    Streams complete in any order, as their requests finish. CANCEL aborts a
+    stream; if it has not answered yet it answers 400 with "cancelled": true.
+    STATUS frames on stream 0 carry the JSON startup messages. Requests and
+    responses are those of the HTTP endpoints; EOF on stdin stops the server.
+    Exposes serve_forever/shutdown/server_close like ThreadingHTTPServer.
+    """
+
+    def __init__(self, backend, stdin, stdout):
+        self.backend = backend
+        self.stdin = stdin
+        self.stdout = stdout
+        self._tasks = {}  # stream ID -> task serving it; event loop only
+        # One writer thread keeps frames whole and in order, and blocks only it while the parent is not reading
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-stdio-writer")
+        self._stopped = Event()
+
+    def serve_forever(self):
+        """Read frames until shutdown() is called or the parent closes stdin"""
+        Thread(target=self._read_frames, name="tts-stdio-reader", daemon=True).start()
+        # Wait in short slices so KeyboardInterrupt is still delivered on Windows
+        while not self._stopped.wait(0.5):
+            pass
+
+    def shutdown(self):
+        """Stop serve_forever; safe to call from any thread"""
+        self._stopped.set()
+
+    def server_close(self):
+        """Abort open streams and stop the writer thread"""
+        try:
+            self.backend.loop_thread.run(self._close(), timeout=5)
+        except Exception as e:
+            sys.stderr.write(f"[TTS Server] Error closing stdio transport: {e}\n")
+            sys.stderr.flush()
+        self._writer.shutdown(wait=False)
+
+    async def _close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # Let them write their cancelled responses before the writer thread stops
+            await asyncio.wait(tasks, timeout=2)
+
+    def _read_exactly(self, size):
+        """Read size bytes from stdin, or None at EOF"""
+        data = b""
+        while len(data) < size:
+            # Unbuffered read: a thread blocked inside the buffered reader stalls interpreter shutdown
+            chunk = os.read(self.stdin.fileno(), size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_frames(self):
+        loop = self.backend.loop_thread.loop
+        try:
+            while not self._stopped.is_set():
+                header = self._read_exactly(STDIO_FRAME_HEADER.size)
+                if header is None:
+                    sys.stderr.write("[TTS Server] Parent closed stdin, shutting down\n")
+                    break
+                length, stream_id, frame_type = STDIO_FRAME_HEADER.unpack(header)
+                if length > STDIO_MAX_FRAME:
+                    raise ValueError(f"frame of {length} bytes exceeds the {STDIO_MAX_FRAME} byte limit")
+                payload = self._read_exactly(length) if length else b""
+                if payload is None:
+                    sys.stderr.write("[TTS Server] Parent closed stdin mid-frame, shutting down\n")
+                    break
+                loop.call_soon_threadsafe(self._on_frame, stream_id, frame_type, payload)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"[TTS Server] Stdio transport failed: {e}\n")
+        sys.stderr.flush()
+        self.shutdown()
+
+    def _on_frame(self, stream_id, frame_type, payload):
+        if frame_type == FRAME_REQUEST:
+            if stream_id in self._tasks:
+                sys.stderr.write(f"[TTS Server] Ignoring REQUEST for stream {stream_id}, which is still open\n")
+                return
+            task = asyncio.ensure_future(self._serve(stream_id, payload))
+            self._tasks[stream_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(stream_id, None))
+        elif frame_type == FRAME_CANCEL:
+            task = self._tasks.get(stream_id)
+            if task is not None:
+                # Scheduled after the task's first step: a task cancelled before it starts never answers
+                asyncio.get_running_loop().call_soon(task.cancel)
+        else:
+            sys.stderr.write(f"[TTS Server] Ignoring unexpected frame type {frame_type} on stream {stream_id}\n")
+
+    @staticmethod
+    def _parse_request(payload):
+        """
+        Split a REQUEST payload
+
+        Returns:
+            (method, target, headers, body)
+
+        Raises:
+            ValueError: The payload is malformed
+        """
+        if len(payload) < STDIO_REQUEST_HEADER.size:
+            raise ValueError("Truncated REQUEST frame")
+        method, head_length = STDIO_REQUEST_HEADER.unpack_from(payload)
+        if method >= len(STDIO_METHODS):
+            raise ValueError(f"Unknown method code {method}")
+        start = STDIO_REQUEST_HEADER.size
+        if start + head_length > len(payload):
+            raise ValueError("REQUEST head runs past the end of the frame")
+        target, _, header_lines = payload[start:start + head_length].partition(b"\r\n")
+        headers = http.client.parse_headers(io.BytesIO(header_lines + b"\r\n\r\n" if header_lines else b"\r\n"))
+        return STDIO_METHODS[method], target.decode('latin-1'), headers, payload[start + head_length:]
+
+    async def _write(self, stream_id, frame_type, payload=b""):
+        await asyncio.get_running_loop().run_in_executor(self._writer, write_frame, self.stdout, stream_id, frame_type, payload)
+
+    async def _write_response(self, stream_id, response):
+        """Write a dispatched response; returns bytes sent"""
+        head = [f"Content-Type: {response.content_type}"]
+        head += [f"{name}: {value}" for name, value in response.headers.items()]
+        head = "\r\n".join(head).encode('latin-1')
+        flags = STDIO_RESPONSE_MORE if response.chunks is not None else 0
+        await self._write(stream_id, FRAME_RESPONSE,
+                          STDIO_RESPONSE_HEADER.pack(response.status, flags, len(head)) + head + response.body)
+        if response.chunks is None:
+            return len(response.body)
+        return await self._relay_chunks(stream_id, response)
+
+    async def _relay_chunks(self, stream_id, response):
+        """Relay items of an async iterator as DATA frames, then END"""
+        sent = 0
+        error = b""
+        try:
+            while True:
+                try:
+                    # Tracked, so a cancel request aborts the upstream stream while we wait
+                    chunk = await self.backend.run_tracked(response.request_id, response.chunks.__anext__())
+                except StopAsyncIteration:
+                    break
+                if response.encode is not None:
+                    chunk = response.encode(chunk)
+                await self._write(stream_id, FRAME_DATA, chunk)
+                sent += len(chunk)
+        except (OSError, ValueError):
+            # stdout is gone
+            raise
+        except (asyncio.CancelledError, RequestCancelled):
+            response.outcome = "cancelled"
+            error = b"cancelled"
+        except Exception as e:
+            sys.stderr.write(f"[TTS Server] Stream aborted: {e}\n")
+            response.outcome = "aborted"
+            error = str(e).encode('utf-8') or b"aborted"
+        finally:
+            await response.chunks.aclose()
+        await self._write(stream_id, FRAME_END, error)
+        return sent
+
+    async def _serve(self, stream_id, payload):
+        """Dispatch one REQUEST and write its response on the same stream"""
+        backend = self.backend
+        metrics = backend.metrics
+        started = time.monotonic()
+        endpoint, outcome, sent = "unknown", "error", 0
+        response = None
+        reserved = None
+        try:
+            method, target, headers, body = self._parse_request(payload)
+        except ValueError as e:
+            method, target, headers, body = None, "", None, b""
+            response = HttpResponse.json(400, {"success": False, "error": str(e)}, endpoint="unknown", outcome="error")
+        else:
+            if not backend.admission.body_allowed(len(body)):
+                response = backend.overloaded_response("body_too_large", len(body))
+            else:
+                reserved, response = backend.admit(method, target, body)
+        trace = backend.start_trace(method or "?", target)
+        metrics.add_gauge("http_requests_in_flight", 1)
+        try:
+            if response is None:
+                try:
+                    response = await backend.dispatch(method, target, headers, body)
+                    reserved = backend.hold_response(reserved, response)
+                except asyncio.CancelledError:
+                    # CANCEL frame from the parent
+                    response = HttpResponse.json(400, {"success": False, "cancelled": True,
+                                                       "error": f"Stream {stream_id} was cancelled"}, outcome="cancelled")
+                except Exception as e:
+                    import traceback
+                    response = HttpResponse.json(500, {
+                        "success": False,
+                        "error": str(e),
+                        "traceback": traceback.format_exc()
+                    }, endpoint=endpoint, outcome="error")
+            endpoint = response.endpoint
+            try:
+                sent = await self._write_response(stream_id, response)
+            finally:
+                outcome = response.outcome
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"[TTS Server] Could not write stream {stream_id}: {e}\n")
+            outcome = "disconnected"
+        finally:
+            backend.finish_admitted(reserved)
+            metrics.add_gauge("http_requests_in_flight", -1)
+            backend.record_request(endpoint, outcome, sent, started, trace)
+        if response.shutdown:
+            self.shutdown()
+
+
+# (module, package) pairs checked at startup
+REQUIRED_PACKAGES = [
+    ("fishaudio", "fish-audio-sdk"),
+    ("httpx", "httpx"),
+    ("ormsgpack", "ormsgpack"),
+]
+OPTIONAL_PACKAGES = [
+    ("numpy", "numpy"),
+]
+
+
+def check_dependencies():
+    """
+    Check that the required packages are installed without importing them
+
+    Returns:
+        Dictionary in the format of check_dependencies.py, plus optional packages that are missing
+    """
+    results = {
+        "success": True,
+        "python_version": f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
+        "missing_packages": [],
+        "installed_packages": [],
+        "missing_optional": [],
+        "errors": []
+    }
+    for packages, required in ((REQUIRED_PACKAGES, True), (OPTIONAL_PACKAGES, False)):
+        for module_name, package_name in packages:
+            try:
+                found = importlib.util.find_spec(module_name) is not None
+            except (ImportError, ValueError) as e:
+                found = False
+                results["errors"].append(f"{module_name}: {e}")
+            if found:
+                results["installed_packages"].append(package_name)
+            elif required:
+                results["success"] = False
+                results["missing_packages"].append({"package": package_name, "module": module_name})
+            else:
+                results["missing_optional"].append(package_name)
+    return results
+
+
+class DeferredImports:
+    """
+    Imports the Fish Audio SDK (with httpx and ormsgpack) and numpy on a background thread
+
+    The server binds its socket and reports ready while this runs; requests
+    wait for it in TTSBackend.dispatch() before touching the SDK.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.error = None
+        self.sdk_version = None
+        self._done = Event()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._done.is_set()
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="tts-imports", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        global AsyncFishAudio, APIError, ServerError, TTSConfig, TTSRequest, Prosody, httpx, ormsgpack, np
+        started = time.perf_counter()
+        try:
+            import httpx
+            import ormsgpack
+            import fishaudio
+            from fishaudio import AsyncFishAudio
+            from fishaudio.exceptions import APIError, ServerError
+            from fishaudio.types import TTSConfig, TTSRequest, Prosody
+            self.sdk_version = getattr(fishaudio, "__version__", "unknown")
+        except Exception as e:
+            self.error = e
+        self.timings["sdk_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+        self.timings["numpy_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        if self.error is None:
+            sys.stderr.write(f"[TTS Server] fishaudio {self.sdk_version} loaded in {self.timings['sdk_ms']:.0f} ms\n")
+        else:
+            sys.stderr.write(f"[TTS Server] Failed to import fishaudio: {self.error}\n")
+        sys.stderr.flush()
+        self._done.set()
+
+    def wait(self):
+        """
+        Block until the imports are done (running them here if start() was not called)
+
+        Raises:
+            ImportError: The Fish Audio SDK could not be imported
+        """
+        if self._thread is None and not self.loaded:
+            self._run()
+        self._done.wait()
+        if self.error is not None:
+            raise ImportError(f"fishaudio package could not be imported: {self.error}")
+
+
+deferred_imports = DeferredImports()
+
+
 def monitor_parent_process(parent_pid, server):
     """Monitor parent process and shutdown server if parent exits"""
     if parent_pid is None:
@@ -253,50 +4013,502 @@ def monitor_parent_process(parent_pid, server):
         # Check every 5 seconds
         time.sleep(5)
 
-def run_server(port=5678, parent_pid=None):
+def worker_share(total, workers, index):
+    """Part of an integer limit for worker index when it is divided between workers; the first ones get the remainder"""
+    return total // workers + (1 if index < total % workers else 0)
+
+
+def max_workers(options):
+    """Most --workers processes the limits allow: every worker needs at least one upstream slot (and token, and request)"""
+    limits = [getattr(options, "max_concurrency", 5)]
+    if getattr(options, "rate_limit", 0.0) > 0:
+        limits.append(getattr(options, "rate_burst", 5))
+    if getattr(options, "max_in_flight", 64) > 0:
+        limits.append(getattr(options, "max_in_flight", 64))
+    return max(1, min(limits))
+
+
+def build_backend(options=None, workers=1, index=0):
+    """
+    Create the backend from the command line options
+    
+    With workers > 1 this is worker number index of several processes: the
+    cache directory is shared and the per-key upstream limits are divided
+    between the workers, so together they stay within them (see max_workers).
+    """
+    cache = None
+    if not getattr(options, "no_cache", False):
+        cache = AudioCache(
+            getattr(options, "cache_dir", DEFAULT_CACHE_DIR),
+            max_bytes=int(getattr(options, "cache_size_mb", 256) * 1024 * 1024),
+            memory_bytes=int(getattr(options, "cache_memory_mb", 32) * 1024 * 1024),
+            processes=workers
+        )
+        sys.stderr.write(f"[TTS Server] Audio cache: {cache.cache_dir} ({cache.stats()['entries']} entries)\n")
+        sys.stderr.flush()
+    
+    trace = None
+    if getattr(options, "trace", None):
+        path = options.trace
+        if workers > 1:
+            # One file per worker process; replay_trace.py merges them
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{os.getpid()}{ext}"
+        trace = TraceRecorder(path, max_bytes=int(getattr(options, "trace_max_mb", 64) * 1024 * 1024))
+        trace.start(server_mode=getattr(options, "server_mode", "threading"), workers=workers)
+        sys.stderr.write(f"[TTS Server] Recording request trace to {path}\n")
+        sys.stderr.flush()
+    
+    prefetch_concurrency = getattr(options, "prefetch_concurrency", 2)
+    return TTSBackend(
+        base_url=getattr(options, "base_url", DEFAULT_BASE_URL),
+        idle_timeout=getattr(options, "client_idle_timeout", 300.0),
+        cache=cache,
+        batch_concurrency=getattr(options, "batch_concurrency", 4),
+        scheduler=UpstreamScheduler(
+            rate=getattr(options, "rate_limit", 0.0) / workers,
+            burst=max(1, worker_share(getattr(options, "rate_burst", 5), workers, index)),
+            max_concurrency=max(1, worker_share(getattr(options, "max_concurrency", 5), workers, index)),
+            max_retries=getattr(options, "max_retries", 3)
+        ),
+        prefetch_concurrency=max(1, prefetch_concurrency // workers) if prefetch_concurrency > 0 else 0,
+        prefetch_budget=getattr(options, "prefetch_budget", 20) / workers,
+        prefetch_queue_size=getattr(options, "prefetch_queue_size", 64),
+        negative_cache=NegativeCache(ttl=getattr(options, "negative_cache_ttl", 30.0)),
+        breaker=CircuitBreaker(
+            failure_threshold=getattr(options, "breaker_failures", 5),
+            reset_timeout=getattr(options, "breaker_reset", 10.0)
+        ),
+        admission=AdmissionControl(
+            max_body_bytes=int(getattr(options, "max_body_mb", 1) * 1024 * 1024),
+            max_in_flight=max(1, worker_share(getattr(options, "max_in_flight", 64), workers, index)) if getattr(options, "max_in_flight", 64) > 0 else 0,
+            max_buffered_bytes=int(getattr(options, "max_buffered_mb", 64) * 1024 * 1024 / workers)
+        ),
+        latency_mode=LatencyModeSelector(
+            queue_depth=getattr(options, "balanced_queue_depth", 3),
+            slow_seconds=getattr(options, "balanced_latency", 3.0)
+        ),
+        spool=AudioSpool(
+            getattr(options, "spool_dir", DEFAULT_SPOOL_DIR),
+            max_bytes=int(getattr(options, "spool_size_mb", 64) * 1024 * 1024 / workers),
+            lease_timeout=getattr(options, "spool_lease_timeout", 30.0)
+        ) if getattr(options, "spool_size_mb", 64) > 0 else None,
+        trace=trace
+    )
+
+
+def create_http_server(server_mode, server_address, backend, sock=None):
+    """HTTP front end for backend, bound to server_address or serving an already listening sock"""
+    if server_mode == "asyncio":
+        return AsyncHTTPServer(server_address, backend, sock=sock)
+    if sock is not None:
+        httpd = SharedSocketHTTPServer(sock)
+    else:
+        httpd = TTSHTTPServer(server_address, TTSRequestHandler)
+    httpd.backend = backend
+    return httpd
+
+
+def serve_until_stopped(httpd, backend):
+    """Run httpd until it is shut down, then release the backend"""
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write("[TTS Server] Keyboard interrupt received\n")
+        sys.stderr.flush()
+    except Exception as e:
+        sys.stderr.write(f"[TTS Server] Server error: {e}\n")
+        sys.stderr.flush()
+    finally:
+        sys.stderr.write("[TTS Server] Cleaning up...\n")
+        sys.stderr.flush()
+        httpd.server_close()
+        backend.stop()
+
+
+def report_status(message, channel=None):
+    """Send a JSON startup message to the parent: a stdout line, or a STATUS frame on channel with --transport stdio"""
+    if channel is None:
+        print(json.dumps(message), flush=True)
+    else:
+        write_frame(channel, 0, FRAME_STATUS, json.dumps(message).encode('utf-8'))
+
+
+def run_server(port=5678, parent_pid=None, options=None, channel=None):
     """
-    Start the TTS HTTP server with threading support for concurrent requests
+    Start the TTS server (HTTP, threaded or served from the backend event loop, or the stdio transport)
     
     Args:
-        port: Port number to listen on (default: 5678)
+        port: Port number to listen on (default: 5678; unused with the stdio transport)
         parent_pid: Parent process ID to monitor (optional)
+        options: Parsed command line options (optional)
+        channel: Binary stdout of the process, with --transport stdio
     """
-    server_address = ('127.0.0.1', port)
-    httpd = ThreadingHTTPServer(server_address, TTSRequestHandler)
+    if channel is not None and getattr(options, "workers", 1) > 1:
+        sys.stderr.write("[TTS Server] --workers is not supported with --transport stdio, using one process\n")
+        sys.stderr.flush()
+        options.workers = 1
+    if getattr(options, "workers", 1) > max_workers(options):
+        sys.stderr.write(f"[TTS Server] --workers {options.workers} would exceed the upstream limits, "
+                         f"using {max_workers(options)} processes\n")
+        sys.stderr.flush()
+        options.workers = max_workers(options)
+    if getattr(options, "workers", 1) > 1:
+        run_workers(port, parent_pid, options)
+        return
+    
+    timings = {"imports_ms": round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)}
+    # Import the SDK while the cache index is read and the socket is bound
+    deferred_imports.start()
+    
+    step_started = time.perf_counter()
+    backend = build_backend(options)
+    backend.start()
+    timings["cache_ms"] = round((time.perf_counter() - step_started) * 1000, 1)
+    
+    step_started = time.perf_counter()
+    if channel is not None:
+        server_mode = "stdio"
+        httpd = StdioTransport(backend, sys.stdin.buffer, channel)
+    else:
+        server_mode = getattr(options, "server_mode", "threading")
+        httpd = create_http_server(server_mode, ('127.0.0.1', port), backend)
     
     # Start parent process monitor thread
     if parent_pid is not None:
         monitor_thread = Thread(target=monitor_parent_process, args=(parent_pid, httpd), daemon=True)
         monitor_thread.start()
     
+    timings["bind_ms"] = round((time.perf_counter() - step_started) * 1000, 1)
+    if getattr(options, "warmup", False):
+        backend.warm_up()
+    timings["total_ms"] = round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)
+    # Still importing in the background unless the SDK was already loaded
+    timings.update(deferred_imports.timings)
+    
+    report_status({
+        "status": "ready",
+        "port": port if channel is None else None,
+        "mode": server_mode,
+        "sdk_loaded": deferred_imports.loaded,
+        "timings": timings,
+        "message": f"Fish Audio TTS Server started ({server_mode} mode) in {timings['total_ms']:.0f} ms"
+    }, channel)
+    
+    serve_until_stopped(httpd, backend)
+    print(json.dumps({
+        "status": "stopped",
+        "message": "Fish Audio TTS Server stopped"
+    }), file=sys.stderr, flush=True)
+
+
+class WorkerLink:
+    """
+    A worker's control pipe to the --workers supervisor
+    
+    Commands that concern every worker (shutdown, cancelling a request that
+    runs elsewhere) are sent to the supervisor, which relays them to the other
+    workers. If the supervisor goes away the pipe closes and the worker stops.
+    """
+    
+    def __init__(self, conn, httpd, backend):
+        self.conn = conn
+        self.httpd = httpd
+        self.backend = backend
+        self._lock = Lock()
+    
+    def send(self, command, *args):
+        try:
+            with self._lock:
+                self.conn.send((command,) + args)
+        except (OSError, EOFError):
+            pass
+    
+    def run(self):
+        """Handle commands from the supervisor until it closes the pipe"""
+        while True:
+            try:
+                message = self.conn.recv()
+            except (OSError, EOFError):
+                sys.stderr.write(f"[TTS Server] Worker {os.getpid()}: supervisor is gone, shutting down\n")
+                sys.stderr.flush()
+                break
+            if message[0] == "cancel":
+                self.backend.loop_thread.submit(self.backend.cancel(message[1]))
+            elif message[0] == "shutdown":
+                break
+        self.httpd.shutdown()
+
+
+def worker_main(index, sock, conn, options):
+    """Entry point of one --workers process (module level so the spawn start method can import it)"""
+    started = time.perf_counter()
+    deferred_imports.start()
+    backend = build_backend(options, workers=options.workers, index=index)
+    backend.start()
+    server_mode = getattr(options, "server_mode", "threading")
+    httpd = create_http_server(server_mode, sock.getsockname(), backend, sock=sock)
+    link = WorkerLink(conn, httpd, backend)
+    backend.peers = link
+    Thread(target=link.run, name="tts-worker-link", daemon=True).start()
+    if getattr(options, "warmup", False):
+        backend.warm_up()
+    link.send("ready", {"pid": os.getpid(), "startup_ms": round((time.perf_counter() - started) * 1000, 1)})
+    serve_until_stopped(httpd, backend)
+
+
+# --workers: a worker that exits sooner than this after starting is not restarted
+WORKER_MIN_UPTIME = 10.0
+
+
+class WorkerPool:
+    """
+    --workers mode: worker processes accepting connections on one listening socket
+    
+    The supervisor binds the port and passes the socket to each worker; workers
+    are started with the spawn method, which also works on Windows (the socket
+    is shared through multiprocessing's socket pickling). Each worker runs its
+    own backend; cache entries are shared through the cache directory. Workers
+    that exit unexpectedly are restarted. Exposes serve_forever/shutdown/
+    server_close like ThreadingHTTPServer, so the parent process monitor works
+    unchanged.
+    """
+    
+    def __init__(self, port, workers, options):
+        self.port = port
+        self.workers = workers
+        self.options = options
+        self.context = multiprocessing.get_context("spawn")
+        self.sock = socket.create_server(('127.0.0.1', port), backlog=LISTEN_BACKLOG)
+        self._processes = {}  # index -> (process, supervisor end of the pipe)
+        self._spawned = {}  # index -> start time, to avoid restarting a worker that keeps crashing
+        self._stopped = Event()
+        self.restarts = 0
+    
+    def _spawn(self, index):
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(index, self.sock, child_conn, self.options),
+                                       name=f"tts-worker-{index}", daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[index] = (process, conn)
+        self._spawned[index] = time.monotonic()
+    
+    def start(self, timeout=60.0):
+        """
+        Start the workers and wait until each one is serving
+        
+        Returns:
+            List of the ready messages of the workers
+        """
+        for index in range(self.workers):
+            self._spawn(index)
+        ready = []
+        deadline = time.monotonic() + timeout
+        for index, (process, conn) in self._processes.items():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not conn.poll(remaining):
+                raise RuntimeError(f"Worker {index} did not start within {timeout:.0f} seconds")
+            try:
+                message = conn.recv()
+            except EOFError:
+                raise RuntimeError(f"Worker {index} exited during startup with code {process.exitcode}")
+            ready.append(dict(message[1], worker=index))
+        return ready
+    
+    def _broadcast(self, message, exclude=None):
+        for index, (process, conn) in self._processes.items():
+            if index == exclude:
+                continue
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass
+    
+    def serve_forever(self):
+        """Relay commands between workers until shutdown() is called"""
+        while not self._stopped.is_set():
+            connections = {conn: index for index, (_, conn) in self._processes.items()}
+            sentinels = {process.sentinel: index for index, (process, _) in self._processes.items()}
+            for ready in multiprocessing.connection.wait(list(connections) + list(sentinels), timeout=0.5):
+                if ready in sentinels:
+                    index = sentinels[ready]
+                    if self._stopped.is_set():
+                        continue
+                    process, conn = self._processes.pop(index)
+                    process.join(timeout=1)
+                    conn.close()
+                    if time.monotonic() - self._spawned[index] < WORKER_MIN_UPTIME:
+                        sys.stderr.write(f"[TTS Server] Worker {index} (PID {process.pid}) crashed right after starting (code {process.exitcode}), not restarting\n")
+                        sys.stderr.flush()
+                        if not self._processes:
+                            self.shutdown()
+                        continue
+                    sys.stderr.write(f"[TTS Server] Worker {index} (PID {process.pid}) exited with code {process.exitcode}, restarting\n")
+                    sys.stderr.flush()
+                    self.restarts += 1
+                    self._spawn(index)
+                    continue
+                index = connections[ready]
+                try:
+                    message = ready.recv()
+                except (OSError, EOFError):
+                    continue
+                if message[0] == "shutdown":
+                    self.shutdown()
+                elif message[0] == "cancel":
+                    self._broadcast(message, exclude=index)
+    
+    def shutdown(self):
+        """Stop serve_forever; safe to call from any thread"""
+        self._stopped.set()
+    
+    def server_close(self):
+        """Stop every worker and close the listening socket"""
+        self._broadcast(("shutdown",))
+        for index, (process, conn) in self._processes.items():
+            process.join(timeout=10)
+            if process.is_alive():
+                sys.stderr.write(f"[TTS Server] Worker {index} did not exit, terminating\n")
+                sys.stderr.flush()
+                process.terminate()
+                process.join(timeout=5)
+            conn.close()
+        self.sock.close()
+
+
+def run_workers(port, parent_pid, options):
+    """Supervisor of --workers mode: start the pool, report ready, and stop every worker on shutdown"""
+    timings = {"imports_ms": round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)}
+    if not getattr(options, "no_cache", False):
+        # Clean up interrupted writes and enforce the size limit once, before workers share the directory
+        AudioCache(getattr(options, "cache_dir", DEFAULT_CACHE_DIR),
+                   max_bytes=int(getattr(options, "cache_size_mb", 256) * 1024 * 1024), memory_bytes=0)
+    
+    pool = WorkerPool(port, options.workers, options)
+    server_mode = getattr(options, "server_mode", "threading")
+    try:
+        workers = pool.start()
+    except Exception as e:
+        print(json.dumps({"status": "error", "error": f"Failed to start workers: {e}"}), flush=True)
+        pool.server_close()
+        sys.exit(1)
+    
+    if parent_pid is not None:
+        monitor_thread = Thread(target=monitor_parent_process, args=(parent_pid, pool), daemon=True)
+        monitor_thread.start()
+    
+    timings["total_ms"] = round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)
     print(json.dumps({
         "status": "ready",
         "port": port,
-        "message": "Fish Audio TTS Server started (threading mode)"
+        "mode": server_mode,
+        "workers": workers,
+        "timings": timings,
+        "message": f"Fish Audio TTS Server started ({server_mode} mode, {len(workers)} workers) in {timings['total_ms']:.0f} ms"
     }), flush=True)
     
     try:
-        httpd.serve_forever()
+        pool.serve_forever()
     except KeyboardInterrupt:
         sys.stderr.write("[TTS Server] Keyboard interrupt received\n")
         sys.stderr.flush()
-    except Exception as e:
-        sys.stderr.write(f"[TTS Server] Server error: {e}\n")
-        sys.stderr.flush()
     finally:
-        sys.stderr.write("[TTS Server] Cleaning up...\n")
+        sys.stderr.write("[TTS Server] Stopping workers...\n")
         sys.stderr.flush()
-        httpd.server_close()
+        pool.server_close()
         print(json.dumps({
             "status": "stopped",
             "message": "Fish Audio TTS Server stopped"
         }), file=sys.stderr, flush=True)
 
 
+def parse_args(argv):
+    """Parse command line: positional port and parent PID, followed by optional flags"""
+    parser = argparse.ArgumentParser(description="Fish Audio TTS sidecar server")
+    parser.add_argument("port", nargs="?", default="5678")
+    parser.add_argument("parent_pid", nargs="?", default=None)
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL,
+                        help="Fish Audio API base URL")
+    parser.add_argument("--server-mode", choices=("threading", "asyncio"), default="threading",
+                        help="HTTP front end: one thread per connection, or keep-alive connections on the event loop")
+    parser.add_argument("--transport", choices=("http", "stdio"), default="http",
+                        help="Serve HTTP on the port, or framed requests from the parent process over stdin/stdout")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port (upstream limits are divided between them, so at most --max-concurrency)")
+    parser.add_argument("--check-dependencies", action="store_true",
+                        help="Print which required packages are installed as JSON and exit")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Open the upstream connection at startup, before the first request")
+    parser.add_argument("--client-idle-timeout", type=float, default=300.0,
+                        help="Seconds before an unused pooled API client is evicted")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the persistent audio cache")
+    parser.add_argument("--cache-size-mb", type=float, default=256,
+                        help="Maximum size of the on-disk audio cache")
+    parser.add_argument("--cache-memory-mb", type=float, default=32,
+                        help="Maximum size of the in-memory hot tier of the audio cache")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the audio cache")
+    parser.add_argument("--batch-concurrency", type=int, default=4,
+                        help="Maximum lines of one batch request synthesized at the same time")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="Upstream requests per second allowed per API key (0 = unlimited)")
+    parser.add_argument("--rate-burst", type=int, default=5,
+                        help="Token bucket size for --rate-limit")
+    parser.add_argument("--max-concurrency", type=int, default=5,
+                        help="Maximum concurrent upstream requests per API key")
+    parser.add_argument("--max-retries", type=int, default=3,
+                        help="Retries for rate-limited (429) and 5xx upstream responses")
+    parser.add_argument("--prefetch-concurrency", type=int, default=2,
+                        help="Prefetched lines rendered at the same time (0 disables prefetching)")
+    parser.add_argument("--prefetch-budget", type=float, default=20,
+                        help="Upstream calls per minute per API key that prefetching may use")
+    parser.add_argument("--prefetch-queue-size", type=int, default=64,
+                        help="Maximum lines queued for prefetching per API key")
+    parser.add_argument("--spool-dir", default=DEFAULT_SPOOL_DIR,
+                        help="Directory of the memory-mapped spool file used for response_format 'spool'")
+    parser.add_argument("--spool-size-mb", type=float, default=64,
+                        help="Size of the spool ring buffer (0 disables spool handoff)")
+    parser.add_argument("--spool-lease-timeout", type=float, default=30.0,
+                        help="Seconds before an unreleased spool lease expires and its audio may be overwritten")
+    parser.add_argument("--balanced-queue-depth", type=int, default=3,
+                        help="Requests sent with latency 'auto' use Fish Audio's 'balanced' mode from this many queued upstream calls")
+    parser.add_argument("--balanced-latency", type=float, default=3.0,
+                        help="...and while recent upstream calls take longer than this many seconds")
+    parser.add_argument("--negative-cache-ttl", type=float, default=30.0,
+                        help="Seconds to answer lines with a recently rejected API key or voice without calling the API (0 disables)")
+    parser.add_argument("--breaker-failures", type=int, default=5,
+                        help="Consecutive upstream outage errors that open the circuit breaker")
+    parser.add_argument("--breaker-reset", type=float, default=10.0,
+                        help="Seconds the circuit stays open before a probe request is let through")
+    parser.add_argument("--max-body-mb", type=float, default=1,
+                        help="Largest request body accepted; bigger ones are answered 413 without being read (0 = no limit)")
+    parser.add_argument("--max-in-flight", type=int, default=64,
+                        help="Requests worked on at once; more are answered 503 'overloaded' with Retry-After right away (0 = no limit)")
+    parser.add_argument("--max-buffered-mb", type=float, default=64,
+                        help="Request and buffered response bodies held at once before new requests are answered 503 (0 = no limit)")
+    parser.add_argument("--trace", default=None,
+                        help="Append a JSONL record per request (API keys and text redacted) to this file, for replay_trace.py")
+    parser.add_argument("--trace-max-mb", type=float, default=64,
+                        help="Size at which the trace file is rotated to <file>.1")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
     # Get port and parent PID from command line arguments
+    options = parse_args(sys.argv[1:])
+    if options.check_dependencies:
+        results = check_dependencies()
+        print(json.dumps(results, indent=2))
+        sys.exit(0 if results["success"] else 1)
     port = 5678
     parent_pid = None
+    channel = None
+    if options.transport == "stdio":
+        # stdout carries frames from here on; anything else printed goes to stderr
+        channel = sys.stdout.buffer
+        sys.stdout = sys.stderr
     
     # Log startup information
     sys.stderr.write("[TTS Server] Starting Fish Audio TTS Server...\n")
@@ -304,40 +4516,44 @@ if __name__ == "__main__":
     sys.stderr.write(f"[TTS Server] Python executable: {sys.executable}\n")
     sys.stderr.flush()
     
-    if len(sys.argv) > 1:
-        try:
-            port = int(sys.argv[1])
-            sys.stderr.write(f"[TTS Server] Using port: {port}\n")
-            sys.stderr.flush()
-        except ValueError:
-            print(json.dumps({
-                "status": "error",
-                "error": f"Invalid port number: {sys.argv[1]}"
-            }), file=sys.stderr)
-            sys.exit(1)
+    try:
+        port = int(options.port)
+        sys.stderr.write(f"[TTS Server] Using port: {port}\n")
+        sys.stderr.flush()
+    except ValueError:
+        print(json.dumps({
+            "status": "error",
+            "error": f"Invalid port number: {options.port}"
+        }), file=sys.stderr)
+        sys.exit(1)
     
-    if len(sys.argv) > 2:
+    if options.parent_pid is not None:
         try:
-            parent_pid = int(sys.argv[2])
+            parent_pid = int(options.parent_pid)
             sys.stderr.write(f"[TTS Server] Parent process PID: {parent_pid}\n")
             sys.stderr.flush()
         except ValueError:
-            sys.stderr.write(f"[TTS Server] Warning: Invalid parent PID: {sys.argv[2]}\n")
+            sys.stderr.write(f"[TTS Server] Warning: Invalid parent PID: {options.parent_pid}\n")
             sys.stderr.flush()
     
-    # Verify fishaudio package is available
-    try:
-        import fishaudio
-        sys.stderr.write(f"[TTS Server] fishaudio package version: {getattr(fishaudio, '__version__', 'unknown')}\n")
-        sys.stderr.flush()
-    except ImportError as e:
-        print(json.dumps({
+    # Verify required packages are installed (spec lookup only; the SDK is imported later)
+    dependencies = check_dependencies()
+    if not dependencies["success"]:
+        missing = ", ".join(entry["package"] for entry in dependencies["missing_packages"])
+        report_status({
             "status": "error",
-            "error": "fishaudio package not found. Please install: pip install fish-audio-sdk"
-        }), file=sys.stderr)
+            "error": f"Missing Python packages: {missing}. Please install: pip install {missing.replace(', ', ' ')}",
+            "dependencies": dependencies
+        }, channel)
         sys.exit(1)
+    if dependencies["missing_optional"]:
+        sys.stderr.write(f"[TTS Server] Optional packages not installed: {', '.join(dependencies['missing_optional'])}\n")
+        sys.stderr.flush()
     
-    sys.stderr.write(f"[TTS Server] Starting HTTP server on 127.0.0.1:{port}\n")
+    if channel is not None:
+        sys.stderr.write("[TTS Server] Serving the parent process over stdin/stdout\n")
+    else:
+        sys.stderr.write(f"[TTS Server] Starting HTTP server on 127.0.0.1:{port}\n")
     sys.stderr.flush()
     
-    run_server(port, parent_pid)
+    run_server(port, parent_pid, options, channel)
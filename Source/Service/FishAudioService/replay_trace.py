@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Fish Audio TTS Trace Replay
+Re-issues a request trace recorded with fish_audio_tts.py --trace against a
+server, at the original pacing or scaled, and reports the replayed latencies
+next to the recorded ones as JSON.
+
+Traces hold no text or API keys: each line is replayed with generated text of
+the recorded length, the same for every request that had the same parameters
+hash, so cache hits and coalescing repeat as they did. Examples:
+    python replay_trace.py trace.jsonl --mock
+    python replay_trace.py trace.jsonl --mock --speed 4 -- --server-mode asyncio
+    python replay_trace.py trace-*.jsonl --url http://127.0.0.1:5678 --api-key KEY --speed 0
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import http.client
+from threading import Thread, Lock, Semaphore
+from urllib.parse import urlparse
+
+from benchmark_tts import MockUpstream, free_port, percentiles, make_text, start_server, stop_server, fetch_metrics
+
+
+def load_trace(paths):
+    """Request records of one or more trace files (e.g. one per worker), merged in arrival order"""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("type") == "request":
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def build_line(fields, api_key):
+    """Request fields for one traced line, with text regenerated from its length and parameters hash"""
+    payload = dict(fields.get("params") or {})
+    payload["api_key"] = api_key or f"replay-{fields.get('key_id', 'key')}"
+    seed = fields.get("params_hash", "")
+    payload["text"] = make_text(random.Random(seed), fields.get("text_chars", 20), seed[:8])
+    return payload
+
+
+def build_request(record, api_key):
+    """
+    Turn a trace record back into an HTTP request
+
+    Returns:
+        (path, headers, payload), or None for records that are not replayed
+        (GETs, commands and requests the server could not parse)
+    """
+    if record.get("method") != "POST" or "command" in record:
+        return None
+    headers = {"Content-Type": "application/json"}
+    if "lines" in record:
+        payload = dict(record.get("params") or {})
+        payload["lines"] = [build_line(line, api_key) for line in record["lines"]]
+    elif "text_chars" in record:
+        payload = build_line(record, api_key)
+        if record.get("binary"):
+            headers["Accept"] = "audio/wav"
+    else:
+        return None
+    return record.get("path") or "/", headers, payload
+
+
+def replay(host, port, records, options):
+    """
+    Send the records at their recorded offsets divided by options.speed (0: back to back)
+
+    Returns:
+        Dictionary with per-request latencies, schedule lateness, statuses and bytes
+    """
+    lock = Lock()
+    slots = Semaphore(options.max_in_flight)
+    results = {"latency": [], "lateness": [], "statuses": {}, "failures": 0, "bytes": 0, "skipped": 0}
+
+    def send(path, headers, payload):
+        try:
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection(host, port, timeout=options.timeout)
+                connection.request("POST", path, json.dumps(payload), headers)
+                response = connection.getresponse()
+                size = len(response.read())
+                elapsed = time.perf_counter() - started
+                status = response.status
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    results["failures"] += 1
+                return
+            with lock:
+                results["statuses"][str(status)] = results["statuses"].get(str(status), 0) + 1
+                results["bytes"] += size
+                if status == 200:
+                    results["latency"].append(elapsed)
+        finally:
+            slots.release()
+
+    threads = []
+    first = records[0]["ts"] if records else 0.0
+    started = time.perf_counter()
+    for record in records:
+        request = build_request(record, options.api_key)
+        if request is None:
+            results["skipped"] += 1
+            continue
+        if options.speed > 0:
+            due = (record["ts"] - first) / options.speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        slots.acquire()
+        if options.speed > 0:
+            results["lateness"].append(max(0.0, time.perf_counter() - started - due))
+        thread = Thread(target=send, args=request, daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def recorded_summary(records):
+    """Latency and outcomes of the replayable records as the server saw them when the trace was taken"""
+    replayable = [r for r in records if build_request(r, None) is not None]
+    outcomes = {}
+    for record in replayable:
+        outcomes[record.get("outcome", "unknown")] = outcomes.get(record.get("outcome", "unknown"), 0) + 1
+    span = replayable[-1]["ts"] - replayable[0]["ts"] if replayable else 0.0
+    return {
+        "requests": len(replayable),
+        "span_seconds": round(span, 4),
+        "outcomes": outcomes,
+        "latency_seconds": percentiles([r["total_ms"] / 1000.0 for r in replayable
+                                        if r.get("outcome") == "success" and "total_ms" in r])
+    }
+
+
+def run_replay(options):
+    records = load_trace(options.trace)
+    upstream = process = cache_dir = None
+    if options.mock:
+        upstream = MockUpstream(latency=options.latency / 1000.0, jitter=options.jitter / 1000.0,
+                                per_char=options.per_char / 1000.0, seed=options.seed)
+        port = free_port()
+        cache_dir = tempfile.TemporaryDirectory(prefix="tts_replay_cache_")
+        process, _ = start_server(options.server_mode, upstream.start(), port, options, cache_dir.name)
+        host = "127.0.0.1"
+    else:
+        url = urlparse(options.url)
+        host, port = url.hostname, url.port or 80
+
+    try:
+        started = time.perf_counter()
+        results = replay(host, port, records, options)
+        wall = time.perf_counter() - started
+        server_metrics = fetch_metrics(port)
+    finally:
+        if process is not None:
+            stop_server(process, port)
+            upstream.stop()
+            cache_dir.cleanup()
+
+    return {
+        "recorded": recorded_summary(records),
+        "replayed": {
+            "speed": options.speed,
+            "sent": len(records) - results["skipped"],
+            "skipped": results["skipped"],
+            "statuses": results["statuses"],
+            "connection_failures": results["failures"],
+            "bytes_received": results["bytes"],
+            "wall_seconds": round(wall, 4),
+            "latency_seconds": percentiles(results["latency"]),
+            "schedule_lateness_seconds": percentiles(results["lateness"])
+        },
+        "upstream": dict(upstream.counts) if upstream is not None else None,
+        "server_metrics": server_metrics
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Replay a fish_audio_tts.py --trace file against a server",
+                                     epilog="Extra fish_audio_tts.py arguments for the --mock server go after '--'")
+    parser.add_argument("trace", nargs="+", help="Trace file(s); files from several workers are merged")
+    parser.add_argument("--url", default="http://127.0.0.1:5678", help="Server to replay against")
+    parser.add_argument("--mock", action="store_true",
+                        help="Start a server against a local mock Fish Audio API instead of using --url")
+    parser.add_argument("--server-mode", default="asyncio", help="Server mode with --mock (threading, asyncio)")
+    parser.add_argument("--no-cache", action="store_true", help="Run the --mock server without its audio cache")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed: 1 keeps the recorded pacing, 2 is twice as fast, 0 sends back to back")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Most requests outstanding at once")
+    parser.add_argument("--api-key", default=None, help="API key sent with every request (traces hold none)")
+    parser.add_argument("--latency", type=float, default=200.0, help="Mock upstream base latency (ms)")
+    parser.add_argument("--jitter", type=float, default=50.0, help="Mock upstream latency jitter, +/- (ms)")
+    parser.add_argument("--per-char", type=float, default=2.0, help="Mock upstream latency per character (ms)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request (s)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the mock")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file instead of stdout")
+    # Split by hand: a REMAINDER positional would swallow options given after the trace files
+    server_args = []
+    if "--" in argv:
+        argv, server_args = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    options = parser.parse_args(argv)
+    options.server_args = server_args
+    return options
+
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    sys.stderr.write(f"[Replay] {', '.join(options.trace)} at speed {options.speed}\n")
+    sys.stderr.flush()
+    text = json.dumps(run_replay(options), indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
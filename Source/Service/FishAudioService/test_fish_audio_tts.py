@@ -0,0 +1,765 @@
+"""
+Tests for fish_audio_tts.py
+
+Synthesis runs against benchmark_tts.MockUpstream, so no network access or
+API key is needed:
+    python -m pytest -q test_fish_audio_tts.py
+"""
+
+import io
+import os
+import json
+import time
+import select
+import asyncio
+import threading
+import contextlib
+import http.client
+
+import pytest
+
+import fish_audio_tts as tts
+from benchmark_tts import MockUpstream, free_port
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+needs_numpy = pytest.mark.skipif(np is None, reason="numpy is not installed")
+
+LINE = "The colonist hauls steel to the stockpile. Raiders gather near the northern hills tonight."
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sdk():
+    tts.deferred_imports.wait()
+
+
+@pytest.fixture
+def make_backend():
+    """Start a TTSBackend (and its MockUpstream) per call; both are stopped after the test"""
+    started = []
+
+    def make(upstream=None, **kwargs):
+        upstream = upstream or MockUpstream(latency=0.0, jitter=0.0, audio_per_char=0.01, seed=1)
+        kwargs.setdefault("scheduler", tts.UpstreamScheduler(max_retries=0))
+        backend = tts.TTSBackend(base_url=upstream.start(), **kwargs)
+        backend.start()
+        started.append((upstream, backend))
+        return backend, upstream
+
+    yield make
+    for upstream, backend in started:
+        backend.stop()
+        upstream.stop()
+
+
+def headers(**fields):
+    lines = "".join(f"{name.replace('_', '-')}: {value}\r\n" for name, value in fields.items())
+    return http.client.parse_headers(io.BytesIO((lines + "\r\n").encode()))
+
+
+def post(backend, payload, target="/", **header_fields):
+    """Run one POST through TTSBackend.dispatch; returns (HttpResponse, decoded JSON body or None)"""
+    response = backend.run(backend.dispatch("POST", target, headers(**header_fields), json.dumps(payload).encode()), timeout=30)
+    body = json.loads(response.body) if response.content_type == "application/json" and response.body else None
+    return response, body
+
+
+def tts_request(text=LINE, **fields):
+    return dict({"api_key": "test-key", "reference_id": "voice-1", "text": text}, **fields)
+
+
+@needs_numpy
+def test_split_failure_skips_postprocessing(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=0.0, jitter=0.0, error_rate=1.0))
+    response, body = post(backend, tts_request(split={"max_chars": 40}, postprocess={"trim_silence": True}))
+    assert response.status == 400
+    assert body["success"] is False
+    assert "audio_bytes" not in body["error"]
+
+
+@needs_numpy
+def test_split_failure_keeps_circuit_state(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=0.0, jitter=0.0, error_rate=1.0),
+                              breaker=tts.CircuitBreaker(failure_threshold=1, reset_timeout=30.0))
+    post(backend, tts_request(text="Opens the circuit."))
+    for target in ("/", "/stream"):
+        response, body = post(backend, tts_request(split={"max_chars": 40}, postprocess={"trim_silence": True}), target)
+        assert response.status == 503
+        assert body["circuit_open"] is True
+        assert response.headers["X-Circuit-State"] == "open"
+        assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_scheduler_keeps_pause_of_idle_key():
+    async def scenario():
+        scheduler = tts.UpstreamScheduler(max_retries=1, backoff_base=0.0)
+        await scheduler.acquire("key")
+        delay = scheduler.retry_delay("key", 0, tts.UpstreamRateLimited(3.0))
+        scheduler.release("key")
+        assert delay == pytest.approx(3.0)
+
+        # The key is idle with a full bucket, but its Retry-After pause still holds back new calls
+        assert scheduler.stats()["keys"] == 1
+        waiter = asyncio.ensure_future(scheduler.acquire("key"))
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = tts.AudioCache(str(tmp_path), max_bytes=300, memory_bytes=0)
+    for key in ("aa01", "bb02", "cc03"):
+        cache.put(key, key.encode() * 25)
+    assert cache.get("aa01") == b"aa01" * 25
+    cache.put("dd04", b"dd04" * 25)
+
+    assert not cache.contains("bb02")
+    assert not (tmp_path / "bb" / "bb02.wav").exists()
+    assert all(cache.contains(key) for key in ("aa01", "cc03", "dd04"))
+    assert cache.stats()["bytes"] == 300
+    # Larger than the whole cache: not stored at all
+    cache.put("ee05", b"x" * 301)
+    assert not cache.contains("ee05") and cache.contains("aa01")
+
+
+def test_cache_hot_tier_holds_recent_entries(tmp_path):
+    cache = tts.AudioCache(str(tmp_path), max_bytes=1000, memory_bytes=150)
+    cache.put("aa01", b"a" * 100)
+    cache.put("bb02", b"b" * 100)
+    stats = cache.stats()
+    assert (stats["entries"], stats["memory_entries"], stats["memory_bytes"]) == (2, 1, 100)
+
+    # A disk hit moves the entry into the hot tier, pushing the other one out
+    (tmp_path / "bb" / "bb02.wav").unlink()
+    assert cache.get("aa01") == b"a" * 100
+    assert cache.get("bb02") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["memory_entries"]) == (1, 1, 1)
+
+
+def test_cache_restores_lru_order_from_disk(tmp_path):
+    cache = tts.AudioCache(str(tmp_path), max_bytes=1000)
+    for age, key in enumerate(("aa01", "bb02", "cc03")):
+        cache.put(key, b"x" * 100)
+        os.utime(tmp_path / key[:2] / f"{key}.wav", (1000 + age, 1000 + age))
+    (tmp_path / "aa" / "aa01.wav.123.tmp").write_bytes(b"partial")
+
+    reloaded = tts.AudioCache(str(tmp_path), max_bytes=250)
+    assert not reloaded.contains("aa01")
+    assert reloaded.contains("bb02") and reloaded.contains("cc03")
+    assert not (tmp_path / "aa" / "aa01.wav.123.tmp").exists()
+
+
+def test_batch_keeps_line_order_and_reports_failures_per_line(make_backend):
+    # Upstream time grows with the text, so the long first line finishes last
+    backend, _ = make_backend(MockUpstream(latency=0.0, jitter=0.0, per_char=0.004, audio_per_char=0.01))
+    lines = [{"text": LINE * 2}, {"text": "Short line."}, {"text": ""}, {"text": "Another short line."}]
+
+    async def collect(ordered):
+        result, results = await backend.open_batch({**tts_request(), "lines": lines, "ordered": ordered})
+        assert result == {"success": True, "count": 4}
+        return [line async for line in results]
+
+    for ordered in (True, False):
+        results = backend.run(collect(ordered), timeout=30)
+        if ordered:
+            assert [result["index"] for result in results] == [0, 1, 2, 3]
+        else:
+            assert results[-1]["index"] == 0
+        by_index = {result["index"]: result for result in results}
+        assert [by_index[i]["success"] for i in range(4)] == [True, True, False, True]
+        assert by_index[2]["error"]
+
+
+def test_identical_requests_share_one_upstream_call(make_backend):
+    backend, upstream = make_backend(MockUpstream(latency=0.2, jitter=0.0, audio_per_char=0.01))
+
+    async def scenario():
+        return await asyncio.gather(*(backend.synthesize(tts_request()) for _ in range(3)))
+
+    results = backend.run(scenario(), timeout=30)
+    assert upstream.counts["requests"] == 1
+    assert all(result["success"] for result in results)
+    assert len({result["audio_bytes"] for result in results}) == 1
+    assert sum(1 for result in results if result.get("coalesced")) == 2
+
+
+def test_cancelled_waiter_leaves_shared_call_running(make_backend):
+    backend, upstream = make_backend(MockUpstream(latency=0.3, jitter=0.0, audio_per_char=0.01))
+
+    async def scenario():
+        first = asyncio.ensure_future(backend.synthesize(tts_request()))
+        second = asyncio.ensure_future(backend.synthesize(tts_request()))
+        await asyncio.sleep(0.1)
+        first.cancel()
+        return await second
+
+    result = backend.run(scenario(), timeout=30)
+    assert result["success"] and result["coalesced"]
+    assert upstream.counts["requests"] == 1
+
+
+def test_identical_request_after_cancel_starts_a_fresh_call(make_backend):
+    backend, upstream = make_backend(MockUpstream(latency=0.3, jitter=0.0, audio_per_char=0.01))
+
+    async def scenario():
+        first = asyncio.ensure_future(backend.synthesize(tts_request()))
+        await asyncio.sleep(0.1)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # The shared call is cancelled but not finished yet; this must not join it
+        return await backend.synthesize(tts_request())
+
+    result = backend.run(scenario(), timeout=30)
+    assert result["success"] and not result.get("coalesced")
+    assert upstream.counts["requests"] == 2
+
+
+def test_scheduler_serves_higher_priority_first():
+    async def scenario():
+        scheduler = tts.UpstreamScheduler(max_concurrency=1)
+        order = []
+
+        async def call(name):
+            await scheduler.acquire("key", tts.PRIORITY_LEVELS[name])
+            order.append(name)
+            scheduler.release("key")
+
+        await scheduler.acquire("key")
+        tasks = [asyncio.ensure_future(call(name)) for name in ("low", "normal", "high")]
+        await asyncio.sleep(0.05)
+        assert scheduler.stats()["queue_depth"] == 3
+        scheduler.release("key")
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "normal", "low"]
+
+
+def test_scheduler_token_bucket_limits_rate():
+    async def scenario():
+        scheduler = tts.UpstreamScheduler(rate=10.0, burst=2)
+        started = asyncio.get_running_loop().time()
+        waits = []
+        for _ in range(4):
+            await scheduler.acquire("key")
+            waits.append(asyncio.get_running_loop().time() - started)
+            scheduler.release("key")
+        return waits
+
+    waits = asyncio.run(scenario())
+    # The burst goes through at once, then one call per 1/rate seconds
+    assert waits[1] < 0.05
+    assert waits[2] >= 0.08 and waits[3] >= 0.18
+
+
+def test_scheduler_dispatches_prefetch_with_a_burst_of_one():
+    async def scenario():
+        scheduler = tts.UpstreamScheduler(rate=20.0, burst=1)
+        await scheduler.acquire("key")
+        scheduler.release("key")
+        # The bucket refills to 1 token, which is all a prefetch may ever wait for
+        await asyncio.wait_for(scheduler.acquire("key", tts.PREFETCH_PRIORITY), timeout=2.0)
+        scheduler.release("key")
+
+    asyncio.run(scenario())
+
+
+def test_request_is_dropped_once_its_deadline_passes(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=1.0, jitter=0.0, audio_per_char=0.01))
+    started = time.monotonic()
+    response, body = post(backend, tts_request(deadline_ms=200))
+    assert response.status == 400
+    assert body["deadline_exceeded"] is True
+    assert time.monotonic() - started < 0.8
+
+
+def test_deadline_shorter_than_recent_latency_skips_the_upstream_call(make_backend):
+    backend, upstream = make_backend()
+    backend.latency_mode.observe(2.0)
+    # 0.5 s left is under DEADLINE_DROP_FRACTION of the 2 s calls currently take
+    response, body = post(backend, tts_request(deadline_ms=500))
+    assert response.status == 400
+    assert body["deadline_exceeded"] is True
+    assert upstream.counts["requests"] == 0
+
+    response, body = post(backend, tts_request(deadline_ms=5000))
+    assert response.status == 200 and body["success"]
+
+
+def test_latency_mode_follows_queue_depth_and_upstream_latency():
+    selector = tts.LatencyModeSelector(queue_depth=3, slow_seconds=2.0)
+    assert selector.select(queued=0) == "normal"
+    assert selector.select(queued=3) == "balanced"
+    # Stays balanced until the queue is empty
+    assert selector.select(queued=1) == "balanced"
+    assert selector.select(queued=0) == "normal"
+
+    selector.observe(3.0)
+    assert selector.select(queued=0) == "balanced"
+    # Back to normal only once latency is under half of slow_seconds
+    for _ in range(10):
+        selector.observe(0.5)
+    assert selector.expected() < 1.0
+    assert selector.select(queued=0) == "normal"
+    assert selector.switches == 4
+
+
+def test_latency_mode_is_balanced_for_a_tight_deadline():
+    selector = tts.LatencyModeSelector(queue_depth=3, slow_seconds=5.0)
+    # No latency observed yet: the deadline alone does not decide
+    assert selector.select(queued=0, remaining=0.1) == "normal"
+    selector.observe(1.0)
+    assert selector.select(queued=0, remaining=1.5) == "balanced"
+    assert selector.select(queued=0, remaining=3.0) == "normal"
+    # A single tight request does not switch the shared mode
+    assert selector.mode == "normal" and selector.switches == 0
+
+
+def tone(seconds, sample_rate=24000, channels=1, amplitude=0.5, frequency=440.0):
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    return np.repeat((amplitude * np.sin(2 * np.pi * frequency * t))[:, None], channels, axis=1)
+
+
+@needs_numpy
+def test_postprocess_trims_downmixes_and_resamples():
+    silence = np.zeros((12000, 2), dtype=np.float32)
+    clip = tts.encode_wav(np.concatenate([silence, tone(1.0, channels=2), silence]), 24000)
+    options, error = tts.parse_postprocess_options({"trim_silence": True, "mono": True, "sample_rate": 16000})
+    assert error is None
+
+    samples, sample_rate = tts.decode_wav(tts.postprocess_audio(clip, options))
+    assert sample_rate == 16000 and samples.shape[1] == 1
+    # One second of tone plus at most the trim padding on either side
+    assert 1.0 <= len(samples) / sample_rate <= 1.0 + 2 * tts.TRIM_PADDING + 0.02
+
+
+@needs_numpy
+def test_postprocess_normalizes_loudness_under_peak_ceiling():
+    clip = tts.encode_wav(tone(1.0, amplitude=0.05), 24000)
+    options, _ = tts.parse_postprocess_options({"target_rms_db": -20.0})
+    samples, sample_rate = tts.decode_wav(tts.postprocess_audio(clip, options))
+    assert tts.active_rms_db(samples, sample_rate, -50.0) == pytest.approx(-20.0, abs=0.5)
+
+    options, _ = tts.parse_postprocess_options({"target_lufs": 0.0})
+    samples, _ = tts.decode_wav(tts.postprocess_audio(clip, options))
+    assert np.abs(samples).max() <= tts._db_to_gain(tts.PEAK_CEILING_DB) + 1e-3
+
+
+def test_postprocess_options_are_validated():
+    assert tts.parse_postprocess_options(None) == (None, None)
+    assert tts.parse_postprocess_options({"mono": False}) == (None, None)
+    assert "Unknown" in tts.parse_postprocess_options({"reverb": 1})[1]
+    assert "sample_rate" in tts.parse_postprocess_options({"sample_rate": 1000})[1]
+
+
+def test_split_text_prefers_sentence_boundaries():
+    text = "First sentence is here. Second one, with a clause, follows! Version 3.5 stays whole? Yes."
+    segments = tts.split_text(text, 40)
+    assert all(len(segment) <= 40 for segment in segments)
+    assert segments[0] == "First sentence is here."
+    # Short sentences are packed together; "3.5" is not a sentence end
+    assert segments[2] == "Version 3.5 stays whole? Yes."
+    assert " ".join(segments) == text
+    # A single unspaced word longer than max_chars is cut mid-way
+    assert tts.split_text("あ" * 50, 20) == ["あ" * 20, "あ" * 20, "あ" * 10]
+
+
+@needs_numpy
+def test_wav_stitcher_streams_the_joined_clip():
+    segments = [tts.encode_wav(tone(0.5, amplitude=0.3), 24000), tts.encode_wav(tone(0.5, sample_rate=16000), 16000)]
+    joined = tts.WavStitcher(crossfade_ms=10).join(segments)
+    fmt, pcm = tts.parse_wav(joined)
+    assert fmt == (1, 1, 24000, 16)
+    # Each join overlaps 10 ms of the two segments
+    assert len(pcm) == (24000 - 240) * 2
+
+    stitcher = tts.WavStitcher(crossfade_ms=10)
+    streamed = b"".join(stitcher.add(segment) for segment in segments) + stitcher.finish()
+    assert streamed[44:] == pcm
+
+
+def test_spool_reuses_regions_once_leases_are_released(tmp_path):
+    spool = tts.AudioSpool(str(tmp_path), max_bytes=250)
+    try:
+        first = spool.lease("a", b"a" * 100)
+        shared = spool.lease("a", b"a" * 100)
+        second = spool.lease("b", b"b" * 100)
+        assert (first["offset"], shared["offset"], second["offset"]) == (0, 0, 100)
+        with open(first["path"], "rb") as f:
+            assert f.read(200) == b"a" * 100 + b"b" * 100
+
+        # The oldest region is still leased, so there is no room to wrap around
+        assert spool.lease("c", b"c" * 100) is None
+        assert spool.release([first["lease"], "unknown"]) == 1
+        assert spool.lease("c", b"c" * 100) is None
+        assert spool.release([shared["lease"]]) == 1
+        third = spool.lease("c", b"c" * 100)
+        assert third["offset"] == 0
+        assert spool.stats()["regions"] == 2
+    finally:
+        spool.close()
+    assert not os.path.exists(first["path"])
+
+
+def test_spool_expires_unreleased_leases(tmp_path):
+    spool = tts.AudioSpool(str(tmp_path), max_bytes=100, lease_timeout=0.05)
+    try:
+        assert spool.lease("a", b"a" * 100) is not None
+        assert spool.lease("b", b"b" * 100) is None
+        time.sleep(0.1)
+        assert spool.lease("b", b"b" * 100)["offset"] == 0
+        assert spool.stats()["expired"] == 1
+    finally:
+        spool.close()
+
+
+def test_shared_cache_cap_applies_to_the_whole_directory(tmp_path):
+    workers = [tts.AudioCache(str(tmp_path), max_bytes=1000, memory_bytes=0, processes=2) for _ in range(2)]
+    for i in range(20):
+        workers[i % 2].put(f"{i:02x}{i:02x}", bytes([i]) * 100)
+    on_disk = sum(path.stat().st_size for path in tmp_path.rglob("*.wav"))
+    assert on_disk <= 1000
+    # The newest entries survive, whichever worker wrote them
+    assert workers[0].get("1313") == bytes([19]) * 100
+
+
+def test_worker_limits_add_up_to_the_configured_ones():
+    assert [tts.worker_share(5, 3, index) for index in range(3)] == [2, 2, 1]
+    options = tts.parse_args(["--max-concurrency", "3", "--rate-limit", "1", "--rate-burst", "2"])
+    assert tts.max_workers(options) == 2
+    backends = [tts.build_backend(tts.parse_args(["--no-cache", "--spool-size-mb", "0", "--max-concurrency", "5"]),
+                                  workers=3, index=index) for index in range(3)]
+    assert sum(backend.scheduler.max_concurrency for backend in backends) == 5
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    breaker = tts.CircuitBreaker(failure_threshold=2, reset_timeout=0.1, max_reset_timeout=0.3)
+    breaker.record("host", StatusError(404))
+    breaker.record("host", OSError("connection refused"))
+    breaker.check("host")
+    breaker.record("host", StatusError(502))
+    assert breaker.stats()["host"]["state"] == "open"
+    with pytest.raises(tts.UpstreamUnavailable):
+        breaker.check("host")
+
+    # After the reset timeout one probe goes through; a failed probe reopens with a longer timeout
+    time.sleep(0.12)
+    assert breaker.allow("host") is True
+    with pytest.raises(tts.UpstreamUnavailable):
+        breaker.allow("host")
+    breaker.record("host", StatusError(500), probe=True)
+    assert breaker.stats()["host"]["state"] == "open"
+    time.sleep(0.12)
+    with pytest.raises(tts.UpstreamUnavailable):
+        breaker.check("host")
+
+    # Any response to the probe, even a 4xx, closes the circuit
+    time.sleep(0.2)
+    assert breaker.allow("host") is True
+    breaker.record("host", StatusError(401), probe=True)
+    assert breaker.stats() == {} and breaker.allow("host") is False
+
+
+def test_open_circuit_answers_503_without_calling_upstream(make_backend):
+    backend, upstream = make_backend(MockUpstream(latency=0.0, jitter=0.0, error_rate=1.0),
+                                     breaker=tts.CircuitBreaker(failure_threshold=2, reset_timeout=30.0))
+    for i in range(2):
+        response, _ = post(backend, tts_request(text=f"Line number {i}."))
+        assert response.status == 400
+    response, body = post(backend, tts_request(text="Line number 2."))
+    assert response.status == 503 and body["circuit_open"] is True
+    assert upstream.counts["requests"] == 2
+
+
+def test_negative_cache_remembers_auth_and_voice_failures():
+    cache = tts.NegativeCache(ttl=0.1)
+    job = tts.SynthesisJob(tts_request())
+    other_voice = tts.SynthesisJob(tts_request(reference_id="voice-2"))
+    other_key = tts.SynthesisJob(tts_request(api_key="other-key"))
+
+    cache.put(job, StatusError(500), "server error")
+    assert cache.get(job) is None
+    cache.put(job, StatusError(404), "unknown voice")
+    assert cache.get(job) == "unknown voice"
+    assert cache.get(other_voice) is None
+
+    cache.put(job, StatusError(401), "invalid key")
+    assert cache.get(other_voice) == "invalid key"
+    assert cache.get(other_key) is None
+    time.sleep(0.12)
+    assert cache.get(job) is None and cache.stats()["entries"] == 0
+
+
+def test_trace_redacts_api_keys_and_text(make_backend, tmp_path):
+    path = tmp_path / "trace.jsonl"
+    trace = tts.TraceRecorder(str(path))
+    trace.start(server_mode="threading")
+    backend, _ = make_backend(trace=trace)
+    port = free_port()
+    httpd = tts.create_http_server("threading", ("127.0.0.1", port), backend)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    secret_key, secret_text = "sk-private-0123456789", "Meet me behind the freezer at midnight."
+
+    def send(target, payload):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            connection.request("POST", target, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    try:
+        assert send("/", {**tts_request(text=secret_text), "api_key": secret_key}) == 200
+        assert send("/batch", {**tts_request(), "api_key": secret_key,
+                               "lines": [{"text": secret_text}, {"text": "Second line."}]}) == 200
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    trace.close()
+
+    content = path.read_text(encoding="utf-8")
+    assert secret_key not in content and "test-key" not in content
+    assert secret_text not in content and "freezer" not in content
+    start, single, batch = [json.loads(line) for line in content.splitlines()]
+    assert start["type"] == "start"
+    assert single["text_chars"] == len(secret_text) and len(single["key_id"]) == 8
+    assert [line["text_chars"] for line in batch["lines"]] == [len(secret_text), len("Second line.")]
+    assert batch["lines"][0]["params_hash"] == single["params_hash"]
+
+
+def test_encode_phase_is_recorded_for_json_and_binary_responses(make_backend):
+    backend, _ = make_backend()
+    response, body = post(backend, tts_request())
+    assert response.status == 200 and body["success"]
+    response, _ = post(backend, tts_request(), Accept="audio/wav")
+    assert response.status == 200 and response.content_type == "audio/wav"
+    assert backend.metrics.snapshot()["latency_seconds"]["encode"]["count"] == 2
+
+
+def test_cancel_by_request_id_over_http(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=1.0, jitter=0.0, audio_per_char=0.01))
+    port = free_port()
+    httpd = tts.create_http_server("threading", ("127.0.0.1", port), backend)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    def send(payload):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            connection.request("POST", "/", body=json.dumps(payload), headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    try:
+        answer = []
+        started = time.monotonic()
+        line = threading.Thread(target=lambda: answer.append(send(tts_request(request_id="line-1"))))
+        line.start()
+        time.sleep(0.2)
+        assert send({"command": "cancel", "request_id": "line-1"}) == (200, {"success": True, "cancelled": True})
+        line.join(5)
+        status, body = answer[0]
+        assert status == 400 and body["cancelled"] is True
+        assert time.monotonic() - started < 1.0
+        # Unknown or finished requests are reported, not an error
+        assert send({"command": "cancel", "request_id": "line-1"}) == (200, {"success": True, "cancelled": False})
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def request_frame(method, target, body=b"", headers=()):
+    head = "\r\n".join([target] + [f"{name}: {value}" for name, value in headers]).encode()
+    return tts.STDIO_REQUEST_HEADER.pack(tts.STDIO_METHODS.index(method), len(head)) + head + body
+
+
+def read_frame(stream, timeout=10.0):
+    assert select.select([stream], [], [], timeout)[0], f"No frame within {timeout} s"
+    length, stream_id, frame_type = tts.STDIO_FRAME_HEADER.unpack(stream.read(tts.STDIO_FRAME_HEADER.size))
+    return stream_id, frame_type, stream.read(length)
+
+
+@contextlib.contextmanager
+def stdio_session(backend):
+    """Serve backend through a StdioTransport on pipes; yields (transport, request writer, response reader)"""
+    in_read, in_write = os.pipe()
+    out_read, out_write = os.pipe()
+    transport = tts.StdioTransport(backend, os.fdopen(in_read, "rb", buffering=0), os.fdopen(out_write, "wb"))
+    server = threading.Thread(target=transport.serve_forever, daemon=True)
+    server.start()
+    requests = os.fdopen(in_write, "wb")
+    responses = os.fdopen(out_read, "rb")
+    try:
+        yield transport, requests, responses
+    finally:
+        requests.close()
+        server.join(5)
+        transport.server_close()
+        responses.close()
+    assert not server.is_alive()
+
+
+def response_json(payload):
+    """Status and JSON body of a RESPONSE frame payload"""
+    status, _, head_length = tts.STDIO_RESPONSE_HEADER.unpack_from(payload)
+    return status, json.loads(payload[tts.STDIO_RESPONSE_HEADER.size + head_length:])
+
+
+def test_stdio_request_parsing():
+    method, target, headers, body = tts.StdioTransport._parse_request(
+        request_frame("POST", "/stream?x=1", b'{"a": 1}', [("Accept", "audio/wav"), ("X-Request-Id", "r1")]))
+    assert (method, target, body) == ("POST", "/stream?x=1", b'{"a": 1}')
+    assert headers.get("accept") == "audio/wav" and headers.get("x-request-id") == "r1"
+    assert tts.StdioTransport._parse_request(request_frame("GET", "/status"))[:2] == ("GET", "/status")
+
+    for payload, message in ((b"\x01", "Truncated"), (b"\x07\x00\x00", "Unknown method"),
+                             (tts.STDIO_REQUEST_HEADER.pack(1, 50) + b"/", "past the end")):
+        with pytest.raises(ValueError, match=message):
+            tts.StdioTransport._parse_request(payload)
+
+
+def test_stdio_transport_multiplexes_streams(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=0.3, jitter=0.0, audio_per_char=0.01))
+    with stdio_session(backend) as (_, requests, responses):
+        tts.write_frame(requests, 1, tts.FRAME_REQUEST, request_frame("POST", "/", json.dumps(tts_request()).encode()))
+        tts.write_frame(requests, 2, tts.FRAME_REQUEST, request_frame("GET", "/status"))
+        tts.write_frame(requests, 3, tts.FRAME_REQUEST, request_frame("POST", "/stream", json.dumps(tts_request()).encode()))
+        tts.write_frame(requests, 4, tts.FRAME_REQUEST, b"\x09")
+        tts.write_frame(requests, 5, tts.FRAME_REQUEST, request_frame("POST", "/", json.dumps(tts_request(text="Cancelled.")).encode()))
+        tts.write_frame(requests, 5, tts.FRAME_CANCEL)
+
+        frames = {}
+        order = []
+        while not (all(stream_id in frames for stream_id in (1, 2, 4, 5)) and tts.FRAME_END in [t for t, _ in frames.get(3, [])]):
+            stream_id, frame_type, payload = read_frame(responses)
+            order.append(stream_id)
+            frames.setdefault(stream_id, []).append((frame_type, payload))
+
+        # The quick requests are answered while the synthesis is still running
+        assert order.index(2) < order.index(1) and order.index(4) < order.index(1)
+        status, flags, head_length = tts.STDIO_RESPONSE_HEADER.unpack_from(frames[2][0][1])
+        assert (frames[2][0][0], status, flags) == (tts.FRAME_RESPONSE, 200, 0)
+        assert json.loads(frames[2][0][1][tts.STDIO_RESPONSE_HEADER.size + head_length:])["success"]
+        assert tts.STDIO_RESPONSE_HEADER.unpack_from(frames[4][0][1])[0] == 400
+        status, _, head_length = tts.STDIO_RESPONSE_HEADER.unpack_from(frames[5][0][1])
+        assert status == 400 and json.loads(frames[5][0][1][tts.STDIO_RESPONSE_HEADER.size + head_length:])["cancelled"]
+
+        # /stream: RESPONSE with the MORE flag, DATA chunks and an empty END
+        kinds = [frame_type for frame_type, _ in frames[3]]
+        assert kinds[0] == tts.FRAME_RESPONSE and kinds[-1] == tts.FRAME_END and set(kinds[1:-1]) == {tts.FRAME_DATA}
+        assert tts.STDIO_RESPONSE_HEADER.unpack_from(frames[3][0][1])[1] == tts.STDIO_RESPONSE_MORE
+        assert frames[3][-1][1] == b""
+        audio = b"".join(payload for frame_type, payload in frames[3] if frame_type == tts.FRAME_DATA)
+        assert audio[:4] == b"RIFF"
+
+
+def test_stdio_cancel_frame_before_and_after_start(make_backend):
+    backend, upstream = make_backend(MockUpstream(latency=1.0, jitter=0.0, audio_per_char=0.01))
+    started = time.monotonic()
+    with stdio_session(backend) as (transport, requests, responses):
+        # Stream 1 is cancelled before its task has run a single step: both frames are
+        # handled in one pass of the event loop, as when they arrive back to back
+        first = request_frame("POST", "/", json.dumps(tts_request(text="First.")).encode())
+        backend.loop_thread.loop.call_soon_threadsafe(
+            lambda: (transport._on_frame(1, tts.FRAME_REQUEST, first), transport._on_frame(1, tts.FRAME_CANCEL, b"")))
+        # Stream 2 is cancelled while it waits for upstream
+        tts.write_frame(requests, 2, tts.FRAME_REQUEST, request_frame("POST", "/", json.dumps(tts_request(text="Second.")).encode()))
+        time.sleep(0.2)
+        tts.write_frame(requests, 2, tts.FRAME_CANCEL)
+
+        answers = {}
+        while len(answers) < 2:
+            stream_id, frame_type, payload = read_frame(responses)
+            assert frame_type == tts.FRAME_RESPONSE
+            answers[stream_id] = response_json(payload)
+    for status, body in answers.values():
+        assert status == 400 and body["cancelled"] is True
+    assert time.monotonic() - started < 1.0
+    assert upstream.counts["ok"] == 0
+
+
+def test_stdio_cancel_command_by_request_id(make_backend):
+    backend, _ = make_backend(MockUpstream(latency=1.0, jitter=0.0, audio_per_char=0.01))
+    with stdio_session(backend) as (_, requests, responses):
+        tts.write_frame(requests, 1, tts.FRAME_REQUEST,
+                        request_frame("POST", "/", json.dumps(tts_request(request_id="line-1")).encode()))
+        time.sleep(0.2)
+        tts.write_frame(requests, 2, tts.FRAME_REQUEST,
+                        request_frame("POST", "/cancel", json.dumps({"request_id": "line-1"}).encode()))
+
+        answers = {}
+        while len(answers) < 2:
+            stream_id, _, payload = read_frame(responses)
+            answers[stream_id] = response_json(payload)
+    assert answers[2] == (200, {"success": True, "cancelled": True})
+    assert answers[1][0] == 400 and answers[1][1]["cancelled"] is True
+
+
+def test_admission_control_limits():
+    admission = tts.AdmissionControl(max_body_bytes=100, max_in_flight=2, max_buffered_bytes=1000)
+    assert admission.body_allowed(100) and not admission.body_allowed(101)
+    # A lone request is let in even when it is larger than the buffer budget
+    assert admission.acquire(1500) is None
+    assert admission.acquire(10) == "buffered_bytes"
+    admission.release(1500)
+
+    assert admission.acquire(600) is None
+    admission.hold(300)
+    assert admission.acquire(200) == "buffered_bytes"
+    assert admission.acquire(50) is None
+    assert admission.acquire(0) == "in_flight"
+    admission.release(900)
+    admission.release(50)
+    assert admission.stats()["in_flight"] == 0 and admission.stats()["buffered_bytes"] == 0
+
+
+@pytest.mark.parametrize("server_mode", ["threading", "asyncio"])
+def test_overloaded_server_answers_at_once(make_backend, server_mode):
+    backend, _ = make_backend(MockUpstream(latency=0.5, jitter=0.0, audio_per_char=0.01),
+                              admission=tts.AdmissionControl(max_body_bytes=4096, max_in_flight=1))
+    port = free_port()
+    httpd = tts.create_http_server(server_mode, ("127.0.0.1", port), backend)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    def send(method, target, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            connection.request(method, target, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, response.getheader("Retry-After"), response.read()
+        finally:
+            connection.close()
+
+    try:
+        assert send("POST", "/", b" " * 5000)[0] == 413
+        slow = threading.Thread(target=send, args=("POST", "/", json.dumps(tts_request())))
+        slow.start()
+        time.sleep(0.2)
+        status, retry_after, body = send("POST", "/", json.dumps(tts_request(text="Another line.")))
+        assert status == 503 and int(retry_after) >= 1 and json.loads(body)["overloaded"]
+        # Status and commands still get through
+        assert send("GET", "/status")[0] == 200
+        assert send("POST", "/", json.dumps({"command": "cancel", "request_id": "none"}))[0] == 200
+        slow.join(10)
+        assert send("POST", "/", json.dumps(tts_request(text="Another line.")))[0] == 200
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -73,7 +73,12 @@ namespace RimTalk.TTS.Service
             switch (supplier)
             {
                 case TTSSettings.TTSSupplier.FishAudio:
-                    return new Provider.FishAudioProvider();
+                    var fishAudioProvider = new Provider.FishAudioProvider();
+                    if (settings != null)
+                    {
+                        fishAudioProvider.SetSettings(settings);
+                    }
+                    return fishAudioProvider;
                 case TTSSettings.TTSSupplier.CosyVoice:
                     return new Provider.CosyVoiceProvider();
                 case TTSSettings.TTSSupplier.IndexTTS:
@@ -140,6 +145,13 @@ namespace RimTalk.TTS.Service
                 }
             }
 
+            // Early exit: the FishAudio server is refusing calls to a failing Fish Audio API (circuit breaker open)
+            if (settings.Supplier == TTSSettings.TTSSupplier.FishAudio && !FishAudioService.FishAudioTTSClient.IsUpstreamAvailable)
+            {
+                reason = "Fish Audio API unavailable after repeated failures";
+                return false;
+            }
+
             // Early exit: empty text
             if (string.IsNullOrEmpty(text))
             {
@@ -222,11 +234,19 @@ namespace RimTalk.TTS.Service
                     return;
                 }
 
+                var ttsRequest = BuildTTSRequest(voiceModelId, finalInputText, finalInstructText, settings);
+
+                // Let the FishAudio server render the line into its cache while it waits out the cooldown
+                if (_provider is Provider.FishAudioProvider fishAudioProvider && settings.GetSupplierGenerateCooldown(settings.Supplier) > 0)
+                {
+                    _ = fishAudioProvider.PrefetchAsync(ttsRequest);
+                }
+
                 // Apply cooldown
                 await ApplyCooldownAsync(settings);
                 
                 // Generate speech
-                byte[] audioData = await GenerateSpeechAsync(voiceModelId, finalInputText, finalInstructText, settings);
+                byte[] audioData = await _provider.GenerateSpeechAsync(ttsRequest);
 
                 // Final validation and playback setup
                 HandleGenerationResult(dialogueId, audioData, settings);
@@ -296,11 +316,11 @@ namespace RimTalk.TTS.Service
         }
 
         /// <summary>
-        /// Generate speech using configured provider
+        /// Build the request for the configured provider
         /// </summary>
-        private static async Task<byte[]> GenerateSpeechAsync(string voiceModelId, string inputText, string instructText, TTSSettings settings)
+        private static Service.TTSRequest BuildTTSRequest(string voiceModelId, string inputText, string instructText, TTSSettings settings)
         {
-            var ttsRequest = new Service.TTSRequest
+            return new Service.TTSRequest
             {
                 ApiKey = settings.GetSupplierApiKey(settings.Supplier),
                 Model = settings.GetSupplierModel(settings.Supplier),
@@ -312,8 +332,6 @@ namespace RimTalk.TTS.Service
                 Temperature = settings.GetSupplierTemperature(settings.Supplier),
                 TopP = settings.GetSupplierTopP(settings.Supplier)
             };
-
-            return await _provider.GenerateSpeechAsync(ttsRequest);
         }
 
         /// <summary>
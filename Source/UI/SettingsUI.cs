@@ -203,6 +203,57 @@ namespace RimTalk.TTS.UI
                     {
                         settings.SetSupplierModel(settings.Supplier, "s1");
                     }
+
+                    listing.Gap(6f);
+                    bool currentStdio = settings.FishAudioUseStdioTransport;
+                    listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioUseStdioTransport".Translate(), ref settings.FishAudioUseStdioTransport, "RimTalk.Settings.TTS.FishAudioUseStdioTransportTooltip".Translate());
+                    if (settings.FishAudioUseStdioTransport != currentStdio)
+                    {
+                        // The transport is fixed when the server starts
+                        TTSService.SetProvider(settings.Supplier, settings);
+                    }
+
+                    bool currentWarmUp = settings.FishAudioWarmUpOnStart;
+                    listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioWarmUpOnStart".Translate(), ref settings.FishAudioWarmUpOnStart, "RimTalk.Settings.TTS.FishAudioWarmUpOnStartTooltip".Translate());
+                    if (settings.FishAudioWarmUpOnStart != currentWarmUp)
+                    {
+                        TTSService.SetProvider(settings.Supplier, settings);
+                    }
+
+                    // A stdio server is a single process without an HTTP front end
+                    if (!settings.FishAudioUseStdioTransport)
+                    {
+                        bool currentAsyncio = settings.FishAudioUseAsyncioServer;
+                        listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioUseAsyncioServer".Translate(), ref settings.FishAudioUseAsyncioServer, "RimTalk.Settings.TTS.FishAudioUseAsyncioServerTooltip".Translate());
+                        if (settings.FishAudioUseAsyncioServer != currentAsyncio)
+                        {
+                            TTSService.SetProvider(settings.Supplier, settings);
+                        }
+
+                        // The server clamps larger counts, so never offer or show them
+                        int maxWorkers = FishAudioService.FishAudioTTSClient.MaxServerWorkers;
+                        int currentWorkers = Mathf.Min(settings.FishAudioServerWorkers, maxWorkers);
+                        listing.Label("RimTalk.Settings.TTS.FishAudioServerWorkers".Translate(currentWorkers.ToString(), maxWorkers.ToString()), -1f, "RimTalk.Settings.TTS.FishAudioServerWorkersTooltip".Translate());
+                        int newWorkers = currentWorkers;
+                        listing.IntAdjuster(ref newWorkers, 1, 1);
+                        newWorkers = Mathf.Min(newWorkers, maxWorkers);
+                        if (newWorkers != settings.FishAudioServerWorkers)
+                        {
+                            settings.FishAudioServerWorkers = newWorkers;
+                            // The worker count is fixed when the server starts
+                            TTSService.SetProvider(settings.Supplier, settings);
+                        }
+                    }
+
+                    listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioAdaptiveLatency".Translate(), ref settings.FishAudioAdaptiveLatency, "RimTalk.Settings.TTS.FishAudioAdaptiveLatencyTooltip".Translate());
+                    listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioUseSpoolHandoff".Translate(), ref settings.FishAudioUseSpoolHandoff, "RimTalk.Settings.TTS.FishAudioUseSpoolHandoffTooltip".Translate());
+                    listing.CheckboxLabeled("RimTalk.Settings.TTS.FishAudioSplitLongLines".Translate(), ref settings.FishAudioSplitLongLines, "RimTalk.Settings.TTS.FishAudioSplitLongLinesTooltip".Translate());
+
+                    int currentDeadline = settings.FishAudioRequestDeadlineMs;
+                    listing.Label("RimTalk.Settings.TTS.FishAudioRequestDeadline".Translate(currentDeadline > 0 ? currentDeadline.ToString() : "RimTalk.Settings.TTS.FishAudioRequestDeadlineOff".Translate().ToString()), -1f, "RimTalk.Settings.TTS.FishAudioRequestDeadlineTooltip".Translate());
+                    int newDeadline = (int)listing.Slider(currentDeadline, 0, 30000);
+                    if (newDeadline != currentDeadline)
+                        settings.FishAudioRequestDeadlineMs = newDeadline;
                 }
 
                 // CosyVoice model selection